@@ -0,0 +1 @@
+"""Timing harness for the Timecard backends; run with ``python -m benchmarks``."""
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import datetime as dt
+import random
+import sqlite3
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List
+
+from timecard import xml_data
+from timecard.data import Activity, Project, Timeslot
+from timecard.mmap_database import Timecard as MmapTimecard
+from timecard.sqlite_database import Timecard as SqliteTimecard
+from timecard.sync import DeltaSync
+from timecard.xml_database import Timecard as XmlTimecard
+
+MESSAGES = ('', '', '', 'standup', 'code review', 'field prep', 'data upload',
+            'writing docs', 'debugging firmware', 'lab meeting', 'reading papers')
+ACTIVITY_WEIGHTS = {
+    Activity.Development: 6,
+    Activity.Meetings: 2,
+    Activity.Planning: 1,
+    Activity.Support: 1
+}
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    projects: int = 50
+    years: int = 5
+    slotsPerDay: int = 10
+    seed: int = 0
+    start: dt.date = dt.date(2019, 1, 1)
+
+    @property
+    def end(self) -> dt.date:
+        return self.start + dt.timedelta(days=365 * self.years)
+
+    def toDict(self) -> Dict[str, Any]:
+        return dict(asdict(self), start=self.start.isoformat())
+
+
+@dataclass
+class Dataset:
+    spec: DatasetSpec
+    projects: List[Project]
+    timeslots: List[Timeslot]
+
+
+def generate(spec: DatasetSpec) -> Dataset:
+    """Build the same projects and timeslots for the same spec every time.
+
+    Each day has ``slotsPerDay`` back-to-back slots of 10-60 minutes with
+    short breaks, starting around 8 am.  A few projects get most of the
+    time, as in a real lab.
+    """
+    rng = random.Random(spec.seed)
+
+    def uid() -> uuid.UUID:
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+    projects = [Project(name=f'PROJ{i:03d}', desc=f'Synthetic project {i}', uid=uid())
+                for i in range(spec.projects)]
+    projectWeights = [1 / (i + 1) for i in range(spec.projects)]
+    activities = list(ACTIVITY_WEIGHTS)
+    activityWeights = list(ACTIVITY_WEIGHTS.values())
+
+    timeslots: List[Timeslot] = []
+    day = spec.start
+    while day < spec.end:
+        cursor = dt.datetime.combine(day, dt.time(8)) + dt.timedelta(minutes=rng.randrange(60))
+        for _ in range(spec.slotsPerDay):
+            length = dt.timedelta(minutes=rng.randrange(10, 61))
+            timeslots.append(Timeslot(
+                project=rng.choices(projects, projectWeights)[0],
+                startTime=cursor,
+                endTime=cursor + length,
+                activity=rng.choices(activities, activityWeights)[0],
+                uid=uid(),
+                msg=rng.choice(MESSAGES)))
+            cursor += length + dt.timedelta(minutes=rng.randrange(0, 16))
+        day += dt.timedelta(days=1)
+    return Dataset(spec=spec, projects=projects, timeslots=timeslots)
+
+
+def writeXml(dataset: Dataset, path: Path) -> None:
+    with open(path, 'w') as f:
+        XmlTimecard._writeXml(f,
+                              (project.toDict() for project in dataset.projects),
+                              (timeslot.toDict() for timeslot in dataset.timeslots))
+
+
+def writeLegacyXml(dataset: Dataset, path: Path) -> None:
+    legacy = xml_data.Timecard(path.as_posix())
+    projects = {}
+    for project in dataset.projects:
+        projects[project.uid] = xml_data.Project(project.name, project.desc, project.uid.hex)
+        legacy.addProject(projects[project.uid])
+    for timeslot in dataset.timeslots:
+        project = timeslot.getProject()
+        activity = timeslot.getActivity()
+        assert isinstance(project, Project) and activity is not None
+        legacy._timeslots.append(xml_data.Timeslot(
+            startTime=timeslot.getStartTime(),
+            endTime=timeslot.getEndTime(),
+            project=projects[project.uid],
+            activity=xml_data.Activity(activity.value),
+            uuidHex=timeslot.uid.hex,
+            msg=timeslot.getMsg()))
+    legacy.flush()
+
+
+def writeSqlite(dataset: Dataset, path: Path) -> None:
+    with SqliteTimecard(path.as_posix()) as tc:
+        tc.importRecords([(XmlTimecard.PROJECT_TAG, project.toDict()) for project in dataset.projects] +
+                         [(XmlTimecard.TIMESLOT_TAG, timeslot.toDict()) for timeslot in dataset.timeslots])
+    conn = sqlite3.connect(path.as_posix())
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+
+def writeMmap(dataset: Dataset, path: Path) -> None:
+    with MmapTimecard(path.as_posix()) as tc:
+        tc.importRecords([(XmlTimecard.PROJECT_TAG, project.toDict()) for project in dataset.projects] +
+                         [(XmlTimecard.TIMESLOT_TAG, timeslot.toDict()) for timeslot in dataset.timeslots])
+
+
+def firebaseTree(dataset: Dataset, updated: int = 1) -> Dict[str, Any]:
+    """The user subtree the Firebase backend would have written."""
+    return {
+        'initialized': True,
+        'projects': {project.uid.hex: dict(project.toDict(), **{DeltaSync.FIELD: updated})
+                     for project in dataset.projects},
+        'timeslots': {timeslot.uid.hex: dict(timeslot.toDict(), **{DeltaSync.FIELD: updated})
+                      for timeslot in dataset.timeslots}
+    }
@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import gc
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+import timecard
+from benchmarks.dataset import (Dataset, DatasetSpec, firebaseTree, generate,
+                                writeLegacyXml, writeMmap, writeSqlite, writeXml)
+from timecard import xml_data
+from timecard.data import Activity
+
+RESULT_VERSION = 1
+Results = Dict[str, Dict[str, Dict[str, Any]]]
+
+
+class Backend(ABC):
+    """Adapter giving every Timecard implementation the same benchmark hooks."""
+
+    name = ''
+
+    @abstractmethod
+    def prepare(self, dataset: Dataset, workdir: Path) -> None:
+        pass
+
+    @abstractmethod
+    def open(self) -> Any:
+        pass
+
+    def project(self, tc: Any) -> Any:
+        return tc.getProjects()['PROJ000']
+
+    def activity(self) -> Any:
+        return Activity.Development
+
+    def flush(self, tc: Any) -> None:
+        tc.flush()
+
+    def close(self, tc: Any) -> None:
+        tc.close()
+
+    def cleanup(self) -> None:
+        pass
+
+
+class XmlBackend(Backend):
+    name = 'xml'
+
+    def __init__(self, columnar: bool = False):
+        self.columnar = columnar
+        if columnar:
+            self.name = 'xml-columnar'
+
+    def prepare(self, dataset: Dataset, workdir: Path) -> None:
+        self.path = workdir.joinpath(f'{self.name}.xml')
+        writeXml(dataset, self.path)
+
+    def open(self) -> Any:
+        from timecard.xml_database import Timecard
+        return Timecard(self.path.as_posix(), columnar=self.columnar)
+
+
+class LegacyXmlBackend(Backend):
+    name = 'legacy-xml'
+
+    def prepare(self, dataset: Dataset, workdir: Path) -> None:
+        self.path = workdir.joinpath('legacy.xml')
+        writeLegacyXml(dataset, self.path)
+
+    def open(self) -> Any:
+        return xml_data.Timecard(self.path.as_posix())
+
+    def activity(self) -> Any:
+        return xml_data.Activity.Development
+
+    def flush(self, tc: Any) -> None:
+        # stop() already rewrites the whole file.
+        pass
+
+    def close(self, tc: Any) -> None:
+        # close() would rewrite the file; nothing changed since open.
+        pass
+
+
+class SqliteBackend(Backend):
+    name = 'sqlite'
+
+    def prepare(self, dataset: Dataset, workdir: Path) -> None:
+        self.path = workdir.joinpath('timecard.db')
+        writeSqlite(dataset, self.path)
+
+    def open(self) -> Any:
+        from timecard.sqlite_database import Timecard
+        return Timecard(self.path.as_posix())
+
+    def flush(self, tc: Any) -> None:
+        # stop() commits.
+        pass
+
+
+class MmapBackend(Backend):
+    name = 'mmap'
+
+    def prepare(self, dataset: Dataset, workdir: Path) -> None:
+        self.path = workdir.joinpath('timecard.dat')
+        writeMmap(dataset, self.path)
+
+    def open(self) -> Any:
+        from timecard.mmap_database import Timecard
+        return Timecard(self.path.as_posix())
+
+    def flush(self, tc: Any) -> None:
+        # stop() syncs its record.
+        pass
+
+
+class FirebaseBackend(Backend):
+    """Firebase Timecard against RealtimeDatabaseStub.
+
+    ``warm`` opens from a snapshot left by a previous run, the usual case on
+    a daily-use machine; otherwise every open downloads the whole tree.
+    """
+
+    name = 'firebase'
+    EMAIL = 'bench@example.com'
+    PASSWORD = 'benchmark'
+
+    def __init__(self, warm: bool = False, latency: float = 0.0):
+        self.warm = warm
+        self.latency = latency
+        if warm:
+            self.name = 'firebase-warm'
+
+    def prepare(self, dataset: Dataset, workdir: Path) -> None:
+        from timecard.config import Config
+        from tests.rtdb_stub import RealtimeDatabaseStub
+        configPath = workdir.joinpath('config.yaml')
+        with open(configPath, 'w') as f:
+            yaml.safe_dump({'logPath': workdir.joinpath('log.log').as_posix(),
+                            'email': self.EMAIL, 'password': self.PASSWORD}, f)
+        config = Config.instance(configPath=configPath)
+        if config.email != self.EMAIL:
+            raise RuntimeError('Config already loaded for another user')
+        self.workdir = workdir
+        self.stub = RealtimeDatabaseStub(latency=self.latency).start()
+        localId = self.stub.addUser(self.EMAIL, self.PASSWORD)
+        self.stub.set(f'data/{localId}', firebaseTree(dataset))
+        self.runs = 0
+        if self.warm:
+            self.close(self.open())
+
+    def open(self) -> Any:
+        from timecard.firebase import Timecard
+        if self.warm:
+            snapshotDir = self.workdir.joinpath('firebase-snapshot')
+        else:
+            self.runs += 1
+            snapshotDir = self.workdir.joinpath(f'firebase-snapshot-{self.runs}')
+        return Timecard(config=self.stub.config, snapshotDir=snapshotDir)
+
+    def flush(self, tc: Any) -> None:
+        if not tc.flush(timeout=30):
+            raise RuntimeError('Write queue did not drain')
+
+    def cleanup(self) -> None:
+        self.stub.stop()
+
+
+BACKENDS: Dict[str, Callable[[], Backend]] = {
+    'xml': XmlBackend,
+    'xml-columnar': lambda: XmlBackend(columnar=True),
+    'legacy-xml': LegacyXmlBackend,
+    'sqlite': SqliteBackend,
+    'mmap': MmapBackend,
+    'firebase': FirebaseBackend,
+    'firebase-warm': lambda: FirebaseBackend(warm=True)
+}
+
+
+def _summarize(runs: List[float], number: int) -> Dict[str, Any]:
+    perCall = [run / number for run in runs]
+    return {
+        'unit': 's',
+        'number': number,
+        'runs': perCall,
+        'min': min(perCall),
+        'median': statistics.median(perCall),
+        'max': max(perCall)
+    }
+
+
+def _time(fn: Callable[[], Any], repeat: int, number: int = 1) -> Dict[str, Any]:
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append(time.perf_counter() - start)
+    return _summarize(runs, number)
+
+
+def benchmarkBackend(backend: Backend, dataset: Dataset, workdir: Path,
+                     repeat: int, number: int) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    start = time.perf_counter()
+    backend.prepare(dataset, workdir)
+    results['prepare'] = _summarize([time.perf_counter() - start], 1)
+
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        tc = backend.open()
+        runs.append(time.perf_counter() - start)
+        backend.close(tc)
+    results['open'] = _summarize(runs, 1)
+
+    tc = backend.open()
+    try:
+        # Reports look at a busy day and week in the middle of the history.
+        middle = dataset.spec.start + (dataset.spec.end - dataset.spec.start) / 2
+        year, week, _ = middle.isocalendar()
+        results['dayTotals'] = _time(lambda: tc.getDayTotals(middle), repeat, number)
+        results['weekTotals'] = _time(lambda: tc.getWeekTotals(week, year), repeat, number)
+        results['dayEntries'] = _time(lambda: tc.getDayEntries(middle), repeat, number)
+        results['weekEntries'] = _time(lambda: tc.getWeekEntries(week, year), repeat, number)
+        results['lastEntry'] = _time(tc.getLastEntry, repeat, number)
+
+        project = backend.project(tc)
+        activity = backend.activity()
+        slotStart = dt.datetime.combine(dataset.spec.end, dt.time(8))
+
+        def stopAndFlush():
+            nonlocal slotStart
+            tc.start(slotStart)
+            tc.stop(project, activity, slotStart + dt.timedelta(minutes=30))
+            backend.flush(tc)
+            slotStart += dt.timedelta(hours=1)
+        results['stopFlush'] = _time(stopAndFlush, repeat)
+    finally:
+        backend.close(tc)
+        backend.cleanup()
+    return results
+
+
+def run(spec: DatasetSpec, backends: List[str], repeat: int, number: int,
+        workdir: Optional[Path] = None, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    start = time.perf_counter()
+    dataset = generate(spec)
+    log(f'Generated {len(dataset.timeslots)} timeslots in {time.perf_counter() - start:.2f} s')
+
+    results: Results = {}
+    for name in backends:
+        tmp = Path(tempfile.mkdtemp(prefix=f'timecard-bench-{name}-', dir=workdir))
+        try:
+            results[name] = benchmarkBackend(BACKENDS[name](), dataset, tmp, repeat, number)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        log(formatResults({name: results[name]}))
+    return {
+        'version': RESULT_VERSION,
+        'meta': _meta(spec, repeat, number),
+        'results': results
+    }
+
+
+def _meta(spec: DatasetSpec, repeat: int, number: int) -> Dict[str, Any]:
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'timecard': timecard.__version__,
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+        'dataset': spec.toDict(),
+        'repeat': repeat,
+        'number': number
+    }
+
+
+def formatResults(results: Results) -> str:
+    lines = []
+    for backend, operations in results.items():
+        for operation, result in operations.items():
+            lines.append(f'{backend:16} {operation:12} {result["median"] * 1e3:12.3f} ms'
+                         f'  (min {result["min"] * 1e3:.3f} ms)')
+    return '\n'.join(lines)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float, minDelta: float = 1e-5) -> Tuple[List[str], List[str]]:
+    """Compare median times; returns report lines and the regressions.
+
+    A regression is slower by more than ``threshold`` and by more than
+    ``minDelta`` seconds, so microsecond noise does not fail a run.
+    """
+    lines = []
+    regressions = []
+    if baseline['meta'].get('dataset') != current['meta'].get('dataset'):
+        lines.append('warning: runs used different datasets')
+    for backend, operations in current['results'].items():
+        for operation, result in operations.items():
+            before = baseline['results'].get(backend, {}).get(operation)
+            if before is None:
+                continue
+            ratio = result['median'] / before['median'] if before['median'] else float('inf')
+            line = (f'{backend:16} {operation:12} {before["median"] * 1e3:12.3f} -> '
+                    f'{result["median"] * 1e3:12.3f} ms  x{ratio:.2f}')
+            lines.append(line)
+            if ratio > 1 + threshold and result['median'] - before['median'] > minDelta:
+                regressions.append(line)
+    return lines, regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Timecard backend benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    runParser = subparsers.add_parser('run', help='run the benchmarks')
+    runParser.add_argument('--backends', default='xml,legacy-xml,sqlite,mmap,firebase',
+                           help=f'comma separated, from {", ".join(BACKENDS)}')
+    runParser.add_argument('--projects', type=int, default=DatasetSpec.projects)
+    runParser.add_argument('--years', type=int, default=DatasetSpec.years)
+    runParser.add_argument('--slots-per-day', type=int, default=DatasetSpec.slotsPerDay)
+    runParser.add_argument('--seed', type=int, default=DatasetSpec.seed)
+    runParser.add_argument('--repeat', type=int, default=5)
+    runParser.add_argument('--number', type=int, default=100,
+                           help='calls per run for the cheap report operations')
+    runParser.add_argument('--output', type=Path, help='write JSON results here')
+
+    compareParser = subparsers.add_parser('compare', help='compare two result files')
+    compareParser.add_argument('baseline', type=Path)
+    compareParser.add_argument('current', type=Path)
+    compareParser.add_argument('--threshold', type=float, default=0.1,
+                               help='slowdown ratio above which to fail (default 0.1 = 10%%)')
+    compareParser.add_argument('--min-delta', type=float, default=1e-5,
+                               help='ignore slowdowns smaller than this many seconds')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        backends = [name.strip() for name in args.backends.split(',') if name.strip()]
+        unknown = [name for name in backends if name not in BACKENDS]
+        if unknown:
+            parser.error(f'unknown backends: {", ".join(unknown)}')
+        if sum(name.startswith('firebase') for name in backends) > 1:
+            # Config is a process-wide singleton.
+            parser.error('run one firebase backend per process')
+        spec = DatasetSpec(projects=args.projects, years=args.years,
+                           slotsPerDay=args.slots_per_day, seed=args.seed)
+        report = run(spec, backends, args.repeat, args.number)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    lines, regressions = compare(baseline, current, args.threshold, args.min_delta)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'\n{len(regressions)} regressions over {args.threshold:.0%}:', file=sys.stderr)
+        print('\n'.join(regressions), file=sys.stderr)
+        return 1
+    return 0
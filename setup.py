@@ -6,14 +6,19 @@ setup(
     description="E4E Timecard Application",
     author='Nathan Hui',
     author_email='nthui@eng.ucsd.edu',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
+    python_requires='>=3.8',
     install_requires=[
-        'pyrebase4',
+        'requests',
         'ipython',
         'pyyaml',
         'appdirs',
         'schema'
     ],
+    extras_require={
+        'columnar': ['numpy'],
+        'fastjson': ['orjson']
+    },
     entry_points={
         'console_scripts': [
             'timecard=timecard.timecard:main'
@@ -0,0 +1,36 @@
+import pytest
+import yaml
+
+from rtdb_stub import RealtimeDatabaseStub
+from timecard.config import Config
+from timecard.firebase import FirebaseClient
+
+
+@pytest.fixture
+def stub():
+    with RealtimeDatabaseStub() as stub:
+        stub.addUser('admin@example.com', 'password')
+        yield stub
+
+
+@pytest.fixture
+def client(stub, tmp_path):
+    client = FirebaseClient(stub.config, sessionPath=tmp_path.joinpath('session.json'))
+    client.run(client.tokens.signIn('admin@example.com', 'password'))
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def configure(tmp_path, monkeypatch):
+    """Install a Config singleton with the given options for one test."""
+    def configure(**options) -> Config:
+        path = tmp_path.joinpath('config.yaml')
+        data = {'logPath': tmp_path.joinpath('log.log').as_posix(),
+                'email': 'admin@example.com', 'password': 'password'}
+        with open(path, 'w') as f:
+            yaml.safe_dump(dict(data, **options), f)
+        config = Config(path)
+        monkeypatch.setattr(Config, '_Config__instance', config)
+        return config
+    return configure
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import json
+import secrets
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlsplit
+
+
+class RealtimeDatabaseStub:
+    """In-process stand-in for the Firebase Realtime Database REST API.
+
+    Supports GET (with orderBy/startAt/endAt/equalTo/limitToFirst/
+    limitToLast/shallow), PUT, PATCH multi-path updates, POST and DELETE,
+    plus the ``{".sv": "timestamp"}`` server value.  Tokens are accepted
+    without checking unless ``checkTokens`` is set, in which case database
+    requests need an unexpired ID token issued by the stub.  ``latency`` seconds are added to every response, and
+    every request is appended to ``requests`` so callers can count round
+    trips.  Database requests under a path in ``failPaths`` fail with
+    ``failStatus`` (503 unless changed).
+
+    Users added with ``addUser`` can sign in through the Auth REST endpoints
+    (``/v1/accounts:signInWithPassword`` and ``/v1/token``); ``config`` is a
+    Timecard config pointing every endpoint at the stub.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.data: Dict[str, Any] = {}
+        self.latency = latency
+        self.requests: List[Tuple[str, str, Dict[str, str]]] = []
+        self.lock = threading.Lock()
+        self.users: Dict[str, Tuple[str, str]] = {}
+        self.tokenLifetime = 3600
+        self.checkTokens = False
+        self.failPaths: Set[str] = set()
+        self.failStatus = 503
+        self._refreshTokens: Dict[str, str] = {}
+        self._idTokens: Dict[str, float] = {}
+        self._lastTimestamp = 0
+        self._server = ThreadingHTTPServer((host, port), self._handlerClass())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    @property
+    def config(self) -> Dict[str, str]:
+        return {
+            'apiKey': 'stub',
+            'databaseURL': self.url,
+            'identityToolkitURL': self.url + 'v1',
+            'secureTokenURL': self.url + 'v1'
+        }
+
+    def addUser(self, email: str, password: str, localId: Optional[str] = None) -> str:
+        localId = localId or uuid.uuid4().hex
+        with self.lock:
+            self.users[email] = (password, localId)
+        return localId
+
+    def _issueTokens(self, localId: str) -> Tuple[str, str]:
+        refreshToken = secrets.token_hex(16)
+        self._refreshTokens[refreshToken] = localId
+        idToken = f'id-{localId}-{secrets.token_hex(8)}'
+        self._idTokens[idToken] = time.time() + self.tokenLifetime
+        return idToken, refreshToken
+
+    def expireTokens(self) -> None:
+        with self.lock:
+            self._idTokens.clear()
+
+    def _failing(self, path: str) -> bool:
+        parts = self._split(path)
+        with self.lock:
+            return any(parts[:len(prefix)] == prefix
+                       for prefix in (self._split(failPath) for failPath in self.failPaths))
+
+    def _authorized(self, params: Dict[str, Any]) -> bool:
+        if not self.checkTokens:
+            return True
+        with self.lock:
+            return self._idTokens.get(str(params.get('auth')), 0) > time.time()
+
+    def _signIn(self, body: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        with self.lock:
+            user = self.users.get(body.get('email'))
+            if user is None or user[0] != body.get('password'):
+                return {'error': {'code': 400, 'message': 'INVALID_LOGIN_CREDENTIALS'}}, 400
+            idToken, refreshToken = self._issueTokens(user[1])
+        return {
+            'kind': 'identitytoolkit#VerifyPasswordResponse',
+            'localId': user[1],
+            'email': body['email'],
+            'idToken': idToken,
+            'refreshToken': refreshToken,
+            'expiresIn': str(self.tokenLifetime),
+            'registered': True
+        }, 200
+
+    def _refresh(self, form: Dict[str, str]) -> Tuple[Dict[str, Any], int]:
+        with self.lock:
+            localId = self._refreshTokens.pop(form.get('refresh_token', ''), None)
+            if localId is None or form.get('grant_type') != 'refresh_token':
+                return {'error': {'code': 400, 'message': 'INVALID_REFRESH_TOKEN'}}, 400
+            idToken, refreshToken = self._issueTokens(localId)
+        return {
+            'id_token': idToken,
+            'refresh_token': refreshToken,
+            'expires_in': str(self.tokenLifetime),
+            'token_type': 'Bearer',
+            'user_id': localId
+        }, 200
+
+    def start(self) -> RealtimeDatabaseStub:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> RealtimeDatabaseStub:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stop()
+
+    def _timestamp(self) -> int:
+        self._lastTimestamp = max(self._lastTimestamp + 1, int(time.time() * 1000))
+        return self._lastTimestamp
+
+    def _resolveServerValues(self, value: Any, timestamp: int) -> Any:
+        if isinstance(value, dict):
+            if value == {'.sv': 'timestamp'}:
+                return timestamp
+            return {key: self._resolveServerValues(child, timestamp) for key, child in value.items()}
+        return value
+
+    @staticmethod
+    def _split(path: str) -> List[str]:
+        return [part for part in path.strip('/').split('/') if part]
+
+    def get(self, path: str) -> Any:
+        node: Any = self.data
+        for part in self._split(path):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def set(self, path: str, value: Any) -> None:
+        parts = self._split(path)
+        if not parts:
+            self.data = value if isinstance(value, dict) else {}
+            return
+        node = self.data
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = {}
+                node[part] = child
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+
+    def update(self, path: str, values: Dict[str, Any]) -> None:
+        timestamp = self._timestamp()
+        for key, value in values.items():
+            self.set(f'{path}/{key}', self._resolveServerValues(value, timestamp))
+
+    @staticmethod
+    def _query(value: Any, params: Dict[str, Any]) -> Any:
+        if not isinstance(value, dict):
+            return value
+        if params.get('shallow'):
+            return {key: True for key in value}
+        orderBy = params.get('orderBy')
+        if orderBy is None:
+            return value
+
+        def sortKey(item: Tuple[str, Any]) -> Any:
+            key, child = item
+            if orderBy == '$key':
+                return key
+            if orderBy == '$value':
+                return child
+            if isinstance(child, dict):
+                return child.get(orderBy)
+            return None
+
+        items = [item for item in value.items()]
+        if 'equalTo' in params:
+            items = [item for item in items if sortKey(item) == params['equalTo']]
+        if 'startAt' in params:
+            items = [item for item in items
+                     if sortKey(item) is not None and sortKey(item) >= params['startAt']]
+        if 'endAt' in params:
+            items = [item for item in items
+                     if sortKey(item) is not None and sortKey(item) <= params['endAt']]
+        items.sort(key=lambda item: (sortKey(item) is not None, sortKey(item) or 0, item[0]))
+        if 'limitToFirst' in params:
+            items = items[:params['limitToFirst']]
+        if 'limitToLast' in params:
+            items = items[-params['limitToLast']:]
+        return dict(items)
+
+    def _handlerClass(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _parse(self) -> Tuple[str, Dict[str, Any]]:
+                url = urlsplit(self.path)
+                path = url.path
+                if path.endswith('.json'):
+                    path = path[:-len('.json')]
+                params: Dict[str, Any] = {}
+                for key, values in parse_qs(url.query).items():
+                    if key == 'auth':
+                        params[key] = values[0]
+                        continue
+                    try:
+                        params[key] = json.loads(values[0])
+                    except ValueError:
+                        params[key] = values[0]
+                with stub.lock:
+                    stub.requests.append((self.command, path, dict(params)))
+                return path, params
+
+            def _raw(self) -> bytes:
+                return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            def _body(self) -> Any:
+                raw = self._raw()
+                if not raw:
+                    return None
+                return json.loads(raw)
+
+            def _reply(self, value: Any, status: int = 200):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                payload = json.dumps(value).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _denied(self, path: str, params: Dict[str, Any]) -> bool:
+                if stub._failing(path):
+                    self._reply({'error': 'Injected failure'}, stub.failStatus)
+                    return True
+                if stub._authorized(params):
+                    return False
+                self._reply({'error': 'Auth token is expired'}, 401)
+                return True
+
+            def do_GET(self):
+                path, params = self._parse()
+                if self._denied(path, params):
+                    return
+                with stub.lock:
+                    value = stub._query(stub.get(path), params)
+                self._reply(value)
+
+            def do_PUT(self):
+                path, params = self._parse()
+                body = self._body()
+                if self._denied(path, params):
+                    return
+                with stub.lock:
+                    value = stub._resolveServerValues(body, stub._timestamp())
+                    stub.set(path, value)
+                self._reply(value)
+
+            def do_PATCH(self):
+                path, params = self._parse()
+                body = self._body()
+                if self._denied(path, params):
+                    return
+                if not isinstance(body, dict):
+                    self._reply({'error': 'Invalid data; couldn\'t parse JSON object.'}, 400)
+                    return
+                with stub.lock:
+                    stub.update(path, body)
+                self._reply(body)
+
+            def do_POST(self):
+                path, params = self._parse()
+                if path == '/v1/accounts:signInWithPassword':
+                    self._reply(*stub._signIn(self._body() or {}))
+                    return
+                if path == '/v1/token':
+                    self._reply(*stub._refresh(dict(parse_qsl(self._raw().decode('ascii')))))
+                    return
+                body = self._body()
+                if self._denied(path, params):
+                    return
+                key = uuid.uuid4().hex
+                with stub.lock:
+                    stub.set(f'{path}/{key}', stub._resolveServerValues(body, stub._timestamp()))
+                self._reply({'name': key})
+
+            def do_DELETE(self):
+                path, params = self._parse()
+                if self._denied(path, params):
+                    return
+                with stub.lock:
+                    stub.set(path, None)
+                self._reply(None)
+
+        return Handler
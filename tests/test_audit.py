@@ -0,0 +1,84 @@
+import builtins
+import datetime as dt
+
+import pytest
+
+from timecard.audit import OverlapError, sweep
+from timecard.data import Activity, Project, Timeslot
+from timecard.mmap_database import Timecard as MmapTimecard
+from timecard.sqlite_database import Timecard as SqliteTimecard
+from timecard.timecard import TimeCardCLI
+from timecard.xml_database import Timecard as XmlTimecard
+
+START = dt.datetime(2022, 5, 2, 9)
+DAY = (START - dt.timedelta(hours=9), START + dt.timedelta(hours=15))
+BACKENDS = {'xml': XmlTimecard, 'sqlite': SqliteTimecard, 'mmap': MmapTimecard}
+
+
+def slot(startMinutes, endMinutes, project=None):
+    return Timeslot(project=project, startTime=START + dt.timedelta(minutes=startMinutes),
+                    endTime=START + dt.timedelta(minutes=endMinutes), activity=Activity.Development)
+
+
+def test_sweep_reports_overlaps_durations_and_gaps():
+    long, inside, after, backwards = slot(0, 120), slot(30, 60), slot(150, 180), slot(200, 190)
+    nextDay = slot(24 * 60, 24 * 60 + 30)
+    findings = sweep([after, nextDay, backwards, inside, long], minGap=dt.timedelta(minutes=20))
+
+    overlaps = [finding for finding in findings if finding.kind == 'overlap']
+    assert [(finding.slots, finding.start, finding.end) for finding in overlaps] == \
+        [((long, inside), inside.getStartTime(), inside.getEndTime())]
+    assert [finding.slots for finding in findings if finding.kind == 'duration'] == [(backwards,)]
+    # The night before the next day's slot is not a gap.
+    assert [(finding.start, finding.end) for finding in findings if finding.kind == 'gap'] == \
+        [(long.getEndTime(), after.getStartTime())]
+    assert sweep([long, after]) == []
+
+
+def test_sweep_skips_open_slots():
+    running = Timeslot(startTime=START + dt.timedelta(minutes=10))
+    assert sweep([slot(0, 60), running]) == []
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_stop_rejects_overlaps_unless_allowed(tmp_path, backend):
+    tc = BACKENDS[backend](tmp_path.joinpath('tc').as_posix())
+    try:
+        project = Project(name='P', desc='')
+        tc.addProject(project)
+        tc.start(START)
+        tc.stop(project, Activity.Development, endTime=START + dt.timedelta(hours=1))
+        tc.start(START + dt.timedelta(minutes=30))
+        with pytest.raises(OverlapError) as error:
+            tc.stop(project, Activity.Meetings, endTime=START + dt.timedelta(hours=2))
+        assert [overlap.getStartTime() for overlap in error.value.overlaps] == [START]
+        assert len(tc.getRangeEntries(*DAY)) == 1
+
+        tc.stop(project, Activity.Meetings, endTime=START + dt.timedelta(hours=2), allowOverlap=True)
+        assert len(tc.getRangeEntries(*DAY)) == 2
+        findings = tc.audit()
+        assert [(finding.kind, finding.start, finding.end) for finding in findings] == \
+            [('overlap', START + dt.timedelta(minutes=30), START + dt.timedelta(hours=1))]
+    finally:
+        tc.close()
+
+
+def runCli(monkeypatch, commands):
+    lines = iter(commands + ['exit'])
+    monkeypatch.setattr(builtins, 'input', lambda prompt='': next(lines))
+    TimeCardCLI()
+
+
+@pytest.mark.parametrize('rejectOverlaps', [False, True])
+def test_cli_stop_warns_or_rejects_overlaps(configure, monkeypatch, capsys, tmp_path, rejectOverlaps):
+    dataPath = tmp_path.joinpath('data', 'timecard.xml')
+    configure(backend='xml', dataPath=dataPath.as_posix(), rejectOverlaps=rejectOverlaps)
+    runCli(monkeypatch, ['addproject PROJ test project',
+                         'start 2022.05.02.09.00', 'stop PROJ DEV 2022.05.02.10.00',
+                         'start 2022.05.02.09.30', 'stop PROJ DEV 2022.05.02.10.30'])
+    output = capsys.readouterr().out
+    assert 'Warning: this entry overlaps:' in output
+    assert ('Entry rejected' in output) == rejectOverlaps
+
+    with XmlTimecard(dataPath.as_posix()) as tc:
+        assert len(tc.getRangeEntries(*DAY)) == (1 if rejectOverlaps else 2)
@@ -0,0 +1,44 @@
+import datetime as dt
+
+import pytest
+
+from timecard.data import Activity, Project, Timeslot
+
+columnar = pytest.importorskip('timecard.columnar')
+pytest.importorskip('numpy')
+
+START = dt.datetime(2021, 3, 1, 9)
+
+
+def slots(project, days):
+    return [Timeslot(project=project, activity=Activity.Development,
+                     startTime=START + dt.timedelta(days=day),
+                     endTime=START + dt.timedelta(days=day, hours=1)) for day in days]
+
+
+def test_verify_checks_days_and_weeks_and_rebuild_repairs():
+    project = Project(name='p', desc='')
+    timeslots = slots(project, range(3))
+    store = columnar.ColumnarStore(timeslots)
+    rollup = store.rollup()
+    assert rollup.verify(timeslots) == []
+
+    # A slot the store never saw, in a later week.
+    extra = slots(project, [9])
+    mismatches = rollup.verify(timeslots + extra)
+    assert [bucket for bucket, _ in mismatches] == [(START + dt.timedelta(days=9)).date(), (2021, 10)]
+
+    rollup.rebuild(timeslots + extra)
+    assert rollup.verify(timeslots + extra) == []
+    assert len(store) == 4
+
+
+def test_rebuild_resets_projects():
+    old = Project(name='old', desc='')
+    store = columnar.ColumnarStore(slots(old, range(2)))
+    store.addProject(Project(name='unused', desc=''))
+    new = Project(name='new', desc='')
+    store.rebuild(slots(new, range(2)))
+    assert store._projectTable == [new]
+    assert store.totals(START, START + dt.timedelta(days=7)) == {
+        (new, Activity.Development): dt.timedelta(hours=2)}
@@ -0,0 +1,34 @@
+import datetime as dt
+import os
+import time
+
+import pytest
+
+from timecard.data import Activity, Project, Timeslot
+
+
+@pytest.fixture
+def losAngeles():
+    if not hasattr(time, 'tzset'):
+        pytest.skip('needs time.tzset')
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/Los_Angeles'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+def test_total_time_does_not_depend_on_cached_datetimes(losAngeles):
+    # Clocks skip 02:00-03:00 on this night, so two hours really pass.
+    slot = Timeslot(project=Project(name='p', desc=''), activity=Activity.Development,
+                    startTime=dt.datetime(2024, 3, 10, 1), endTime=dt.datetime(2024, 3, 10, 4))
+    loaded = Timeslot.fromDict(slot.toDict())
+    assert loaded.getTotalTime() == dt.timedelta(hours=2)
+    loaded.getStartTime()
+    loaded.getEndTime()
+    assert loaded.getTotalTime() == dt.timedelta(hours=2)
+    assert slot.getTotalTime() == dt.timedelta(hours=2)
@@ -0,0 +1,55 @@
+import datetime as dt
+import time
+
+from timecard.data import Activity, Project
+from timecard.firebase import Timecard
+
+
+def waitFor(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+def test_rejected_sync_query_keeps_the_session(stub, configure, tmp_path):
+    configure()
+    tc = Timecard(config=stub.config, snapshotDir=tmp_path.joinpath('snapshots'), syncInterval=0.1)
+    try:
+        assert tc.online
+        localId = stub.users['admin@example.com'][1]
+        # As when the rules lack ".indexOn": ["updated"].
+        stub.failStatus = 400
+        stub.failPaths.add(f'data/{localId}/timeslots')
+        assert waitFor(lambda: tc.syncError is not None and 'HTTP 400' in tc.syncError)
+        time.sleep(0.5)
+        assert tc.online
+        assert not [path for _, path, _ in stub.requests if path.startswith('/v1/')][1:]
+    finally:
+        tc.close()
+
+
+def test_remote_deletion_reaches_the_timecard(stub, configure, tmp_path):
+    configure()
+    tc = Timecard(config=stub.config, snapshotDir=tmp_path.joinpath('snapshots'))
+    try:
+        project = Project(name='p', desc='')
+        tc.addProject(project)
+        start = dt.datetime(2021, 3, 1, 9)
+        tc.start(start)
+        tc.stop(project, Activity.Development, endTime=start + dt.timedelta(hours=1))
+        assert tc.flush(5)
+        tc.sync()
+        assert len(tc.getDayEntries(start.date())) == 1
+
+        localId = stub.users['admin@example.com'][1]
+        slotKey = next(iter(stub.get(f'data/{localId}/timeslots')))
+        stub.set(f'data/{localId}/timeslots/{slotKey}', None)
+        tc._Timecard__sync._fullSync = 0
+        tc.sync()
+        assert tc.getDayEntries(start.date()) == []
+        assert tc.getDayTotals(start.date()) == {}
+    finally:
+        tc.close()
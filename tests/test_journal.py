@@ -0,0 +1,92 @@
+import datetime as dt
+import json
+
+from timecard.data import Activity, Project
+from timecard.journal import Journal
+from timecard.xml_database import Timecard
+
+START = dt.datetime(2022, 5, 2, 9)
+
+
+def record(kind, uid):
+    return (json.dumps({'kind': kind, 'data': {'uuid': uid}}) + '\n').encode()
+
+
+def test_open_truncates_torn_tail(tmp_path):
+    path = tmp_path.joinpath('log.journal')
+    good = record('project', 'a') + record('project', 'b')
+    path.write_bytes(good + b'{"kind": "project", "da')
+    journal = Journal(path)
+    journal.open()
+    assert path.stat().st_size == len(good)
+    journal.append('project', {'uuid': 'c'})
+    journal.close()
+    assert [data['uuid'] for _, data in Journal(path).replay()] == ['a', 'b', 'c']
+
+
+def test_open_truncates_from_first_corrupt_line(tmp_path):
+    path = tmp_path.joinpath('log.journal')
+    good = record('project', 'a')
+    path.write_bytes(good + b'not json\n' + record('project', 'b'))
+    journal = Journal(path)
+    journal.open()
+    journal.close()
+    assert path.read_bytes() == good
+
+
+def addSlot(tc, project, hour):
+    tc.start(START + dt.timedelta(hours=hour))
+    tc.stop(project, Activity.Development, endTime=START + dt.timedelta(hours=hour, minutes=30))
+
+
+def test_unflushed_records_are_replayed(tmp_path):
+    filename = tmp_path.joinpath('tc.xml').as_posix()
+    tc = Timecard(filename)
+    project = Project(name='p', desc='')
+    tc.addProject(project)
+    addSlot(tc, project, 0)
+    # No close: the process dies with everything only in the journal.
+    tc._journal.close()
+
+    reopened = Timecard(filename)
+    assert list(reopened.getProjects()) == ['p']
+    assert [slot.uid for slot in reopened.getRangeEntries(START, START + dt.timedelta(days=1))] == \
+        [slot.uid for slot in tc.getRangeEntries(START, START + dt.timedelta(days=1))]
+    reopened.close()
+
+
+def test_replay_skips_records_already_checkpointed(tmp_path):
+    filename = tmp_path.joinpath('tc.xml').as_posix()
+    tc = Timecard(filename)
+    project = Project(name='p', desc='')
+    tc.addProject(project)
+    addSlot(tc, project, 0)
+    stale = Timecard.journalPath(filename).read_bytes()
+    tc.close()
+    # A crash between the checkpoint's rename and the journal reset.
+    Timecard.journalPath(filename).write_bytes(stale)
+
+    reopened = Timecard(filename)
+    assert len(reopened.getProjects()) == 1
+    assert len(reopened.getRangeEntries(START, START + dt.timedelta(days=1))) == 1
+    reopened.close()
+
+
+def test_flush_resets_journal(tmp_path):
+    filename = tmp_path.joinpath('tc.xml').as_posix()
+    tc = Timecard(filename)
+    project = Project(name='p', desc='')
+    tc.addProject(project)
+    addSlot(tc, project, 0)
+    addSlot(tc, project, 1)
+    journalPath = Timecard.journalPath(filename)
+    assert journalPath.stat().st_size > 0
+    tc.flush()
+    assert journalPath.stat().st_size == 0
+    addSlot(tc, project, 2)
+    assert len(list(Journal(journalPath).replay())) == 1
+    tc.close()
+
+    reopened = Timecard(filename)
+    assert len(reopened.getRangeEntries(START, START + dt.timedelta(days=1))) == 3
+    reopened.close()
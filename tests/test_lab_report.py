@@ -0,0 +1,88 @@
+import datetime as dt
+import time
+
+import pytest
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.lab_report import LabReport
+from timecard.sync import DeltaSync
+
+USERS = [f'user{i}' for i in range(8)]
+YEAR, WEEK = 2019, 10
+MONDAY = dt.datetime.combine(dt.date.fromisocalendar(YEAR, WEEK, 1), dt.time(9))
+
+
+def timeslot(project: Project, day: int, hours: int = 1):
+    start = MONDAY + dt.timedelta(days=day)
+    slot = Timeslot(project=project, activity=Activity.Development,
+                    startTime=start, endTime=start + dt.timedelta(hours=hours))
+    return slot.uid.hex, DeltaSync.stamp(slot.toDict())
+
+
+def seed(stub, localId: str, slots: int = 3) -> Project:
+    project = Project(name='shared', desc='')
+    stub.update(f'data/{localId}', dict(
+        [(f'projects/{project.uid.hex}', DeltaSync.stamp(project.toDict()))] +
+        [(f'timeslots/{key}', value) for key, value in
+         (timeslot(project, day) for day in range(slots))]))
+    return project
+
+
+@pytest.fixture
+def projects(stub):
+    return {localId: seed(stub, localId) for localId in USERS}
+
+
+@pytest.fixture
+def report(client, tmp_path):
+    return LabReport(client, tmp_path.joinpath('cache'), concurrency=len(USERS))
+
+
+def byUser(results):
+    return {result.localId: result for result in results}
+
+
+def test_users_fetched_concurrently(stub, projects, report):
+    stub.latency = 0.25
+    started = time.perf_counter()
+    results = report.weekTotals(YEAR, WEEK, USERS)
+    elapsed = time.perf_counter() - started
+    assert elapsed < len(USERS) * stub.latency / 2
+    assert [result.error for result in results] == [None] * len(USERS)
+    assert LabReport.merge(results) == {('shared', Activity.Development): dt.timedelta(hours=3 * len(USERS))}
+
+
+def test_second_run_fetches_only_changes(stub, projects, report):
+    first = byUser(report.weekTotals(YEAR, WEEK, USERS))
+    assert all(result.changed == 4 for result in first.values())
+
+    key, value = timeslot(projects['user0'], 4, hours=2)
+    stub.update('data/user0', {f'timeslots/{key}': value})
+    stub.requests.clear()
+    second = byUser(report.weekTotals(YEAR, WEEK, USERS))
+
+    assert second['user0'].changed == 1
+    assert second['user0'].hours == pytest.approx(5)
+    assert all(second[localId].changed == 0 for localId in USERS[1:])
+    assert all(second[localId].hours == pytest.approx(3) for localId in USERS[1:])
+    gets = [params for method, _, params in stub.requests if method == 'GET']
+    assert len(gets) == 2 * len(USERS)
+    assert all(params.get('orderBy') == 'updated' and 'startAt' in params for params in gets)
+
+
+def test_failed_user_reported_from_cache(stub, projects, report):
+    report.weekTotals(YEAR, WEEK, USERS)
+    key, value = timeslot(projects['user1'], 4)
+    stub.update('data/user1', {f'timeslots/{key}': value})
+    stub.failPaths.add('data/user1')
+
+    results = byUser(report.weekTotals(YEAR, WEEK, USERS))
+    assert results['user1'].error is not None
+    assert results['user1'].changed == 0
+    assert results['user1'].hours == pytest.approx(3)
+    assert all(results[localId].error is None for localId in USERS if localId != 'user1')
+
+    stub.failPaths.clear()
+    results = byUser(report.weekTotals(YEAR, WEEK, ['user1']))
+    assert results['user1'].error is None
+    assert results['user1'].hours == pytest.approx(4)
@@ -0,0 +1,51 @@
+import datetime as dt
+import uuid
+
+import pytest
+
+from timecard import xml_data
+from timecard.migrate import Migration
+
+
+class QueuedTarget:
+    """A target whose writes never reach the server, like firebase offline."""
+
+    def __init__(self):
+        self.records = []
+        self.flushTimeouts = []
+
+    def importRecords(self, records):
+        self.records.extend(records)
+        return 0, 0
+
+    def flush(self, timeout=None):
+        self.flushTimeouts.append(timeout)
+        return False
+
+    def writeQueueStatus(self):
+        return type('Status', (), {'depth': len(self.records)})()
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    path = tmp_path.joinpath('legacy.xml')
+    tc = xml_data.Timecard(path.as_posix())
+    project = xml_data.Project('p', '', uuid.uuid4().hex)
+    tc.addProject(project)
+    start = dt.datetime(2020, 1, 6, 9)
+    tc._timeslots.append(xml_data.Timeslot(startTime=start, endTime=start + dt.timedelta(hours=1),
+                                           project=project, activity=xml_data.Activity.Development,
+                                           uuidHex=uuid.uuid4().hex, msg=''))
+    tc.flush()
+    return path
+
+
+def test_unsent_writes_fail_and_keep_the_state(legacy, tmp_path):
+    target = QueuedTarget()
+    statePath = tmp_path.joinpath('state.json')
+    migration = Migration(legacy, target, 'firebase', statePath, flushTimeout=0.1)
+    with pytest.raises(RuntimeError, match='not sent'):
+        migration.run()
+    assert target.flushTimeouts == [0.1]
+    assert statePath.is_file()
+    assert len(target.records) == 2
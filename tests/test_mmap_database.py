@@ -0,0 +1,97 @@
+import datetime as dt
+
+import pytest
+
+from timecard import mmap_database
+from timecard.data import Activity, Project
+from timecard.mmap_database import Timecard
+
+START = dt.datetime(2022, 5, 2, 9)
+DAY = (START, START + dt.timedelta(days=1))
+
+
+def addSlot(tc, project, hour, msg=''):
+    tc.start(START + dt.timedelta(hours=hour))
+    tc.stop(project, Activity.Development, endTime=START + dt.timedelta(hours=hour, minutes=30), msg=msg)
+
+
+def test_records_round_trip(tmp_path):
+    filename = tmp_path.joinpath('tc.bin').as_posix()
+    project = Project(name='p', desc='d')
+    with Timecard(filename) as tc:
+        tc.addProject(project)
+        addSlot(tc, project, 2, 'later')
+        addSlot(tc, project, 0, 'first')
+        addSlot(tc, project, 1)
+        written = sorted(slot.toDict()['uuid'] for slot in tc.getRangeEntries(*DAY))
+
+    with Timecard(filename, readOnly=True) as tc:
+        entries = tc.getRangeEntries(*DAY)
+        assert [slot.getMsg() for slot in entries] == ['first', '', 'later']
+        assert sorted(slot.toDict()['uuid'] for slot in entries) == written
+        assert all(slot.getProject().uid == project.uid for slot in entries)
+        assert tc.getRangeTotals(*DAY) == {(tc.getProjects()['p'], Activity.Development): dt.timedelta(minutes=90)}
+        # close() rewrote the out-of-order appends sorted.
+        assert tc._sorted
+
+
+@pytest.mark.skipif(mmap_database.fcntl is None, reason="needs flock")
+def test_second_writer_is_refused(tmp_path):
+    filename = tmp_path.joinpath('tc.bin').as_posix()
+    with Timecard(filename):
+        with pytest.raises(RuntimeError, match='open for writing'):
+            Timecard(filename)
+    Timecard(filename).close()
+
+
+def test_read_only_open(tmp_path):
+    filename = tmp_path.joinpath('tc.bin').as_posix()
+    with pytest.raises(RuntimeError):
+        Timecard(filename, readOnly=True)
+    project = Project(name='p', desc='')
+    with Timecard(filename) as writer:
+        writer.addProject(project)
+        addSlot(writer, project, 0)
+        reader = Timecard(filename, readOnly=True)
+        addSlot(writer, project, 1)
+        assert len(reader.getRangeEntries(*DAY)) == 1
+        with pytest.raises(RuntimeError, match='read-only'):
+            reader.start(START)
+        with pytest.raises(RuntimeError, match='read-only'):
+            reader.addProject(Project(name='q', desc=''))
+        reader.close()
+    with Timecard(filename, readOnly=True) as reader:
+        assert list(reader.getProjects()) == ['p']
+
+
+def test_header_count_is_raised_after_records_are_synced(tmp_path, monkeypatch):
+    filename = tmp_path.joinpath('tc.bin').as_posix()
+    project = Project(name='p', desc='')
+    tc = Timecard(filename)
+    tc.addProject(project)
+    addSlot(tc, project, 0)
+
+    syncs = []
+    syncRange = Timecard._Timecard__syncRange
+
+    def recordSync(self, offset, length):
+        syncs.append((offset, Timecard.HEADER.unpack_from(self._mapped)[3]))
+        syncRange(self, offset, length)
+
+    monkeypatch.setattr(Timecard, '_Timecard__syncRange', recordSync)
+    addSlot(tc, project, 1)
+    recordOffset = Timecard.HEADER_SIZE + Timecard.RECORD.size
+    assert syncs == [(recordOffset, 1), (0, 2)]
+
+    def crash(self):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(Timecard, '_Timecard__writeHeader', crash)
+    with pytest.raises(KeyboardInterrupt):
+        addSlot(tc, project, 2)
+    monkeypatch.undo()
+    tc.close()
+
+    with Timecard(filename, readOnly=True) as reopened:
+        assert [slot.getStartTime() for slot in reopened.getRangeEntries(*DAY)] == \
+            [START, START + dt.timedelta(hours=1)]
@@ -0,0 +1,22 @@
+import pstats
+import threading
+
+from timecard.profiling import Profiler
+
+
+def busyWorker():
+    sum(i * i for i in range(10000))
+
+
+def test_command_profile_includes_threads_it_starts(tmp_path):
+    profiler = Profiler(tmp_path)
+    profiler.start()
+    with profiler.command('work'):
+        worker = threading.Thread(target=busyWorker)
+        worker.start()
+        worker.join()
+    profiler.stop()
+    stats = pstats.Stats(tmp_path.joinpath('001-work.pstats').as_posix())
+    assert any(function == 'busyWorker' for _, _, function in stats.stats)
+    assert 'busyWorker' in tmp_path.joinpath('001-work.txt').read_text()
+    assert threading.getprofile() is None
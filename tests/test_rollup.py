@@ -0,0 +1,39 @@
+import datetime as dt
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.rollup import Rollup
+
+START = dt.datetime(2021, 3, 1, 9)
+ZERO = dt.timedelta(0)
+
+
+def slot(project, activity, minutes):
+    return Timeslot(project=project, activity=activity, startTime=START,
+                    endTime=START + dt.timedelta(minutes=minutes))
+
+
+def test_zero_duration_slots_keep_their_key():
+    project = Project(name='p', desc='')
+    empty = slot(project, Activity.Meetings, 0)
+    work = slot(project, Activity.Development, 60)
+    key = (project, Activity.Meetings)
+
+    rollup = Rollup([empty, work])
+    assert rollup.day(START.date())[key] == ZERO
+    assert rollup.week(2021, 9)[key] == ZERO
+    assert rollup.range(START, START + dt.timedelta(days=1))[key] == ZERO
+
+    rollup.add(slot(project, Activity.Meetings, 0))
+    rollup.remove(empty)
+    assert rollup.day(START.date())[key] == ZERO
+    rollup.remove(empty)
+    assert key not in rollup.day(START.date())
+    assert key not in rollup.week(2021, 9)
+
+
+def test_zero_duration_key_survives_rekey():
+    project = Project(name='p', desc='')
+    rollup = Rollup([slot(project.uid, Activity.Meetings, 0)])
+    assert rollup.day(START.date()) == {(project.uid, Activity.Meetings): ZERO}
+    rollup.addProject(project)
+    assert rollup.day(START.date()) == {(project, Activity.Meetings): ZERO}
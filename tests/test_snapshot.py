@@ -0,0 +1,23 @@
+import datetime as dt
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.snapshot import Snapshot
+
+START = dt.datetime(2022, 5, 2, 9)
+
+
+def test_round_trip_stores_activities_by_value(tmp_path):
+    source = tmp_path.joinpath('source.json')
+    source.write_text('{}')
+    project = Project(name='p', desc='d')
+    timeslots = [Timeslot(project=project, activity=activity, startTime=START + dt.timedelta(hours=i),
+                          endTime=START + dt.timedelta(hours=i + 1), msg=f'slot {i}')
+                 for i, activity in enumerate([*Activity, None])]
+    path = tmp_path.joinpath('source.snap')
+    Snapshot.write(path, source, [project], timeslots)
+
+    data = path.read_bytes()
+    assert all(activity.value.encode() in data for activity in Activity)
+    projects, loaded = Snapshot.load(path, source)
+    assert [loadedProject.uid for loadedProject in projects] == [project.uid]
+    assert [slot.toDict() for slot in loaded] == [slot.toDict() for slot in timeslots]
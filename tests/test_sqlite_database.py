@@ -0,0 +1,41 @@
+import datetime as dt
+import uuid
+
+import pytest
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.serializable import Serializable
+from timecard.sqlite_database import Timecard
+from timecard.xml_database import Timecard as XmlTimecard
+
+START = dt.datetime(2021, 3, 1, 9)
+
+
+def slotRecord(project, hours: int = 0):
+    start = START + dt.timedelta(hours=hours)
+    slot = Timeslot(project=project, activity=Activity.Development,
+                    startTime=start, endTime=start + dt.timedelta(hours=1))
+    return XmlTimecard.TIMESLOT_TAG, slot.toDict()
+
+
+def test_import_skips_slots_with_unknown_projects(tmp_path):
+    project = Project(name='p', desc='')
+    records = [(XmlTimecard.PROJECT_TAG, project.toDict()), slotRecord(project),
+               slotRecord(uuid.uuid4(), 2), slotRecord(project, 4)]
+    with Timecard(tmp_path.joinpath('tc.db').as_posix()) as tc:
+        assert tc.importRecords(records) == (1, 3)
+        assert tc.skippedTimeslots == 1
+        assert len(tc.getDayEntries(START.date())) == 2
+        # Re-importing is harmless.
+        tc.importRecords(records)
+        assert len(tc.getDayEntries(START.date())) == 2
+
+
+def test_import_validates_before_writing(tmp_path):
+    project = Project(name='p', desc='')
+    bad = dict(slotRecord(project)[1], startTime='nine')
+    with Timecard(tmp_path.joinpath('tc.db').as_posix()) as tc:
+        with pytest.raises(Serializable.DeserializationError):
+            tc.importRecords([(XmlTimecard.PROJECT_TAG, project.toDict()),
+                              (XmlTimecard.TIMESLOT_TAG, bad)])
+        assert tc.getProjects() == {}
@@ -0,0 +1,95 @@
+import datetime as dt
+import time
+import uuid
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.sync import DeltaSync
+
+ROOT = 'data/user'
+
+
+def project(name: str, **extra):
+    return dict(Project(name=name, desc='').toDict(), **extra)
+
+
+def seed(stub, count: int, **extra):
+    records = {uuid.uuid4().hex: project(f'p{i}', **extra) for i in range(count)}
+    stub.set(f'{ROOT}/projects', records)
+    return records
+
+
+def test_delta_fetch_returns_only_changes(stub, client, tmp_path):
+    seed(stub, 5)
+    stub.update(ROOT, {f'projects/{key}': DeltaSync.stamp(value)
+                       for key, value in stub.get(f'{ROOT}/projects').items()})
+    sync = DeltaSync(tmp_path.joinpath('snapshot.json'))
+    assert len(client.run(sync.pull(client.db, ROOT))['projects']) == 5
+
+    # Records stamped at the cursor come back from startAt but are unchanged.
+    assert client.run(sync.pull(client.db, ROOT)) == {'projects': {}, 'timeslots': {}}
+
+    key = next(iter(sync.records['projects']))
+    stub.update(ROOT, {f'projects/{key}': DeltaSync.stamp(project('renamed'))})
+    changed = client.run(sync.pull(client.db, ROOT))
+    assert list(changed['projects']) == [key]
+    assert changed['projects'][key]['name'] == 'renamed'
+
+
+def test_backfill_makes_legacy_records_visible(stub, client, tmp_path):
+    legacy = seed(stub, 3)
+    sync = DeltaSync(tmp_path.joinpath('snapshot.json'))
+    client.run(sync.pull(client.db, ROOT))
+    assert sorted(key for _, key in sync.unstamped()) == sorted(legacy)
+
+    assert client.run(sync.backfill(client.db, ROOT, batchSize=2)) == 3
+    assert all(isinstance(record['updated'], int) for record in stub.get(f'{ROOT}/projects').values())
+    # The stamps arrive with the next delta pull and nothing is left to do.
+    assert len(client.run(sync.pull(client.db, ROOT))['projects']) == 3
+    assert sync.unstamped() == []
+    assert client.run(sync.backfill(client.db, ROOT)) == 0
+
+
+def test_full_resync_catches_unstamped_edits(stub, client, tmp_path):
+    legacy = seed(stub, 2)
+    path = tmp_path.joinpath('snapshot.json')
+    sync = DeltaSync(path, fullResyncInterval=3600)
+    client.run(sync.pull(client.db, ROOT))
+    key = next(iter(legacy))
+    stub.set(f'{ROOT}/projects/{key}/name', 'edited')
+    assert client.run(sync.pull(client.db, ROOT))['projects'] == {}
+
+    # The time of the last full sync survives a restart.
+    sync = DeltaSync(path, fullResyncInterval=3600)
+    assert not sync.fullResyncDue
+    sync._fullSync = time.time() - 3600
+    changed = client.run(sync.pull(client.db, ROOT))
+    assert list(changed['projects']) == [key]
+    assert not sync.fullResyncDue
+
+
+def test_schema_accepts_updated():
+    data = project('p', updated=1234)
+    assert Project.fromDict(data).name == 'p'
+    assert Project.fromDicts([data])[0].name == 'p'
+    slot = Timeslot(project=Project(name='p', desc=''), activity=Activity.Development,
+                    startTime=dt.datetime(2020, 1, 1, 9), endTime=dt.datetime(2020, 1, 1, 10))
+    data = dict(slot.toDict(), updated=1234)
+    assert Timeslot.fromDict(data).uid == slot.uid
+    assert Timeslot.fromDicts([data])[0].uid == slot.uid
+
+
+def test_full_resync_drops_deleted_records(stub, client, tmp_path):
+    records = seed(stub, 3)
+    sync = DeltaSync(tmp_path.joinpath('snapshot.json'), fullResyncInterval=3600)
+    client.run(sync.pull(client.db, ROOT))
+    deleted, kept, _ = sorted(records)
+    stub.set(f'{ROOT}/projects/{deleted}', None)
+    # Written locally, not yet on the server.
+    sync.records['projects']['unsent'] = DeltaSync.stamp(project('new'))
+
+    assert client.run(sync.pull(client.db, ROOT))['projects'] == {}
+    sync._fullSync = time.time() - 3600
+    changed = client.run(sync.pull(client.db, ROOT))
+    assert changed['projects'] == {deleted: None}
+    assert deleted not in sync.records['projects']
+    assert {kept, 'unsent'} <= set(sync.records['projects'])
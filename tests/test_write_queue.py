@@ -0,0 +1,62 @@
+import threading
+import time
+
+from timecard.firebase import HTTPError
+from timecard.write_queue import WriteQueue
+
+
+def makeQueue(send):
+    return WriteQueue(send, flushDelay=0, minBackoff=0.01,
+                      permanent=lambda e: isinstance(e, HTTPError) and e.permanent)
+
+
+def test_permanent_rejection_is_isolated_and_dropped():
+    sent = {}
+
+    def send(batch):
+        if 'bad' in batch:
+            raise HTTPError(400, b'{"error": "Invalid data"}')
+        sent.update(batch)
+
+    queue = makeQueue(send)
+    queue.putMany({'a': 1, 'bad': 2, 'b': 3, 'c': 4})
+    assert queue.flush(5)
+    assert sent == {'a': 1, 'b': 3, 'c': 4}
+    status = queue.status()
+    assert (status.depth, status.rejected, status.failures) == (0, 1, 0)
+    assert 'HTTP 400' in status.lastRejection
+    assert queue.close(5)
+
+
+def test_transient_errors_are_retried():
+    statuses = [503, 429, 401, 408]
+    sent = {}
+
+    def send(batch):
+        if statuses:
+            raise HTTPError(statuses.pop(0), b'')
+        sent.update(batch)
+
+    queue = makeQueue(send)
+    queue.put('a', 1)
+    assert queue.flush(5)
+    assert sent == {'a': 1}
+    status = queue.status()
+    assert (status.rejected, status.failures, status.lastRejection) == (0, 4, None)
+    assert queue.close(5)
+
+
+def test_close_does_not_wait_out_backoff():
+    failed = threading.Event()
+
+    def send(batch):
+        failed.set()
+        raise RuntimeError('Offline')
+
+    queue = WriteQueue(send, flushDelay=0, minBackoff=30)
+    queue.put('a', 1)
+    assert failed.wait(5)
+    started = time.perf_counter()
+    assert not queue.close(10)
+    assert time.perf_counter() - started < 2
+    assert queue.status().depth == 1
@@ -0,0 +1,73 @@
+import datetime as dt
+import os
+from pathlib import Path
+
+import pytest
+
+from timecard.data import Activity, Project
+from timecard.snapshot import Snapshot
+from timecard.xml_database import Timecard
+
+START = dt.datetime(2022, 5, 2, 9)
+ALL = (START - dt.timedelta(days=1), START + dt.timedelta(days=7))
+
+
+def addSlot(tc, project, day, msg=''):
+    start = START + dt.timedelta(days=day)
+    tc.start(start)
+    tc.stop(project, Activity.Development, endTime=start + dt.timedelta(hours=1), msg=msg)
+
+
+def startDays(tc):
+    return sorted((slot.getStartTime() - START).days for slot in tc.getRangeEntries(*ALL))
+
+
+@pytest.fixture
+def filename(tmp_path):
+    filename = tmp_path.joinpath('tc.xml').as_posix()
+    with Timecard(filename) as tc:
+        project = Project(name='p', desc='')
+        tc.addProject(project)
+        for day in range(4):
+            addSlot(tc, project, day)
+    return filename
+
+
+@pytest.mark.parametrize('fromSnapshot', [True, False])
+def test_window_loads_only_its_slots(filename, fromSnapshot):
+    if not fromSnapshot:
+        Timecard.snapshotPath(filename).unlink()
+    tc = Timecard(filename, since=START + dt.timedelta(days=1), until=START + dt.timedelta(days=3))
+    assert startDays(tc) == [1, 2]
+    assert list(tc.getProjects()) == ['p']
+    tc.close()
+
+
+def test_windowed_flush_keeps_unloaded_slots(filename):
+    tc = Timecard(filename, since=START + dt.timedelta(days=2))
+    addSlot(tc, tc.getProjects()['p'], 5, 'new')
+    tc.close()
+
+    with Timecard(filename) as reopened:
+        assert startDays(reopened) == [0, 1, 2, 3, 5]
+        assert len({slot.uid for slot in reopened.getRangeEntries(*ALL)}) == 5
+
+
+def test_stale_snapshot_is_ignored(filename):
+    source = Path(filename)
+    snapshotPath = Timecard.snapshotPath(filename)
+    assert Snapshot.load(snapshotPath, source) is not None
+
+    # A windowed close rewrites the file without writing a snapshot.
+    tc = Timecard(filename, since=START + dt.timedelta(days=3))
+    addSlot(tc, tc.getProjects()['p'], 4)
+    tc.close()
+    assert Snapshot.load(snapshotPath, source) is None
+    with Timecard(filename) as reopened:
+        assert startDays(reopened) == [0, 1, 2, 3, 4]
+    assert Snapshot.load(snapshotPath, source) is not None
+
+    # Same size, new mtime.
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert Snapshot.load(snapshotPath, source) is None
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import datetime as dt
+import heapq
+import itertools
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Finding:
+    """One audit result.
+
+    ``kind`` is ``'overlap'`` (``slots`` holds both slots and ``start``/``end``
+    the doubly counted interval), ``'gap'`` (no slots, the uncovered
+    interval) or ``'duration'`` (one slot that ends at or before it starts).
+    """
+    kind: str
+    start: dt.datetime
+    end: dt.datetime
+    slots: Tuple[Any, ...] = ()
+
+    @property
+    def length(self) -> dt.timedelta:
+        return self.end - self.start
+
+
+class OverlapError(RuntimeError):
+    def __init__(self, timeslot: Any, overlaps: List[Any]):
+        super().__init__("Timeslot overlaps %d existing timeslot(s)" % len(overlaps))
+        self.timeslot = timeslot
+        self.overlaps = overlaps
+
+
+def sweep(timeslots: Iterable[Any], minGap: Optional[dt.timedelta] = None,
+          presorted: bool = False) -> List[Finding]:
+    """Report overlaps, bad durations and gaps over ``timeslots``.
+
+    Slots are visited by start time while a heap holds those still running,
+    so the pass costs O(n log n + k) for k overlapping pairs.  Gaps longer
+    than ``minGap`` are only reported within a calendar day; nights and
+    weekends are not gaps.  Slots without an end time are skipped.
+    """
+    if not presorted:
+        timeslots = sorted(timeslots, key=lambda ts: ts.getStartTime())
+    findings: List[Finding] = []
+    running: List[Tuple[dt.datetime, int, Any]] = []
+    reach: Optional[dt.datetime] = None
+    counter = itertools.count()
+    for ts in timeslots:
+        start = ts.getStartTime()
+        end = ts.getEndTime()
+        if end is None:
+            continue
+        if end <= start:
+            findings.append(Finding('duration', start, end, (ts,)))
+            continue
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for otherEnd, _, other in running:
+            findings.append(Finding('overlap', start, min(end, otherEnd), (other, ts)))
+        if minGap is not None and reach is not None and reach.date() == start.date() \
+                and start - reach > minGap:
+            findings.append(Finding('gap', reach, start))
+        if reach is None or end > reach:
+            reach = end
+        heapq.heappush(running, (end, next(counter), ts))
+    return findings
+
+
+def checkOverlap(index: Any, timeslot: Any, allowOverlap: bool = False) -> List[Any]:
+    """Slots in ``index`` overlapping ``timeslot``.
+
+    Raises ``OverlapError`` unless ``allowOverlap`` is set.  Earlier slots
+    are found through the index's running maximum of end times, so the
+    check stays exact after overlaps have been accepted.
+    """
+    start = timeslot.getStartTime()
+    end = timeslot.getEndTime()
+    if end is None or end <= start:
+        return []
+    overlaps = index.overlapping(start, end)
+    if overlaps and not allowOverlap:
+        raise OverlapError(timeslot, overlaps)
+    return overlaps
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+from timecard.xml_database import Timecard as XmlTimecard
+
+# (project name, activity code) -> seconds
+Partial = Dict[Tuple[str, str], int]
+
+
+@dataclass
+class FileSummary:
+    path: str
+    slots: int = 0
+    totals: Partial = field(default_factory=dict)
+    first: Optional[int] = None
+    last: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return Path(self.path).stem
+
+    @property
+    def seconds(self) -> int:
+        return sum(self.totals.values())
+
+
+def summarizeFile(path: str, since: Optional[int] = None, until: Optional[int] = None) -> FileSummary:
+    """Totals for one ``xml_database`` file (and its journal).
+
+    Records are streamed and folded into integer sums by project UUID; only
+    this small summary goes back to the parent process.
+    """
+    summary = FileSummary(path)
+    names: Dict[str, str] = {}
+    byUid: Dict[Tuple[str, str], int] = {}
+    try:
+        for tag, data in XmlTimecard.readRecords(path):
+            if tag == XmlTimecard.PROJECT_TAG:
+                names[data['uuid']] = data['name']
+                continue
+            start = data.get('startTime')
+            end = data.get('endTime')
+            if start is None or end is None or not data.get('project') or not data.get('activity'):
+                continue
+            start = int(start)
+            if (since is not None and start < since) or (until is not None and start >= until):
+                continue
+            key = (data['project'], data['activity'])
+            byUid[key] = byUid.get(key, 0) + int(end) - start
+            summary.slots += 1
+            if summary.first is None or start < summary.first:
+                summary.first = start
+            if summary.last is None or start > summary.last:
+                summary.last = start
+    except Exception as e:
+        summary.error = f'{type(e).__name__}: {e}'
+    for (uid, activity), seconds in byUid.items():
+        key = (names.get(uid, f'Unknown({uid[:8]})'), activity)
+        summary.totals[key] = summary.totals.get(key, 0) + seconds
+    return summary
+
+
+def _summarize(args: Tuple[str, Optional[int], Optional[int]]) -> FileSummary:
+    return summarizeFile(*args)
+
+
+def batchReport(paths: Iterable[Path], workers: Optional[int] = None,
+                since: Optional[int] = None, until: Optional[int] = None) -> List[FileSummary]:
+    """Summarize many files on a process pool, in the order given.
+
+    Larger files are submitted first so that one big file does not leave
+    the other workers idle at the end.
+    """
+    paths = [path.as_posix() for path in paths]
+    order = sorted(range(len(paths)), key=lambda i: -os.path.getsize(paths[i]))
+    summaries: List[Optional[FileSummary]] = [None] * len(paths)
+    if workers == 1 or len(paths) <= 1:
+        for i in order:
+            summaries[i] = summarizeFile(paths[i], since, until)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_summarize, [(paths[i], since, until) for i in order])
+            for i, summary in zip(order, results):
+                summaries[i] = summary
+    return [summary for summary in summaries if summary is not None]
+
+
+def merge(summaries: Iterable[FileSummary]) -> Partial:
+    totals: Partial = {}
+    for summary in summaries:
+        for key, seconds in summary.totals.items():
+            totals[key] = totals.get(key, 0) + seconds
+    return totals
+
+
+def writeCsv(summaries: List[FileSummary], f: TextIO) -> None:
+    writer = csv.writer(f)
+    writer.writerow(('file', 'project', 'activity', 'hours'))
+    for summary in summaries:
+        for (project, activity), seconds in sorted(summary.totals.items()):
+            writer.writerow((summary.name, project, activity, round(seconds / 3600, 4)))
+    for (project, activity), seconds in sorted(merge(summaries).items()):
+        writer.writerow(('TOTAL', project, activity, round(seconds / 3600, 4)))
+
+
+def writeJson(summaries: List[FileSummary], f: TextIO) -> None:
+    def totals(partial: Partial) -> List[Dict[str, object]]:
+        return [{'project': project, 'activity': activity, 'hours': round(seconds / 3600, 4)}
+                for (project, activity), seconds in sorted(partial.items())]
+
+    json.dump({
+        'files': [{'file': summary.path,
+                   'name': summary.name,
+                   'slots': summary.slots,
+                   'first': summary.first,
+                   'last': summary.last,
+                   'error': summary.error,
+                   'totals': totals(summary.totals)}
+                  for summary in summaries],
+        'totals': totals(merge(summaries))
+    }, f, indent=2)
+    f.write('\n')
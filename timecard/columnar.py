@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import datetime as dt
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from uuid import UUID
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.rollup import Rollup, byProjectUid
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is an optional extra
+    np = None
+
+ACTIVITIES: List[Activity] = list(Activity)
+ACTIVITY_CODES: Dict[Activity, int] = {activity: code for code, activity in enumerate(ACTIVITIES)}
+NO_CODE = -1
+NO_END = np.iinfo(np.int64).min if np is not None else None
+
+
+class ColumnarStore:
+    """A query index over timeslots, held as parallel NumPy columns.
+
+    Start and end times are int64 epoch seconds, projects and activities are
+    int32 codes, UUIDs are two uint64 halves and messages live in one shared
+    UTF-8 buffer addressed by an offset/length table.  Rows are kept sorted
+    by start time (lazily, if slots arrive out of order) so range queries are
+    a ``searchsorted`` and totals are a single ``bincount`` group-by.
+
+    It offers the same query surface as ``TimeslotIndex``; ``Timeslot``
+    objects are only built for the rows a caller asks for.  It is an index,
+    not the storage: a columnar ``Timecard`` still keeps its ``Timeslot``
+    list for editing and persistence, so the columns add to its memory
+    rather than replace it.
+    """
+
+    COLUMNS = {
+        'start': 'int64',
+        'end': 'int64',
+        'project': 'int32',
+        'activity': 'int32',
+        'uuidHi': 'uint64',
+        'uuidLo': 'uint64',
+        'msgOffset': 'int64',
+        'msgLength': 'int32',
+    }
+
+    def __init__(self, timeslots: Iterable[Timeslot] = (), capacity: int = 1024):
+        if np is None:
+            raise RuntimeError("numpy is required for the columnar store")
+        self._size = 0
+        self._cols: Dict[str, np.ndarray] = {
+            name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self._msgBuffer = bytearray()
+        self._projectTable: List[Union[Project, UUID]] = []
+        self._projectCodes: Dict[UUID, int] = {}
+        self._sorted = True
+        self._last: Optional[Timeslot] = None
+        self._lastEnd = NO_END
+        # Running maximum of end times in start order, built on demand.
+        self._reach: Optional[np.ndarray] = None
+        self.rebuild(timeslots)
+
+    def rebuild(self, timeslots: Iterable[Timeslot]) -> None:
+        self._size = 0
+        self._msgBuffer = bytearray()
+        self._projectTable = []
+        self._projectCodes = {}
+        self._sorted = True
+        self._last = None
+        self._lastEnd = NO_END
+        self._reach = None
+        rows = [self._row(timeslot) for timeslot in timeslots]
+        if not rows:
+            return
+        self._cols = {
+            name: np.array(values, dtype=self._cols[name].dtype)
+            for name, values in zip(self.COLUMNS, zip(*rows))}
+        self._size = len(rows)
+        starts = self._cols['start']
+        self._sorted = bool(np.all(starts[1:] >= starts[:-1]))
+        slotEnds = np.where(self._cols['end'] != NO_END, self._cols['end'], starts)
+        self.__setLast(int(np.argmax(slotEnds)))
+
+    def _row(self, timeslot: Timeslot) -> Tuple[int, int, int, int, int, int, int, int]:
+        start = int(timeslot.getStartTime().timestamp())
+        endTime = timeslot.getEndTime()
+        end = int(endTime.timestamp()) if endTime is not None else NO_END
+        activity = timeslot.getActivity()
+        uid = timeslot.uid.int
+        msg = timeslot.getMsg().encode('utf-8')
+        msgOffset = len(self._msgBuffer)
+        self._msgBuffer += msg
+        return (start,
+                end,
+                self._projectCode(timeslot.getProject()),
+                ACTIVITY_CODES[activity] if activity is not None else NO_CODE,
+                uid >> 64,
+                uid & 0xFFFFFFFFFFFFFFFF,
+                msgOffset,
+                len(msg))
+
+    def __setLast(self, row: int) -> None:
+        end = int(self._cols['end'][row])
+        self._last = self.view(row)
+        self._lastEnd = end if end != NO_END else int(self._cols['start'][row])
+
+    def _projectCode(self, project: Optional[Union[Project, UUID]]) -> int:
+        if project is None:
+            return NO_CODE
+        uid = project if isinstance(project, UUID) else project.uid
+        code = self._projectCodes.get(uid)
+        if code is None:
+            code = len(self._projectTable)
+            self._projectCodes[uid] = code
+            self._projectTable.append(project)
+        elif isinstance(project, Project):
+            self._projectTable[code] = project
+        return code
+
+    def addProject(self, project: Project) -> None:
+        self._projectCode(project)
+
+    def _grow(self) -> None:
+        capacity = max(1, 2 * len(self._cols['start']))
+        for name, column in self._cols.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._cols[name] = grown
+
+    def insert(self, timeslot: Timeslot) -> None:
+        if self._size == len(self._cols['start']):
+            self._grow()
+        row = self._size
+        values = self._row(timeslot)
+        for name, value in zip(self.COLUMNS, values):
+            self._cols[name][row] = value
+        if row > 0 and values[0] < self._cols['start'][row - 1]:
+            self._sorted = False
+        self._size += 1
+        self._reach = None
+
+        start, end = values[0], values[1]
+        slotEnd = end if end != NO_END else start
+        if self._last is None or slotEnd >= self._lastEnd:
+            self._last = timeslot
+            self._lastEnd = slotEnd
+
+    def _ensureSorted(self) -> None:
+        if self._sorted:
+            return
+        order = np.argsort(self._cols['start'][:self._size], kind='stable')
+        for name, column in self._cols.items():
+            column[:self._size] = column[:self._size][order]
+        self._sorted = True
+
+    def _rows(self, start: dt.datetime, end: dt.datetime) -> Tuple[int, int]:
+        self._ensureSorted()
+        starts = self._cols['start'][:self._size]
+        lo = int(np.searchsorted(starts, int(start.timestamp()), side='left'))
+        hi = int(np.searchsorted(starts, int(end.timestamp()), side='left'))
+        return lo, max(lo, hi)
+
+    def view(self, row: int) -> Timeslot:
+        cols = self._cols
+        projectCode = int(cols['project'][row])
+        activityCode = int(cols['activity'][row])
+        end = int(cols['end'][row])
+        msgOffset = int(cols['msgOffset'][row])
+        msg = bytes(self._msgBuffer[msgOffset:msgOffset + int(cols['msgLength'][row])])
+        return Timeslot(
+            project=self._projectTable[projectCode] if projectCode != NO_CODE else None,
+            startTime=dt.datetime.fromtimestamp(int(cols['start'][row])),
+            endTime=dt.datetime.fromtimestamp(end) if end != NO_END else None,
+            activity=ACTIVITIES[activityCode] if activityCode != NO_CODE else None,
+            uid=UUID(int=(int(cols['uuidHi'][row]) << 64) | int(cols['uuidLo'][row])),
+            msg=msg.decode('utf-8'))
+
+    def range(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        lo, hi = self._rows(start, end)
+        return [self.view(row) for row in range(lo, hi)]
+
+    def overlapping(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        lo, hi = self._rows(start, end)
+        ends = self._cols['end'][:self._size]
+        slotEnds = np.where(ends != NO_END, ends, self._cols['start'][:self._size])
+        if self._reach is None:
+            self._reach = np.maximum.accumulate(slotEnds)
+        startEpoch = int(start.timestamp())
+        # _reach never decreases, so every earlier slot still running at
+        # start lies at or after the first row whose reach passes it.
+        first = int(np.searchsorted(self._reach[:lo], startEpoch, side='right'))
+        earlier = first + np.flatnonzero(slotEnds[first:lo] > startEpoch)
+        return [self.view(int(row)) for row in earlier] + [self.view(row) for row in range(lo, hi)]
+
+    def day(self, date: dt.date) -> List[Timeslot]:
+        start = dt.datetime.combine(date, dt.time.min)
+        return self.range(start, start + dt.timedelta(days=1))
+
+    def week(self, year: int, weekNum: int) -> List[Timeslot]:
+        start = dt.datetime.combine(dt.date.fromisocalendar(year, weekNum, 1), dt.time.min)
+        return self.range(start, start + dt.timedelta(weeks=1))
+
+    def last(self) -> Optional[Timeslot]:
+        return self._last
+
+    def totals(self, start: dt.datetime, end: dt.datetime) -> Dict[Tuple[Union[Project, UUID], Activity], dt.timedelta]:
+        lo, hi = self._rows(start, end)
+        cols = self._cols
+        projects = cols['project'][lo:hi]
+        activities = cols['activity'][lo:hi]
+        ends = cols['end'][lo:hi]
+        valid = (projects != NO_CODE) & (activities != NO_CODE) & (ends != NO_END)
+        keys = projects[valid].astype(np.int64) * len(ACTIVITIES) + activities[valid]
+        durations = ends[valid] - cols['start'][lo:hi][valid]
+        sums = np.bincount(keys, weights=durations,
+                           minlength=len(self._projectTable) * len(ACTIVITIES))
+        report: Dict[Tuple[Union[Project, UUID], Activity], dt.timedelta] = {}
+        # Keys with slots, even if they add up to nothing.
+        for key in np.unique(keys):
+            projectCode, activityCode = divmod(int(key), len(ACTIVITIES))
+            report[(self._projectTable[projectCode], ACTIVITIES[activityCode])] = \
+                dt.timedelta(seconds=int(sums[key]))
+        return report
+
+    def rollup(self) -> ColumnarRollup:
+        return ColumnarRollup(self)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        self._ensureSorted()
+        return (self.view(row) for row in range(self._size))
+
+
+class ColumnarRollup:
+    """``Rollup`` interface answered by vectorized group-bys on a store.
+
+    The store is already maintained through its index calls, so ``add`` has
+    nothing to do here and callers that rebuild the index need not call
+    ``rebuild``; it is for repairing the store after ``verify``.
+    """
+
+    def __init__(self, store: ColumnarStore):
+        self._store = store
+
+    def add(self, timeslot: Timeslot) -> None:
+        pass
+
+    def rebuild(self, timeslots: Iterable[Timeslot]) -> None:
+        self._store.rebuild(timeslots)
+
+    def addProject(self, project: Project) -> None:
+        self._store.addProject(project)
+
+    def day(self, date: dt.date):
+        start = dt.datetime.combine(date, dt.time.min)
+        return self._store.totals(start, start + dt.timedelta(days=1))
+
+    def week(self, year: int, weekNum: int):
+        start = dt.datetime.combine(dt.date.fromisocalendar(year, weekNum, 1), dt.time.min)
+        return self._store.totals(start, start + dt.timedelta(weeks=1))
+
+    def range(self, start: dt.datetime, end: dt.datetime):
+        return self._store.totals(start, end)
+
+    def verify(self, timeslots: Iterable[Timeslot]):
+        timeslots = list(timeslots)
+        expected = Rollup(timeslots)
+        dates = {timeslot.getStartTime().date() for timeslot in timeslots}
+        weeks = {date.isocalendar()[:2] for date in dates}
+        buckets = [(date, expected.day(date), self.day(date)) for date in sorted(dates)]
+        buckets += [(week, expected.week(*week), self.week(*week)) for week in sorted(weeks)]
+        mismatches = []
+        for bucketKey, wanted, actual in buckets:
+            wanted = byProjectUid(wanted)
+            actual = byProjectUid(actual)
+            # The store keeps whole seconds.
+            for key in set(wanted) | set(actual):
+                if int(wanted.get(key, dt.timedelta(0)).total_seconds()) != \
+                        int(actual.get(key, dt.timedelta(0)).total_seconds()):
+                    mismatches.append((bucketKey, key))
+        return mismatches
@@ -11,11 +11,17 @@ import timecard
 class Config:
     __instance: Optional[Config] = None
 
+    BACKENDS = ('firebase', 'xml', 'sqlite', 'mmap')
+
     SCHEMA = schema.Schema(
         {
             'logPath': str,
             'email': str,
-            'password': str
+            'password': str,
+            schema.Optional('backend'): schema.Or(*BACKENDS),
+            schema.Optional('dataPath'): str,
+            schema.Optional('dumpMetrics'): bool,
+            schema.Optional('rejectOverlaps'): bool
         }
     )
 
@@ -39,6 +45,10 @@ class Config:
         self.__logPath = data['logPath']
         self.__email = data['email']
         self.__password = data['password']
+        self.__backend = data.get('backend', 'firebase')
+        self.__dataPath = data.get('dataPath', None)
+        self.__dumpMetrics = data.get('dumpMetrics', False)
+        self.__rejectOverlaps = data.get('rejectOverlaps', False)
 
     @property
     def logPath(self) -> Path:
@@ -52,6 +62,25 @@ class Config:
     def password(self) -> str:
         return self.__password
 
+    @property
+    def backend(self) -> str:
+        return self.__backend
+
+    @property
+    def dataPath(self) -> Path:
+        if self.__dataPath is not None:
+            return Path(self.__dataPath)
+        extension = {'xml': 'xml', 'sqlite': 'db'}.get(self.__backend, 'dat')
+        return Path(appdirs.user_data_dir(appname=timecard.__appname__), f'timecard.{extension}')
+
+    @property
+    def dumpMetrics(self) -> bool:
+        return self.__dumpMetrics
+
+    @property
+    def rejectOverlaps(self) -> bool:
+        return self.__rejectOverlaps
+
     @classmethod
     def instance(cls, *, configPath: Path=None) -> Config:
         if cls.__instance is None:
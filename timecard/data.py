@@ -1,8 +1,9 @@
 from __future__ import annotations
 import datetime as dt
 import enum
+import sys
 import uuid
-from typing import Any, Optional, Dict, Union
+from typing import Any, Optional, Dict, List, Tuple, Type, Union
 from uuid import UUID
 
 import schema
@@ -18,15 +19,17 @@ class Activity(enum.Enum):
 
 
 class Project(Serializable):
+    __slots__ = ('_name', '_desc', '_uuid')
 
     def __init__(self, name: str, desc: str, uid: UUID = None):
         self._validateName(name)
         self._name: str = name
         self._desc: str = desc
+        # Kept as the 128-bit int; UUID objects are built on demand.
         if uid is None:
-            self._uuid: uuid.UUID = uuid.uuid4()
+            self._uuid: int = uuid.uuid4().int
         else:
-            self._uuid = uid
+            self._uuid = uid.int
 
     @property
     def name(self) -> str:
@@ -47,7 +50,7 @@ class Project(Serializable):
 
     @property
     def uid(self) -> UUID:
-        return self._uuid
+        return UUID(int=self._uuid)
 
     def _validateName(self, name: str):
         if name.find('.') > 0:
@@ -60,13 +63,25 @@ class Project(Serializable):
         {
             'name': str,
             'desc': str,
-            'uuid': str
+            'uuid': str,
+            schema.Optional('updated'): int
         }
     )
+    FIELDS = {
+        'name': str,
+        'desc': str,
+        'uuid': str,
+        'updated': int
+    }
+    OPTIONAL_FIELDS = frozenset({'updated'})
 
     @classmethod
     def fromDict(cls, data: dict) -> Project:
         cls.SCHEMA.validate(data)
+        return cls._fromTrustedDict(data)
+
+    @classmethod
+    def _fromTrustedDict(cls, data: Dict[str, Any]) -> Project:
         return Project(
             name=data['name'],
             desc=data['desc'],
@@ -78,7 +93,7 @@ class Project(Serializable):
         return {
             "name": self._name,
             "desc": self._desc,
-            "uuid": self._uuid.hex
+            "uuid": '%032x' % self._uuid
         }
 
     def complete(self, objects: Dict[UUID, Serializable]):
@@ -88,6 +103,16 @@ class Project(Serializable):
         return True
 
 class Timeslot (Serializable):
+    """A span of work on a project.
+
+    Times are stored as int epoch seconds (what ``toDict`` persists); the
+    ``datetime`` returned by the getters is built on first use and cached,
+    or is the exact value passed in.  The UUID is stored as its 128-bit int
+    and messages are interned, since long histories repeat them a lot.
+    """
+    __slots__ = ('_startEpoch', '_endEpoch', '_startCache', '_endCache',
+                 '_project', '_activity', '_msg', '_uuid')
+
     def __init__(self, 
                  project: Optional[Union[Project, UUID]] = None,
                  startTime: Optional[dt.datetime] = None,
@@ -97,25 +122,42 @@ class Timeslot (Serializable):
                  msg: str = ""):
         if not startTime:
             startTime = dt.datetime.now()
-        self._start: dt.datetime = startTime
-        self._end: Optional[dt.datetime] = endTime
+        self._startEpoch: int = int(startTime.timestamp())
+        self._startCache: Optional[dt.datetime] = startTime
+        self._endEpoch: Optional[int] = int(endTime.timestamp()) if endTime else None
+        self._endCache: Optional[dt.datetime] = endTime
         self._project = project
         self._activity: Optional[Activity] = activity
-        self._msg: str = msg
+        self._msg: str = sys.intern(msg)
         if uid:
-            self._uuid = uid
+            self._uuid: int = uid.int
         else:
-            self._uuid = uuid.uuid4()
+            self._uuid = uuid.uuid4().int
+
+    @classmethod
+    def _fromFields(cls, startEpoch: int, endEpoch: Optional[int], project: Optional[Union[Project, UUID]],
+                    activity: Optional[Activity], uid: int, msg: str) -> Timeslot:
+        # Skips the datetime round trip when loading stored slots.
+        timeslot = cls.__new__(cls)
+        timeslot._startEpoch = startEpoch
+        timeslot._startCache = None
+        timeslot._endEpoch = endEpoch
+        timeslot._endCache = None
+        timeslot._project = project
+        timeslot._activity = activity
+        timeslot._msg = sys.intern(msg)
+        timeslot._uuid = uid
+        return timeslot
 
     @property
     def uid(self) -> UUID:
-        return self._uuid
+        return UUID(int=self._uuid)
 
     def __str__(self) -> str:
-        return f'Timeslot({self._start}, {self._end}, {self._project}, {self._activity}, {self._uuid}, {self._msg})'
+        return f'Timeslot({self.getStartTime()}, {self.getEndTime()}, {self._project}, {self._activity}, {self.uid}, {self._msg})'
 
     def __repr__(self) -> str:
-        return f'Timeslot({self._start}, {self._end}, {self._project}, {self._activity}, {self._uuid}, {self._msg})'
+        return f'Timeslot({self.getStartTime()}, {self.getEndTime()}, {self._project}, {self._activity}, {self.uid}, {self._msg})'
 
     def setProject(self, project: Project, activity: Activity):
         self._project = project
@@ -130,34 +172,48 @@ class Timeslot (Serializable):
     def setEndTime(self, endTime: dt.datetime = None):
         if endTime is None:
             endTime = dt.datetime.now()
-        if endTime <= self._start:
+        if endTime <= self.getStartTime():
             raise RuntimeError("Slot cannot end before start")
-        self._end = endTime
+        self._endEpoch = int(endTime.timestamp())
+        self._endCache = endTime
 
     def getEndTime(self) -> Optional[dt.datetime]:
-        return self._end
+        if self._endCache is None and self._endEpoch is not None:
+            self._endCache = dt.datetime.fromtimestamp(self._endEpoch)
+        return self._endCache
 
     def setStartTime(self, startTime: dt.datetime):
-        self._start = startTime
+        self._startEpoch = int(startTime.timestamp())
+        self._startCache = startTime
 
     def getStartTime(self) -> dt.datetime:
-        return self._start
+        if self._startCache is None:
+            self._startCache = dt.datetime.fromtimestamp(self._startEpoch)
+        return self._startCache
+
+    def getStartEpoch(self) -> int:
+        return self._startEpoch
+
+    def getEndEpoch(self) -> Optional[int]:
+        return self._endEpoch
 
     def getTotalTime(self) -> dt.timedelta:
-        if not self._end:
+        # From the epochs, whether or not the datetimes are cached: naive
+        # local datetimes are off by an hour across a DST change.
+        if self._endEpoch is None:
             return dt.timedelta(0)
-        return self._end - self._start
+        return dt.timedelta(seconds=self._endEpoch - self._startEpoch)
 
     def __lt__(self, other):
         if not isinstance(other, Timeslot):
             return False
-        return self._start < other._start
+        return self._startEpoch < other._startEpoch
 
     def getMsg(self) -> str:
         return self._msg
 
     def setMsg(self, msg: str):
-        self._msg = msg
+        self._msg = sys.intern(msg)
 
     def toDict(self) -> Dict[str, Any]:
         if isinstance(self._project, UUID):
@@ -170,15 +226,11 @@ class Timeslot (Serializable):
             activity = self._activity.value
         else:
             activity = None
-        if self._end:
-            endTime = int(self._end.timestamp())
-        else:
-            endTime = None
         retval = {
-            "startTime": int(self._start.timestamp()),
-            "endTime": endTime,
+            "startTime": self._startEpoch,
+            "endTime": self._endEpoch,
             "project": project,
-            "uuid": self._uuid.hex,
+            "uuid": '%032x' % self._uuid,
             "msg": self._msg,
             'activity': activity
         }
@@ -191,21 +243,35 @@ class Timeslot (Serializable):
             'project': str,
             'uuid': str,
             schema.Optional('msg'): str,
-            'activity': str
+            'activity': str,
+            schema.Optional('updated'): int
         }
     )
+    FIELDS = {
+        'startTime': int,
+        'endTime': int,
+        'project': str,
+        'uuid': str,
+        'msg': str,
+        'activity': str,
+        'updated': int
+    }
+    OPTIONAL_FIELDS = frozenset({'msg', 'updated'})
 
     @classmethod
     def fromDict(cls, data: dict) -> Timeslot:
         cls.SCHEMA.validate(data)
+        return cls._fromTrustedDict(data)
 
-        return Timeslot(
-            startTime=dt.datetime.fromtimestamp(float(data['startTime'])),
-            endTime=dt.datetime.fromtimestamp(float(data['endTime'])),
+    @classmethod
+    def _fromTrustedDict(cls, data: Dict[str, Any]) -> Timeslot:
+        return Timeslot._fromFields(
+            startEpoch=data['startTime'],
+            endEpoch=data['endTime'],
             project=UUID(data['project']),
             activity=Activity(data['activity']),
-            uid=uuid.UUID(data['uuid']),
-            msg=data['msg'])
+            uid=int(data['uuid'], 16),
+            msg=data.get('msg', ''))
 
     def complete(self, objects: Dict[UUID, Serializable]):
         if isinstance(self._project, UUID):
@@ -213,6 +279,16 @@ class Timeslot (Serializable):
             if project_obj is not None:
                 self._project = project_obj
 
+    def references(self) -> List[Tuple[Type[Serializable], UUID]]:
+        if isinstance(self._project, UUID):
+            return [(Project, self._project)]
+        return []
+
+    def bind(self, obj: Serializable):
+        if not isinstance(obj, Project) or not isinstance(self._project, UUID) or obj.uid != self._project:
+            raise RuntimeError(f'{obj} is not referenced by {self}')
+        self._project = obj
+
     def isComplete(self) -> bool:
         return isinstance(self._project, Project)
 
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import bz2
+import contextlib
+import csv
+import datetime as dt
+import gzip
+import json
+import lzma
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TextIO, Tuple
+
+from timecard.config import Config
+from timecard.xml_database import Timecard as XmlTimecard
+
+COLUMNS = ('project', 'activity', 'start', 'end', 'hours', 'msg')
+COMPRESSORS: Dict[str, Callable[..., TextIO]] = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open
+}
+SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+
+Record = Tuple[str, Dict[str, Any]]
+
+
+def backendRecords(config: Config, start: Optional[dt.datetime] = None,
+                   end: Optional[dt.datetime] = None) -> Iterator[Record]:
+    """``(tag, toDict())`` records of the configured backend, projects first.
+
+    The XML file is parsed incrementally, sqlite rows come off a cursor and
+    mmap records are decoded one at a time, so none is loaded whole.
+    Firebase keeps its data in memory already and is read through the open
+    Timecard.
+    """
+    if config.backend == 'xml':
+        yield from XmlTimecard.readRecords(config.dataPath.as_posix())
+    elif config.backend == 'sqlite':
+        from timecard.sqlite_database import Timecard as SqliteTimecard
+        with SqliteTimecard(config.dataPath.as_posix()) as tc:
+            yield from tc.readRecords(start, end)
+    elif config.backend == 'mmap':
+        from timecard.mmap_database import Timecard as MmapTimecard
+        # Read-only: a live CLI session may hold the file for writing.
+        with MmapTimecard(config.dataPath.as_posix(), readOnly=True) as tc:
+            yield from tc.readRecords(start, end)
+    elif config.backend == 'firebase':
+        from timecard.firebase import Timecard as FirebaseTimecard
+        tc = FirebaseTimecard()
+        try:
+            for project in tc.getProjects().values():
+                yield XmlTimecard.PROJECT_TAG, project.toDict()
+            for timeslot in tc.getRangeEntries(start or dt.datetime.min, end or dt.datetime.max):
+                yield XmlTimecard.TIMESLOT_TAG, timeslot.toDict()
+        finally:
+            tc.close()
+    else:
+        raise RuntimeError(f'Unknown backend {config.backend}')
+
+
+def resolveRows(records: Iterable[Record], start: Optional[dt.datetime] = None,
+                end: Optional[dt.datetime] = None) -> Iterator[Dict[str, Any]]:
+    """Turn records into export rows, keeping only finished slots starting
+    in ``[start, end)``.  Only the project name table is held in memory."""
+    names: Dict[str, str] = {}
+    lo = int(start.timestamp()) if start else None
+    hi = int(end.timestamp()) if end else None
+    for tag, data in records:
+        if tag == XmlTimecard.PROJECT_TAG:
+            names[data['uuid']] = data['name']
+            continue
+        startTime = data.get('startTime')
+        endTime = data.get('endTime')
+        if startTime is None or endTime is None:
+            continue
+        startTime = int(startTime)
+        endTime = int(endTime)
+        if (lo is not None and startTime < lo) or (hi is not None and startTime >= hi):
+            continue
+        project = data.get('project') or ''
+        yield {
+            'project': names.get(project, f'Unknown({project[:8]})'),
+            'activity': data.get('activity') or '',
+            'start': dt.datetime.fromtimestamp(startTime).isoformat(),
+            'end': dt.datetime.fromtimestamp(endTime).isoformat(),
+            'hours': round((endTime - startTime) / 3600, 4),
+            'msg': data.get('msg') or ''
+        }
+
+
+def writeCsv(rows: Iterable[Dict[str, Any]], f: TextIO) -> int:
+    writer = csv.DictWriter(f, fieldnames=COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def writeJsonl(rows: Iterable[Dict[str, Any]], f: TextIO) -> int:
+    count = 0
+    for row in rows:
+        f.write(json.dumps(row, ensure_ascii=False))
+        f.write('\n')
+        count += 1
+    return count
+
+
+WRITERS: Dict[str, Callable[[Iterable[Dict[str, Any]], TextIO], int]] = {
+    'csv': writeCsv,
+    'jsonl': writeJsonl
+}
+
+
+@contextlib.contextmanager
+def openOutput(path: Optional[Path], compression: Optional[str] = None) -> Iterator[TextIO]:
+    """Open ``path`` for text output, or stdout when it is None.
+
+    Compression defaults to the one matching the file suffix.
+    """
+    if compression is None and path is not None:
+        compression = SUFFIXES.get(path.suffix)
+    if path is None:
+        if compression is None:
+            yield sys.stdout
+            return
+        f = COMPRESSORS[compression](sys.stdout.buffer, 'wt', newline='', encoding='utf-8')
+    elif compression is None:
+        f = open(path, 'w', newline='', encoding='utf-8')
+    else:
+        f = COMPRESSORS[compression](path, 'wt', newline='', encoding='utf-8')
+    with f:
+        yield f
+
+
+def export(records: Iterable[Record], fmt: str, path: Optional[Path] = None,
+           compression: Optional[str] = None, start: Optional[dt.datetime] = None,
+           end: Optional[dt.datetime] = None) -> int:
+    """Write the slots in ``records`` as ``fmt``; returns the row count."""
+    with openOutput(path, compression) as f:
+        return WRITERS[fmt](resolveRows(records, start, end), f)
@@ -1,17 +1,338 @@
+import asyncio
 import datetime as dt
+import json
+import os
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
-from urllib.error import HTTPError
+from typing import Any, Coroutine, Dict, Iterable, List, Optional, Set, Tuple, TypeVar, Union
+from urllib.parse import quote, urlencode, urlsplit
 from uuid import UUID
 
-import pyrebase
-from pyrebase.pyrebase import Database, Firebase
+import appdirs
+import requests
+import requests.adapters
 
+import timecard
+from timecard.audit import Finding, checkOverlap, sweep
 from timecard.config import Config
+from timecard.columnar import ColumnarRollup, ColumnarStore
 from timecard.data import Activity, Project, Timeslot
-from timecard.serializable import Serializable
+from timecard.index import TimeslotIndex
+from timecard.journal import Journal, replaceAtomically
+from timecard.metrics import Metrics
+from timecard.rollup import Rollup
+from timecard.serializable import ObjectRegistry, Reference
+from timecard.snapshot import Snapshot
+from timecard.sync import DeltaSync, Records
+from timecard.write_queue import WriteQueue, WriteQueueStatus
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+T = TypeVar('T')
+
+
+def dumpJson(value: Any) -> bytes:
+    with Metrics.instance().timer('phases', 'serialize'):
+        if orjson is not None:
+            return orjson.dumps(value)
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def loadJson(data: bytes) -> Any:
+    with Metrics.instance().timer('phases', 'parse'):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+class HTTPError(OSError):
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+        self.body = body
+
+    @property
+    def permanent(self) -> bool:
+        """Client errors that resending the same request will not fix."""
+        return 400 <= self.status < 500 and self.status not in (401, 408, 429)
+
+
+class AuthError(HTTPError):
+    """An HTTPError from the Auth endpoints (sign-in or token refresh)."""
+
+
+class ConnectionPool:
+    """A shared ``requests`` session behind the clients' async interface.
+
+    Requests run on ``maxConnections`` worker threads and the session keeps
+    as many keep-alive connections per host, so TLS and TCP setup are paid
+    once rather than per call.  Proxies from the environment, redirects,
+    compression and chunked bodies are left to requests.  Transport failures
+    are raised as ``ConnectionError``.
+    """
+
+    def __init__(self, maxConnections: int = 8, timeout: float = 30.0):
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=maxConnections, pool_maxsize=maxConnections,
+                                                max_retries=1)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=maxConnections, thread_name_prefix='firebase-http')
+        self.requestCount = 0
+
+    async def request(self, method: str, url: str, body: Optional[bytes] = None,
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        self.requestCount += 1
+        Metrics.instance().count('httpRequests')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.__send, method, url, body, headers)
+
+    def __send(self, method: str, url: str, body: Optional[bytes],
+               headers: Optional[Dict[str, str]]) -> Tuple[int, bytes]:
+        try:
+            response = self._session.request(method, url, data=body, headers=headers, timeout=self._timeout)
+            data = response.content
+        except requests.RequestException as e:
+            # Not str(e): requests puts the URL, and so the auth token, in it.
+            raise ConnectionError(f"{method} {urlsplit(url).path}: {type(e).__name__}") from e
+        Metrics.instance().addBytes(sent=len(body or b''), received=len(data))
+        return response.status_code, data
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+
+def decodeResponse(data: bytes) -> Any:
+    try:
+        return loadJson(data)
+    except ValueError as e:
+        # A truncated or garbled body is a transport failure like any other.
+        raise ConnectionError(f"Malformed response: {e}") from e
+
+
+class AuthClient:
+    """Email/password sign-in and ID token refresh against Firebase Auth."""
+
+    IDENTITY_TOOLKIT_URL = 'https://identitytoolkit.googleapis.com/v1'
+    SECURE_TOKEN_URL = 'https://securetoken.googleapis.com/v1'
+
+    def __init__(self, pool: ConnectionPool, apiKey: str,
+                 identityToolkitURL: Optional[str] = None, secureTokenURL: Optional[str] = None):
+        self._pool = pool
+        self._apiKey = apiKey
+        self._identityToolkitURL = (identityToolkitURL or self.IDENTITY_TOOLKIT_URL).rstrip('/')
+        self._secureTokenURL = (secureTokenURL or self.SECURE_TOKEN_URL).rstrip('/')
+
+    async def signIn(self, email: str, password: str) -> Dict[str, Any]:
+        url = f'{self._identityToolkitURL}/accounts:signInWithPassword?{urlencode({"key": self._apiKey})}'
+        body = dumpJson({'email': email, 'password': password, 'returnSecureToken': True})
+        status, data = await self._pool.request('POST', url, body, {'Content-Type': 'application/json'})
+        if status >= 400:
+            raise AuthError(status, data)
+        return decodeResponse(data)
+
+    async def refresh(self, refreshToken: str) -> Dict[str, Any]:
+        url = f'{self._secureTokenURL}/token?{urlencode({"key": self._apiKey})}'
+        body = urlencode({'grant_type': 'refresh_token', 'refresh_token': refreshToken}).encode('ascii')
+        status, data = await self._pool.request('POST', url, body,
+                                                {'Content-Type': 'application/x-www-form-urlencoded'})
+        if status >= 400:
+            raise AuthError(status, data)
+        user = decodeResponse(data)
+        # The token endpoint answers in snake_case; match signIn's keys.
+        return {
+            'idToken': user['id_token'],
+            'refreshToken': user['refresh_token'],
+            'expiresIn': user['expires_in'],
+            'localId': user['user_id']
+        }
+
+
+class TokenManager:
+    """Holds the signed-in user's ID token and keeps it fresh.
+
+    The refresh token is persisted (mode 0600) in the session file next to
+    the email and localId, so a later start can resume without the password.
+    The ID token is refreshed ``margin`` seconds before ``expiresIn`` runs
+    out, and callers that need a refresh at the same time share one request.
+    All coroutines must run on the FirebaseClient loop.
+    """
+
+    def __init__(self, auth: AuthClient, sessionPath: Optional[Path] = None, margin: float = 300.0):
+        self._auth = auth
+        self._sessionPath = sessionPath
+        self._margin = margin
+        self._email: Optional[str] = None
+        self._localId: Optional[str] = None
+        self._refreshToken: Optional[str] = None
+        self._idToken: Optional[str] = None
+        self._expires = 0.0
+        self._refreshing: Optional[asyncio.Future] = None
+
+    class NotSignedIn(RuntimeError):
+        pass
+
+    @property
+    def localId(self) -> Optional[str]:
+        return self._localId
+
+    @property
+    def canRefresh(self) -> bool:
+        return self._refreshToken is not None
+
+    def load(self, email: str) -> Optional[str]:
+        """Restore the session saved for ``email``; returns its localId."""
+        if self._sessionPath is None or not self._sessionPath.is_file():
+            return None
+        try:
+            with open(self._sessionPath, 'r') as f:
+                session = json.load(f)
+        except ValueError:
+            return None
+        if session.get('email') != email:
+            return None
+        self._email = email
+        self._localId = session.get('localId')
+        self._refreshToken = session.get('refreshToken')
+        return self._localId
+
+    def save(self) -> None:
+        if self._sessionPath is None:
+            return
+        self._sessionPath.parent.mkdir(parents=True, exist_ok=True)
+        tmpPath = self._sessionPath.with_name(self._sessionPath.name + '.tmp')
+        fd = os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as f:
+            json.dump({'email': self._email, 'localId': self._localId,
+                       'refreshToken': self._refreshToken}, f)
+        replaceAtomically(tmpPath, self._sessionPath)
+
+    def __accept(self, user: Dict[str, Any]) -> None:
+        self._localId = user['localId']
+        self._refreshToken = user['refreshToken']
+        self._idToken = user['idToken']
+        self._expires = time.monotonic() + int(user['expiresIn'])
+        self.save()
+
+    async def signIn(self, email: str, password: str) -> Dict[str, Any]:
+        user = await self._auth.signIn(email, password)
+        self._email = email
+        self.__accept(user)
+        return user
+
+    async def token(self) -> str:
+        if self._idToken is not None and time.monotonic() < self._expires - self._margin:
+            return self._idToken
+        return await self.refresh()
+
+    async def refresh(self, staleToken: Optional[str] = None) -> str:
+        """Get a new ID token, joining a refresh already under way.
+
+        With ``staleToken``, a token that has already replaced it is
+        returned without another round trip.
+        """
+        if staleToken is not None and self._idToken not in (None, staleToken):
+            return self._idToken
+        if self._refreshing is None:
+            if self._refreshToken is None:
+                raise TokenManager.NotSignedIn
+            self._refreshing = asyncio.ensure_future(self._auth.refresh(self._refreshToken))
+            self._refreshing.add_done_callback(self.__refreshed)
+        user = await asyncio.shield(self._refreshing)
+        return user['idToken']
+
+    def __refreshed(self, future: asyncio.Future) -> None:
+        self._refreshing = None
+        if not future.cancelled() and future.exception() is None:
+            self.__accept(future.result())
+
+
+class RealtimeDatabase:
+    """Async client for the Realtime Database REST API.
+
+    Requests carry the ID token from ``tokens``; one that comes back 401 is
+    retried once after a refresh.
+    """
+
+    def __init__(self, pool: ConnectionPool, databaseURL: str, tokens: TokenManager):
+        self._pool = pool
+        self._baseURL = databaseURL.rstrip('/')
+        self._tokens = tokens
+
+    def _url(self, path: str, params: Dict[str, Any], token: str) -> str:
+        query = {key: json.dumps(value) for key, value in params.items()}
+        if token:
+            query['auth'] = token
+        path = quote(path.strip('/'))
+        url = f'{self._baseURL}/{path}.json' if path else f'{self._baseURL}/.json'
+        return f'{url}?{urlencode(query)}' if query else url
+
+    async def _call(self, method: str, path: str, value: Any = None, **params: Any) -> Any:
+        body = None if value is None else dumpJson(value)
+        token = await self._tokens.token()
+        status, data = await self._pool.request(method, self._url(path, params, token), body,
+                                                {'Content-Type': 'application/json'})
+        if status == 401:
+            token = await self._tokens.refresh(staleToken=token)
+            status, data = await self._pool.request(method, self._url(path, params, token), body,
+                                                    {'Content-Type': 'application/json'})
+        if status >= 400:
+            raise HTTPError(status, data)
+        return decodeResponse(data) if data else None
+
+    async def get(self, path: str, **params: Any) -> Any:
+        # Query parameters (orderBy, startAt, ...) are JSON encoded by _url.
+        return await self._call('GET', path, **params)
+
+    async def set(self, path: str, value: Any) -> Any:
+        return await self._call('PUT', path, value)
+
+    async def update(self, path: str, values: Dict[str, Any]) -> Any:
+        return await self._call('PATCH', path, values)
+
+    async def remove(self, path: str) -> None:
+        await self._call('DELETE', path)
+
+
+class FirebaseClient:
+    """Database and Auth clients sharing one pool on a background event loop.
+
+    Synchronous callers hand coroutines to ``run()``; everything on the loop
+    can overlap.
+    """
+
+    def __init__(self, config: Dict[str, str], sessionPath: Optional[Path] = None,
+                 maxConnections: int = 8, timeout: float = 30.0):
+        self.pool = ConnectionPool(maxConnections=maxConnections, timeout=timeout)
+        self.auth = AuthClient(self.pool, config['apiKey'],
+                               config.get('identityToolkitURL'), config.get('secureTokenURL'))
+        self.tokens = TokenManager(self.auth, sessionPath)
+        self.db = RealtimeDatabase(self.pool, config['databaseURL'], self.tokens)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("FirebaseClient.run() called from its own event loop")
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        async def closePool():
+            self.pool.close()
+        self.run(closePool())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
 
 
 class Timecard:
@@ -21,37 +342,109 @@ class Timecard:
         "databaseURL": "https://e4e-timecard-default-rtdb.firebaseio.com/",
         "storageBucket": "e4e-timecard.appspot.com"
     }
-    def __init__(self):
+    SESSION_FILE = 'session.json'
+
+    def __init__(self, columnar: bool = False, config: Optional[Dict[str, str]] = None,
+                 snapshotDir: Optional[Path] = None, syncInterval: float = 300.0,
+                 closeTimeout: float = 10.0):
         self._projects: Set[Project] = set()
         self._activeSlot: Optional[Timeslot] = None
         self._timeslots: List[Timeslot] = []
-
-        self.__firebase = pyrebase.initialize_app(self.config)
-        self.__token = ''
-        self.__db: Optional[Database] = None
+        self._timeslotsById: Dict[UUID, Timeslot] = {}
+        if columnar:
+            store = ColumnarStore()
+            self._index: Union[TimeslotIndex[Timeslot], ColumnarStore] = store
+            self._rollup: Union[Rollup, ColumnarRollup] = store.rollup()
+        else:
+            self._index = TimeslotIndex()
+            self._rollup = Rollup()
+
+        if snapshotDir is None:
+            snapshotDir = Path(appdirs.user_cache_dir(appname=timecard.__appname__), 'firebase')
+        self.__client = FirebaseClient(dict(self.config, **(config or {})),
+                                       sessionPath=snapshotDir.joinpath(self.SESSION_FILE))
+        self.__tokens = self.__client.tokens
+        self.__snapshotDir = snapshotDir
+        self.__syncInterval = syncInterval
+        self.__closeTimeout = closeTimeout
+        self.__lock = threading.RLock()
+        self.__registry = ObjectRegistry()
+        self.__walLock = threading.Lock()
+        self.__closed = threading.Event()
+        self.__online = threading.Event()
+        self.__sync: Optional[DeltaSync] = None
+        self.__wal: Optional[Journal] = None
+        self.__queue: Optional[WriteQueue] = None
         self.__dataRoot: Optional[Path] = None
-
-        self.authenticate(username=Config.instance().email, password=Config.instance().password)
+        self.__lastSync: Optional[float] = None
+        self.__syncError: Optional[str] = None
+
+        username = Config.instance().email
+        password = Config.instance().password
+        localId = self.__tokens.load(username)
+        if localId is None:
+            # Nothing cached for this user yet, so the first start has to
+            # wait for the network.
+            self.authenticate(username=username, password=password)
+        else:
+            self.__openLocal(localId)
+        threading.Thread(target=self.__reconcile, args=(username, password), daemon=True).start()
 
     def addProject(self, project: Project) -> None:
-        if self.__dataRoot is None or self.__db is None:
+        if self.__dataRoot is None:
             raise RuntimeError
-        for existingProject in self._projects:
-            assert(str(project) != str(existingProject))
-        self._projects.add(project)
+        with self.__lock:
+            for existingProject in self._projects:
+                assert(str(project) != str(existingProject))
+            self._projects.add(project)
+            self._rollup.addProject(project)
+            self.__registry.add(project)
 
         data = {
-            self.__dataRoot.joinpath('projects', project.uid.hex).as_posix():project.toDict()
+            self.__dataRoot.joinpath('projects', project.uid.hex).as_posix():DeltaSync.stamp(project.toDict())
         }
-        self.__db.update(data, token=self.__token)
+        self.__write(data)
+
+    def importRecords(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> Tuple[int, int]:
+        """Add ``(tag, toDict())`` records, skipping UUIDs already present.
+
+        The new records go through the WAL and the write queue, which sends
+        them as multi-path updates of up to ``maxBatch`` paths.  Returns the
+        number of projects and timeslots read.
+        """
+        if self.__dataRoot is None:
+            raise RuntimeError
+        incoming: Dict[str, List[Dict[str, Any]]] = {'projects': [], 'timeslots': []}
+        for tag, record in records:
+            if tag + 's' in incoming:
+                incoming[tag + 's'].append(record)
+        # Validate the whole batch before anything is written.
+        projects = Project.fromDicts(incoming['projects'])
+        timeslots = Timeslot.fromDicts(incoming['timeslots'])
+        data: Dict[str, Any] = {}
+        added: Dict[str, Records] = {'projects': {}, 'timeslots': {}}
+        with self.__lock:
+            fresh = [('projects', project, record) for project, record in zip(projects, incoming['projects'])
+                     if self.__registry.get(Project, project.uid) is None]
+            fresh += [('timeslots', timeslot, record) for timeslot, record in zip(timeslots, incoming['timeslots'])
+                      if timeslot.uid not in self._timeslotsById]
+        for kind, obj, record in fresh:
+            stamped = DeltaSync.stamp(record)
+            data[self.__dataRoot.joinpath(kind, obj.uid.hex).as_posix()] = stamped
+            added[kind][obj.uid.hex] = stamped
+        if data:
+            self.__write(data)
+            self.__mergeRecords(added)
+        return len(projects), len(timeslots)
 
     def start(self, startTime: dt.datetime = None) -> None:
         if self._activeSlot is not None:
             raise RuntimeError
         self._activeSlot = Timeslot(startTime=startTime)
 
-    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg:str = '') -> None:
-        if self.__db is None or self.__dataRoot is None:
+    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg:str = '',
+             allowOverlap: bool = False) -> None:
+        if self.__dataRoot is None:
             raise RuntimeError
         if project not in self._projects:
             raise RuntimeError("Project not registered")
@@ -60,137 +453,375 @@ class Timecard:
         self._activeSlot.setProject(project, activity)
         self._activeSlot.setEndTime(endTime=endTime)
         self._activeSlot.setMsg(msg)
-        self._timeslots.append(self._activeSlot)
+        with self.__lock:
+            checkOverlap(self._index, self._activeSlot, allowOverlap)
+            self._timeslots.append(self._activeSlot)
+            self._timeslotsById[self._activeSlot.uid] = self._activeSlot
+            self._index.insert(self._activeSlot)
+            self._rollup.add(self._activeSlot)
 
         self.update_timeslot(self._activeSlot)
 
         self._activeSlot = None
 
     def update_timeslot(self, timeslot: Timeslot):
+        if self.__dataRoot is None:
+            raise RuntimeError
         data = {
-            self.__dataRoot.joinpath('timeslots', timeslot.uid.hex).as_posix():timeslot.toDict()
+            self.__dataRoot.joinpath('timeslots', timeslot.uid.hex).as_posix():DeltaSync.stamp(timeslot.toDict())
         }
-        self.__db.update(data, token=self.__token)
-        
+        self.__write(data)
+
+    def __write(self, data: Dict[str, Any]):
+        # Log before queueing so a write survives until the server has it,
+        # whether or not we are online right now.
+        with self.__walLock:
+            # close() clears the WAL under this lock.
+            if self.__wal is None or self.__queue is None:
+                raise RuntimeError
+            for path, value in data.items():
+                self.__wal.append(path, value)
+                self.__recordLocally(path, value)
+            self.__queue.putMany(data)
+
+    def __recordLocally(self, path: str, value: Any):
+        if self.__sync is None or self.__dataRoot is None:
+            raise RuntimeError
+        parts = Path(path).relative_to(self.__dataRoot).parts
+        if len(parts) == 2 and parts[0] in DeltaSync.KINDS and isinstance(value, dict):
+            with self.__lock:
+                self.__sync.records[parts[0]][parts[1]] = value
+
+    def __walDrained(self):
+        # Once the server has everything, the snapshot (which already holds
+        # our writes) becomes the durable copy and the WAL can be dropped.
+        with self.__walLock:
+            if self.__wal is None or self.__sync is None or self.__queue is None:
+                return
+            if self.__queue.depth == 0:
+                with self.__lock:
+                    self.__sync.save()
+                self.__wal.reset()
+
+    def __sendUpdate(self, data: Dict[str, Any]):
+        if not self.__online.is_set():
+            raise RuntimeError("Offline")
+        self.__client.run(self.__client.db.update('', data))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until queued writes reach the server; False on timeout."""
+        if self.__queue is None:
+            raise RuntimeError
+        return self.__queue.flush(timeout)
+
+    def writeQueueStatus(self) -> WriteQueueStatus:
+        if self.__queue is None:
+            raise RuntimeError
+        return self.__queue.status()
 
+    @property
+    def online(self) -> bool:
+        return self.__online.is_set()
+
+    @property
+    def lastSync(self) -> Optional[float]:
+        return self.__lastSync
+
+    @property
+    def syncError(self) -> Optional[str]:
+        return self.__syncError
 
     def getDayTotals(self, date: dt.date = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
         if date is None:
             date = dt.date.today()
+        with self.__lock:
+            return self._rollup.day(date)
 
-        timeslots = self.getDayEntries(date)
-        report: Dict[Tuple[Project, Activity], dt.timedelta] = {}
-        for ts in timeslots:
-            ts_project = ts.getProject()
-            ts_activity = ts.getActivity()
-            if not ts_project or not ts_activity:
-                continue
-            if (ts_project, ts_activity) in report:
-                report[(ts_project, ts_activity)
-                       ] += ts.getTotalTime()
-            else:
-                report[(ts_project, ts_activity)] = ts.getTotalTime()
-        return report
-
-
-    def getWeekTotals(self, weekNum: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+
+    def getWeekTotals(self, weekNum: int = None, year: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
         if weekNum is None:
             weekNum = dt.date.today().isocalendar()[1]
-
-        timeslots = self.getWeekEntries(weekNum)
-        report: Dict[Tuple[Project, Activity], dt.timedelta] = {}
-        for ts in timeslots:
-            ts_project = ts.getProject()
-            ts_activity = ts.getActivity()
-            if not ts_project or not ts_activity:
-                continue
-            if (ts_project, ts_activity) in report:
-                report[(ts_project, ts_activity)
-                       ] += ts.getTotalTime()
-            else:
-                report[(ts_project, ts_activity)] = ts.getTotalTime()
-        return report
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        with self.__lock:
+            return self._rollup.week(year, weekNum)
+
+    def getRangeTotals(self, start: dt.datetime, end: dt.datetime) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        with self.__lock:
+            return self._rollup.range(start, end)
+
+    def verifyRollup(self, repair: bool = False) -> bool:
+        with self.__lock:
+            mismatches = self._rollup.verify(self._timeslots)
+            if mismatches and repair:
+                self._rollup.rebuild(self._timeslots)
+            return not mismatches
 
     def getDayEntries(self, date: dt.date = None) -> List[Timeslot]:
         if date is None:
             date = dt.date.today()
-        timeslots = [
-            ts for ts in self._timeslots if ts.getStartTime().date() == date]
-        return timeslots
+        with self.__lock:
+            return self._index.day(date)
 
-    def getWeekEntries(self, weekNum: int = None) -> List[Timeslot]:
+    def getWeekEntries(self, weekNum: int = None, year: int = None) -> List[Timeslot]:
         if weekNum is None:
             weekNum = dt.date.today().isocalendar()[1]
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        with self.__lock:
+            return self._index.week(year, weekNum)
 
-        timeslots = [ts for ts in self._timeslots if ts.getStartTime().date().isocalendar()[
-            1] == weekNum and ts.getStartTime().year == dt.date.today().year]
-        return timeslots
+    def getRangeEntries(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        with self.__lock:
+            return self._index.range(start, end)
+
+    def audit(self, minGap: dt.timedelta = None) -> List[Finding]:
+        with self.__lock:
+            return sweep(self._index, minGap, presorted=True)
 
     def getProjects(self) -> Dict[str, Project]:
-        return {project.name: project for project in self._projects}
+        with self.__lock:
+            return {project.name: project for project in self._projects}
 
 
     def getLastEntry(self) -> Timeslot:
-        return sorted(self._timeslots, key=lambda x:x.getEndTime())[-1]
+        with self.__lock:
+            lastEntry = self._index.last()
+        if lastEntry is None:
+            raise RuntimeError("No timeslots recorded")
+        return lastEntry
 
     def authenticate(self, username:str, password:str):
-        auth = self.__firebase.auth()
         try:
-            self.__user = auth.sign_in_with_email_and_password(username, password)
-            assert(isinstance(self.__user, dict))
-            self.__token = self.__user['idToken']
-            self.__db = self.__firebase.database()
-            self.__dataRoot = Path('data', self.__user['localId'])
-            self.__setUpDb()
-            self.__loadFromDb()
-            threading.Thread(target=self.__autoRefresh, daemon=True).start()
-        except HTTPError:
-            raise Timecard.AuthenticationError
+            user = self.__client.run(self.__tokens.signIn(username, password))
+        except HTTPError as e:
+            if e.status >= 500:
+                raise
+            raise Timecard.AuthenticationError from e
+        self.__connect(user['localId'])
     class AuthenticationError(RuntimeError):
         pass
 
-    def __setUpDb(self):
-        if self.__dataRoot is None or self.__db is None:
+    def __resume(self, username: str, password: str):
+        # A saved refresh token saves the password round trip; fall back to
+        # the password if it has been revoked.
+        try:
+            self.__client.run(self.__tokens.refresh())
+        except HTTPError as e:
+            if e.status >= 500:
+                raise
+            self.authenticate(username=username, password=password)
+            return
+        if self.__tokens.localId is None:
             raise RuntimeError
-        self.__db.update({
-            self.__dataRoot.joinpath('initialized').as_posix(): True
-        }, token=self.__token)
-    
-    def refreshAuth(self):
-        if self.__user is None:
+        self.__connect(self.__tokens.localId)
+
+    def __connect(self, localId: str):
+        if self.__dataRoot is None:
+            self.__openLocal(localId)
+        elif self.__dataRoot != Path('data', localId):
+            raise Timecard.AuthenticationError("Signed in as a different user than the cached one")
+        self.__client.run(self.__setUpDb())
+        self.__online.set()
+        if self.__queue is not None:
+            self.__queue.retryNow()
+
+    def __openLocal(self, localId: str):
+        # Serve the cached snapshot plus any unsynced writes before the
+        # network is involved.
+        self.__snapshotDir.mkdir(parents=True, exist_ok=True)
+        self.__dataRoot = Path('data', localId)
+        self.__sync = DeltaSync(self.__snapshotDir.joinpath(f'{localId}.json'))
+        self.__wal = Journal(self.__snapshotDir.joinpath(f'{localId}.wal'))
+        unsynced: Dict[str, Any] = dict(self.__wal.replay())
+        self.__wal.open()
+        self.__queue = WriteQueue(self.__sendUpdate, onDrained=self.__walDrained,
+                                  permanent=lambda e: isinstance(e, HTTPError) and e.permanent)
+
+        snapshot = Snapshot.load(self.__snapshotPath(localId), self.__sync.path)
+        if snapshot is None:
+            for path, value in unsynced.items():
+                self.__recordLocally(path, value)
+            self.__mergeRecords(self.__sync.records)
+        else:
+            self.__openSnapshot(*snapshot)
+            # Only the unsynced writes need parsing; the JSON snapshot is
+            # read later, when the first sync merges into it.
+            pending: Dict[str, Records] = {kind: {} for kind in DeltaSync.KINDS}
+            for path, value in unsynced.items():
+                self.__recordLocally(path, value)
+                parts = Path(path).relative_to(self.__dataRoot).parts
+                if len(parts) == 2 and parts[0] in DeltaSync.KINDS and isinstance(value, dict):
+                    pending[parts[0]][parts[1]] = value
+            self.__mergeRecords(pending)
+        if unsynced:
+            self.__queue.putMany(unsynced)
+
+    def __snapshotPath(self, localId: str) -> Path:
+        return self.__snapshotDir.joinpath(f'{localId}.snap')
+
+    def __openSnapshot(self, projects: List[Project], timeslots: List[Timeslot]):
+        with self.__lock:
+            self.__registry.addMany(projects)
+            self.__registry.resolve(timeslots)
+            self._projects.update(projects)
+            for project in projects:
+                self._rollup.addProject(project)
+            self._timeslots = timeslots
+            self._timeslotsById = {timeslot.uid: timeslot for timeslot in timeslots}
+            self._index.rebuild(timeslots)
+            if not isinstance(self._rollup, ColumnarRollup):
+                self._rollup.rebuild(timeslots)
+
+    async def __setUpDb(self):
+        if self.__dataRoot is None or self.__sync is None:
             raise RuntimeError
-        auth = self.__firebase.auth()
-        self.__user = auth.refresh(self.__user['refreshToken'])
-        self.__token = self.__user['idToken']
-        
-    def __autoRefresh(self):
-        while(1):
-            time.sleep(1800)
-            self.refreshAuth()
+        # Marking the user initialized and the first pull share the pool.
+        _, changed = await asyncio.gather(
+            self.__client.db.update('', {self.__dataRoot.joinpath('initialized').as_posix(): True}),
+            self.__sync.fetch(self.__client.db, self.__dataRoot.as_posix()))
+        self.__applyFetched(changed)
+        await self.__sync.backfill(self.__client.db, self.__dataRoot.as_posix())
+
+    def refreshAuth(self):
+        self.__client.run(self.__tokens.refresh())
+
+    def __reconcile(self, username: str, password: str):
+        delay = 1.0
+        while not self.__closed.is_set():
+            try:
+                if not self.__online.is_set() and self.__tokens.canRefresh:
+                    self.__resume(username=username, password=password)
+                elif not self.__online.is_set():
+                    self.authenticate(username=username, password=password)
+                elif self.__lastSync is None or time.time() - self.__lastSync >= self.__syncInterval:
+                    self.sync()
+                delay = 1.0
+                self.__closed.wait(min(self.__syncInterval, 60.0))
+            except Timecard.AuthenticationError as e:
+                self.__syncError = repr(e)
+                return
+            except (OSError, ValueError) as e:
+                # Anything the network or a bad response throws must not
+                # end this thread, or the app would never sync again.
+                self.__syncError = repr(e)
+                if isinstance(e, AuthError) and e.status < 500:
+                    # The refresh token was rejected: sign in again.  Other
+                    # 4xx answers (e.g. a query the rules reject) keep the
+                    # session and are only reported.
+                    self.__online.clear()
+                self.__closed.wait(delay)
+                delay = min(delay * 2, 300.0)
+
+    def sync(self):
+        if not self.__online.is_set():
+            raise RuntimeError("Not signed in")
+        self.__loadFromDb()
 
     def __loadFromDb(self):
-        if self.__db is None or self.__dataRoot is None:
+        if self.__dataRoot is None or self.__sync is None:
+            raise RuntimeError
+        changed = self.__client.run(self.__sync.fetch(self.__client.db, self.__dataRoot.as_posix()))
+        self.__applyFetched(changed)
+        # Records older clients left unstamped are invisible to delta pulls.
+        self.__client.run(self.__sync.backfill(self.__client.db, self.__dataRoot.as_posix()))
+
+    def __applyFetched(self, changed: Dict[str, Records]):
+        if self.__sync is None:
             raise RuntimeError
-        objMap: Dict[UUID, Serializable] = {}
-
-        response = self.__db.child(self.__dataRoot.as_posix()).get(token=self.__token)
-        data = response.val()
-
-        assert(isinstance(data, dict))
-
-        if 'projects' in data:
-            for id, project_data in data['projects'].items():
-                project_object = Project.fromDict(project_data)
-                objMap[project_object.uid] = project_object
-                self._projects.add(project_object)
-        if 'timeslots' in data:
-            for id, timeslot_data in data['timeslots'].items():
-                timeslot_object = Timeslot.fromDict(timeslot_data)
-                objMap[timeslot_object.uid] = timeslot_object
+        self.__syncError = None
+        with self.__lock:
+            self.__sync.merge(changed)
+            self.__sync.save()
+            self.__mergeRecords(changed)
+        self.__lastSync = time.time()
+
+    def __mergeRecords(self, records: Dict[str, Records]):
+        with self.__lock:
+            errors: List[Tuple[int, str]] = []
+            # None marks a record deleted on the server.
+            projects = Project.fromDicts((DeltaSync.strip(project_data)
+                                          for project_data in records.get('projects', {}).values()
+                                          if project_data is not None),
+                                         errors=errors)
+            for key, project_data in records.get('projects', {}).items():
+                if project_data is None:
+                    deleted = self.__registry.get(Project, UUID(key))
+                    if deleted is not None:
+                        self._projects.discard(deleted)
+            for project_object in projects:
+                existing = self.__registry.get(Project, project_object.uid)
+                if existing is not None:
+                    existing.name = project_object.name
+                    existing.desc = project_object.desc
+                else:
+                    self._projects.add(project_object)
+                    self._rollup.addProject(project_object)
+                    # Binds any slots that arrived before their project.
+                    self.__registry.add(project_object)
+
+            rebuild = False
+            timeslots = Timeslot.fromDicts((DeltaSync.strip(timeslot_data)
+                                            for timeslot_data in records.get('timeslots', {}).values()
+                                            if timeslot_data is not None),
+                                           errors=errors)
+            deletedSlots = {self._timeslotsById.pop(UUID(key), None)
+                            for key, timeslot_data in records.get('timeslots', {}).items()
+                            if timeslot_data is None} - {None}
+            if deletedSlots:
+                for deletedSlot in deletedSlots:
+                    self.__registry.forget(deletedSlot)
+                self._timeslots = [timeslot for timeslot in self._timeslots if timeslot not in deletedSlots]
+                rebuild = True
+            if errors:
+                # Skip records other clients wrote badly rather than the whole sync.
+                self.__syncError = f'{len(errors)} invalid records, first: {errors[0][1]}'
+            touched: List[Timeslot] = []
+            for timeslot_object in timeslots:
+                existing_slot = self._timeslotsById.get(timeslot_object.uid)
+                if existing_slot is None:
+                    touched.append(timeslot_object)
+                elif existing_slot.toDict() != timeslot_object.toDict():
+                    # Edited elsewhere: update in place and re-sort once.
+                    self.__registry.forget(existing_slot)
+                    existing_slot.setProject(timeslot_object.getProject(), timeslot_object.getActivity())
+                    existing_slot.setStartTime(timeslot_object.getStartTime())
+                    existing_slot.setEndTime(timeslot_object.getEndTime())
+                    existing_slot.setMsg(timeslot_object.getMsg())
+                    touched.append(existing_slot)
+                    rebuild = True
+            self.__registry.resolve(touched)
+            for timeslot_object in touched:
+                if timeslot_object.uid in self._timeslotsById:
+                    continue
                 self._timeslots.append(timeslot_object)
-        
-        for timeslot in self._timeslots:
-            timeslot.complete(objMap)
+                self._timeslotsById[timeslot_object.uid] = timeslot_object
+                if not rebuild:
+                    self._index.insert(timeslot_object)
+                    self._rollup.add(timeslot_object)
+            if rebuild:
+                self._index.rebuild(self._timeslots)
+                if not isinstance(self._rollup, ColumnarRollup):
+                    self._rollup.rebuild(self._timeslots)
+
+    def danglingReferences(self) -> List[Reference]:
+        """Timeslots whose project has not been seen (yet)."""
+        with self.__lock:
+            return self.__registry.dangling()
 
     def close(self):
-        pass
+        self.__closed.set()
+        if self.__queue is not None:
+            # Anything not sent in time stays in the WAL for the next start;
+            # offline there is no point waiting for it.
+            self.__queue.close(timeout=self.__closeTimeout if self.__online.is_set() else 0)
+        with self.__walLock:
+            if self.__wal is not None:
+                self.__wal.close()
+                # A send still finishing must not reset the closed journal.
+                self.__wal = None
+        with self.__lock:
+            if self.__sync is not None and self.__dataRoot is not None and self.__sync.path.is_file():
+                Snapshot.write(self.__snapshotPath(self.__dataRoot.name), self.__sync.path,
+                               self._projects, self._timeslots)
+        self.__client.close()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import bisect
+import datetime as dt
+import itertools
+from typing import Generic, Iterable, Iterator, List, Optional, Protocol, TypeVar
+
+
+class _Slot(Protocol):
+    def getStartTime(self) -> dt.datetime: ...
+
+    def getEndTime(self) -> Optional[dt.datetime]: ...
+
+
+S = TypeVar('S', bound=_Slot)
+K = TypeVar('K')
+
+
+def insertRunningMax(reach: List[K], idx: int, key: K) -> None:
+    """Insert ``key`` at ``idx`` into a running maximum, raising the
+    entries after it that it now exceeds."""
+    if idx > 0 and reach[idx - 1] > key:
+        key = reach[idx - 1]
+    reach.insert(idx, key)
+    for i in range(idx + 1, len(reach)):
+        if reach[i] >= key:
+            break
+        reach[i] = key
+
+
+class TimeslotIndex(Generic[S]):
+    """Timeslots kept sorted by start time.
+
+    Range lookups bisect the start keys, so day, week and arbitrary
+    ``[start, end)`` queries cost O(log n + k).  The slot with the latest end
+    time is tracked on insert so that ``last()`` is O(1).  As with ``Rollup``,
+    ``rebuild`` defers the sort to first use.
+
+    ``_reach[i]`` is the latest end among the first i + 1 slots.  It never
+    decreases, so ``overlapping`` can bisect it for the earliest slot that
+    may still be running at a given time, even in a history that already
+    has overlaps.
+    """
+
+    def __init__(self, timeslots: Iterable[S] = ()):
+        self._keys: List[dt.datetime] = []
+        self._slots: List[S] = []
+        self._reach: List[dt.datetime] = []
+        self._last: Optional[S] = None
+        self._unbuilt: Optional[List[S]] = None
+        self.rebuild(timeslots)
+
+    def rebuild(self, timeslots: Iterable[S]) -> None:
+        self._unbuilt = list(timeslots)
+
+    def _materialize(self) -> None:
+        if self._unbuilt is None:
+            return
+        timeslots = self._unbuilt
+        self._unbuilt = None
+        self._slots = sorted(timeslots, key=lambda ts: ts.getStartTime())
+        self._keys = [ts.getStartTime() for ts in self._slots]
+        self._reach = list(itertools.accumulate((self._endKey(ts) for ts in self._slots), max))
+        self._last = None
+        for ts in self._slots:
+            self._updateLast(ts)
+
+    def insert(self, timeslot: S) -> None:
+        self._materialize()
+        idx = bisect.bisect_right(self._keys, timeslot.getStartTime())
+        self._keys.insert(idx, timeslot.getStartTime())
+        self._slots.insert(idx, timeslot)
+        insertRunningMax(self._reach, idx, self._endKey(timeslot))
+        self._updateLast(timeslot)
+
+    def _updateLast(self, timeslot: S) -> None:
+        if self._last is None or self._endKey(timeslot) >= self._endKey(self._last):
+            self._last = timeslot
+
+    @staticmethod
+    def _endKey(timeslot: S) -> dt.datetime:
+        endTime = timeslot.getEndTime()
+        if endTime is None:
+            return timeslot.getStartTime()
+        return endTime
+
+    def range(self, start: dt.datetime, end: dt.datetime) -> List[S]:
+        self._materialize()
+        lo = bisect.bisect_left(self._keys, start)
+        hi = bisect.bisect_left(self._keys, end, lo)
+        return self._slots[lo:hi]
+
+    def overlapping(self, start: dt.datetime, end: dt.datetime) -> List[S]:
+        """Slots starting in ``[start, end)`` plus earlier ones still
+        running at ``start``, in start order."""
+        self._materialize()
+        lo = bisect.bisect_left(self._keys, start)
+        hi = bisect.bisect_left(self._keys, end, lo)
+        first = bisect.bisect_right(self._reach, start, 0, lo)
+        earlier = [ts for ts in self._slots[first:lo] if self._endKey(ts) > start]
+        return earlier + self._slots[lo:hi]
+
+    def day(self, date: dt.date) -> List[S]:
+        start = dt.datetime.combine(date, dt.time.min)
+        return self.range(start, start + dt.timedelta(days=1))
+
+    def week(self, year: int, weekNum: int) -> List[S]:
+        monday = dt.date.fromisocalendar(year, weekNum, 1)
+        start = dt.datetime.combine(monday, dt.time.min)
+        return self.range(start, start + dt.timedelta(weeks=1))
+
+    def last(self) -> Optional[S]:
+        self._materialize()
+        return self._last
+
+    def __len__(self) -> int:
+        self._materialize()
+        return len(self._slots)
+
+    def __iter__(self) -> Iterator[S]:
+        self._materialize()
+        return iter(self._slots)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, Optional, Tuple
+
+
+class Journal:
+    """Append-only JSON Lines log of records not yet folded into a main file.
+
+    Each record is written and flushed to the OS as soon as it is appended, so
+    a killed process loses nothing.  ``fsyncEvery`` controls how many records
+    may accumulate before they are forced to stable storage.  A torn record at
+    the tail (from a crash mid-write) is dropped when the journal is opened.
+    """
+
+    def __init__(self, path: Path, fsyncEvery: int = 1):
+        if fsyncEvery < 1:
+            raise RuntimeError("fsyncEvery must be at least 1")
+        self._path = path
+        self._fsyncEvery = fsyncEvery
+        self._unsynced = 0
+        self._file: Optional[IO[bytes]] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def open(self) -> None:
+        if self._file is not None:
+            return
+        self._truncateTornTail()
+        self._file = open(self._path, 'ab')
+
+    def _truncateTornTail(self) -> None:
+        if not self._path.is_file():
+            return
+        goodOffset = 0
+        with open(self._path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                goodOffset += len(line)
+        if goodOffset != self._path.stat().st_size:
+            with open(self._path, 'r+b') as f:
+                f.truncate(goodOffset)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def replay(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        if not self._path.is_file():
+            return
+        with open(self._path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    return
+                yield record['kind'], record['data']
+
+    def append(self, kind: str, data: Dict[str, Any]) -> None:
+        if self._file is None:
+            raise RuntimeError("Journal not open")
+        line = json.dumps({'kind': kind, 'data': data}, separators=(',', ':'))
+        self._file.write(line.encode('utf-8') + b'\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self._fsyncEvery:
+            self.sync()
+
+    def appendMany(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """Append a batch with one write and one fsync."""
+        if self._file is None:
+            raise RuntimeError("Journal not open")
+        lines = [json.dumps({'kind': kind, 'data': data}, separators=(',', ':')).encode('utf-8') + b'\n'
+                 for kind, data in records]
+        if not lines:
+            return 0
+        self._file.write(b''.join(lines))
+        self._file.flush()
+        self._unsynced += len(lines)
+        self.sync()
+        return len(lines)
+
+    def sync(self) -> None:
+        if self._file is None or self._unsynced == 0:
+            return
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def size(self) -> int:
+        if self._file is not None:
+            return self._file.tell()
+        if self._path.is_file():
+            return self._path.stat().st_size
+        return 0
+
+    def reset(self) -> None:
+        if self._file is None:
+            raise RuntimeError("Journal not open")
+        self._file.truncate(0)
+        self._file.seek(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+
+
+def replaceAtomically(tmpPath: Path, path: Path) -> None:
+    os.replace(tmpPath, path)
+    if hasattr(os, 'O_DIRECTORY'):
+        dirFd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
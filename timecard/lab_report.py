@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.firebase import FirebaseClient, HTTPError
+from timecard.rollup import Rollup
+from timecard.serializable import ObjectRegistry
+from timecard.sync import DeltaSync
+
+Totals = Dict[Tuple[str, Activity], dt.timedelta]
+
+
+@dataclass
+class UserTotals:
+    localId: str
+    totals: Totals = field(default_factory=dict)
+    changed: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def hours(self) -> float:
+        return sum(self.totals.values(), dt.timedelta(0)).total_seconds() / 3600
+
+
+class LabReport:
+    """Weekly totals across many users' ``data/<localId>`` subtrees.
+
+    Users are fetched concurrently on the client's event loop, at most
+    ``concurrency`` at a time.  Each user has a ``DeltaSync`` snapshot in
+    ``cacheDir``, so after the first report only records changed since the
+    last one are downloaded.  The signed-in account needs read access to the
+    other users' data.
+    """
+
+    def __init__(self, client: FirebaseClient, cacheDir: Path, concurrency: int = 8):
+        self.client = client
+        self.cacheDir = cacheDir
+        self.concurrency = concurrency
+
+    async def users(self) -> List[str]:
+        data = await self.client.db.get('data', shallow=True)
+        return sorted(data) if isinstance(data, dict) else []
+
+    async def _userTotals(self, localId: str, year: int, weekNum: int,
+                          semaphore: asyncio.Semaphore) -> UserTotals:
+        result = UserTotals(localId)
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        sync = await loop.run_in_executor(None, DeltaSync, self.cacheDir.joinpath(f'{localId}.json'))
+        try:
+            async with semaphore:
+                changed = await sync.fetch(self.client.db, f'data/{localId}')
+        except (HTTPError, OSError) as e:
+            # Report from the cached snapshot rather than dropping the user.
+            changed = {}
+            result.error = str(e)
+        result.changed = sum(len(records) for records in changed.values())
+        # Parsing and rolling up is CPU work; keep it off the event loop.
+        result.totals = await loop.run_in_executor(None, self._mergeAndTotal, sync, changed, year, weekNum)
+        result.seconds = time.perf_counter() - started
+        return result
+
+    @staticmethod
+    def _mergeAndTotal(sync: DeltaSync, changed: Dict[str, Any], year: int, weekNum: int) -> Totals:
+        if any(changed.values()):
+            sync.merge(changed)
+            sync.save()
+        registry = ObjectRegistry()
+        registry.addMany(Project.fromDicts(sync.values('projects'), errors=[]))
+        timeslots = Timeslot.fromDicts(sync.values('timeslots'), errors=[])
+        registry.resolve(timeslots)
+        totals: Totals = {}
+        for (project, activity), total in Rollup(timeslots).week(year, weekNum).items():
+            name = project.name if isinstance(project, Project) else f'Unknown({project.hex[:8]})'
+            totals[(name, activity)] = totals.get((name, activity), dt.timedelta(0)) + total
+        return totals
+
+    async def fetchWeek(self, year: int, weekNum: int,
+                        users: Optional[Iterable[str]] = None) -> List[UserTotals]:
+        self.cacheDir.mkdir(parents=True, exist_ok=True)
+        localIds = list(users) if users is not None else await self.users()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return list(await asyncio.gather(*(self._userTotals(localId, year, weekNum, semaphore)
+                                           for localId in localIds)))
+
+    def weekTotals(self, year: int, weekNum: int, users: Optional[Iterable[str]] = None) -> List[UserTotals]:
+        return self.client.run(self.fetchWeek(year, weekNum, users))
+
+    @staticmethod
+    def merge(results: Iterable[UserTotals]) -> Totals:
+        """Lab-wide totals, adding up projects with the same name."""
+        lab: Totals = {}
+        for result in results:
+            for key, total in result.totals.items():
+                lab[key] = lab.get(key, dt.timedelta(0)) + total
+        return lab
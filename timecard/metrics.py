@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Histogram:
+    """Latency histogram over fixed, roughly logarithmic buckets (seconds)."""
+
+    BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2,
+              2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given fraction of samples."""
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def toDict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'bounds': list(self.BOUNDS),
+            'counts': list(self.counts)
+        }
+
+
+class Metrics:
+    """Process-wide counters and timers.
+
+    ``commands`` holds per CLI command latency, ``calls`` per backend method
+    latency, ``phases`` time spent parsing, validating and serializing, and
+    ``counters`` plain counts such as bytes sent and received.
+    """
+    __instance: Optional[Metrics] = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.commands: Dict[str, Histogram] = {}
+        self.calls: Dict[str, Histogram] = {}
+        self.phases: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+
+    @classmethod
+    def instance(cls) -> Metrics:
+        if cls.__instance is None:
+            cls.__instance = Metrics()
+        return cls.__instance
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self.commands = {}
+            self.calls = {}
+            self.phases = {}
+            self.counters = {}
+
+    def record(self, kind: str, name: str, seconds: float) -> None:
+        with self._lock:
+            histograms: Dict[str, Histogram] = getattr(self, kind)
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def addBytes(self, sent: int = 0, received: int = 0) -> None:
+        with self._lock:
+            self.counters['bytesSent'] = self.counters.get('bytesSent', 0) + sent
+            self.counters['bytesReceived'] = self.counters.get('bytesReceived', 0) + received
+
+    @contextlib.contextmanager
+    def timer(self, kind: str, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - start)
+
+    def toDict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'started': self.started,
+                'uptime': time.time() - self.started,
+                'commands': {name: h.toDict() for name, h in self.commands.items()},
+                'calls': {name: h.toDict() for name, h in self.calls.items()},
+                'phases': {name: h.toDict() for name, h in self.phases.items()},
+                'counters': dict(self.counters)
+            }
+
+    def format(self) -> str:
+        data = self.toDict()
+        lines = []
+        for title, kind in (('Commands', 'commands'), ('Backend calls', 'calls'), ('Phases', 'phases')):
+            if not data[kind]:
+                continue
+            lines.append(f'{title}:')
+            lines.append('  %-24s %7s %10s %10s %10s %10s' % ('', 'count', 'total ms', 'p50 ms', 'p99 ms', 'max ms'))
+            for name, h in sorted(data[kind].items(), key=lambda item: -item[1]['total']):
+                lines.append('  %-24s %7d %10.2f %10.2f %10.2f %10.2f' % (
+                    name, h['count'], h['total'] * 1e3, h['p50'] * 1e3, h['p99'] * 1e3, h['max'] * 1e3))
+        if data['counters']:
+            lines.append('Counters:')
+            for name, value in sorted(data['counters'].items()):
+                lines.append('  %-24s %d' % (name, value))
+        if not lines:
+            return 'No metrics recorded yet'
+        return '\n'.join(lines)
+
+    def dump(self, directory: Path) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory.joinpath(time.strftime('metrics-%Y%m%d-%H%M%S.json'))
+        with open(path, 'w') as f:
+            json.dump(self.toDict(), f, indent=2)
+        return path
+
+
+class InstrumentedBackend:
+    """Times and counts every public method call made on a Timecard."""
+
+    def __init__(self, backend: Any, metrics: Optional[Metrics] = None):
+        self._backend = backend
+        self._metrics = metrics or Metrics.instance()
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._backend, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+        metrics = self._metrics
+
+        def timed(*args, **kwargs):
+            with metrics.timer('calls', name):
+                return attribute(*args, **kwargs)
+        return timed
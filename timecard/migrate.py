@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from timecard import xml_data
+from timecard.journal import replaceAtomically
+
+Record = Tuple[str, Dict[str, Any]]
+
+
+@dataclass
+class MigrationStatus:
+    records: int = 0
+    resumed: int = 0
+    projects: int = 0
+    timeslots: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Records written per second in this run."""
+        if self.seconds <= 0:
+            return 0.0
+        return (self.records - self.resumed) / self.seconds
+
+
+def openTarget(kind: str, path: Optional[Path] = None) -> Any:
+    if kind == 'xml':
+        from timecard.xml_database import Timecard as XmlTimecard
+        # Fold the journal into the file once, at the end, instead of
+        # rewriting the whole file every megabyte.
+        return XmlTimecard(str(path), checkpointBytes=1 << 62)
+    if kind == 'sqlite':
+        from timecard.sqlite_database import Timecard as SqliteTimecard
+        return SqliteTimecard(str(path))
+    if kind == 'mmap':
+        from timecard.mmap_database import Timecard as MmapTimecard
+        return MmapTimecard(str(path))
+    if kind == 'firebase':
+        from timecard.firebase import Timecard as FirebaseTimecard
+        return FirebaseTimecard()
+    raise RuntimeError(f'Unknown migration target {kind}')
+
+
+class Migration:
+    """Streams a legacy ``xml_data`` file into another backend in batches.
+
+    After each batch is durable in the target, the number of source records
+    done is written to ``statePath``; a later run with the same source and
+    target skips that many records.  Targets ignore UUIDs they already hold,
+    so replaying part of a batch after a crash is harmless.
+
+    A target with a write queue (firebase) only has the records in its WAL
+    when ``importRecords`` returns; ``run`` waits up to ``flushTimeout``
+    seconds for the server and raises, keeping the state file, if they do
+    not all arrive.
+    """
+
+    def __init__(self, source: Path, target: Any, targetKind: str, statePath: Path,
+                 batchSize: int = 5000, report: Optional[Callable[[MigrationStatus], None]] = None,
+                 flushTimeout: float = 600.0):
+        self.source = source
+        self.target = target
+        self.targetKind = targetKind
+        self.statePath = statePath
+        self.batchSize = batchSize
+        self.flushTimeout = flushTimeout
+        self._report = report
+
+    def _fingerprint(self) -> Dict[str, Any]:
+        stat = self.source.stat()
+        return {
+            'source': self.source.resolve().as_posix(),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'target': self.targetKind
+        }
+
+    def _loadDone(self) -> int:
+        if not self.statePath.is_file():
+            return 0
+        with open(self.statePath) as f:
+            state = json.load(f)
+        if state.get('fingerprint') != self._fingerprint():
+            return 0
+        return int(state.get('done', 0))
+
+    def _saveDone(self, done: int) -> None:
+        tmpPath = Path(self.statePath.as_posix() + '.tmp')
+        with open(tmpPath, 'w') as f:
+            json.dump({'fingerprint': self._fingerprint(), 'done': done}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        replaceAtomically(tmpPath, self.statePath)
+
+    def _batches(self, records: Iterator[Record], skip: int) -> Iterator[List[Record]]:
+        batch: List[Record] = []
+        for position, record in enumerate(records):
+            if position < skip:
+                continue
+            batch.append(record)
+            if len(batch) >= self.batchSize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run(self) -> MigrationStatus:
+        status = MigrationStatus()
+        status.resumed = status.records = self._loadDone()
+        started = time.perf_counter()
+        for batch in self._batches(xml_data.Timecard.readRecords(self.source.as_posix()), status.resumed):
+            projects, timeslots = self.target.importRecords(batch)
+            status.projects += projects
+            status.timeslots += timeslots
+            status.records += len(batch)
+            status.seconds = time.perf_counter() - started
+            self._saveDone(status.records)
+            if self._report is not None:
+                self._report(status)
+        if hasattr(self.target, 'writeQueueStatus'):
+            if not self.target.flush(self.flushTimeout):
+                raise RuntimeError(f'{self.target.writeQueueStatus().depth} writes not sent after '
+                                   f'{self.flushTimeout:.0f} s; they are kept for the next start')
+        elif hasattr(self.target, 'flush'):
+            self.target.flush()
+        status.seconds = time.perf_counter() - started
+        if self.statePath.is_file():
+            self.statePath.unlink()
+        return status
@@ -0,0 +1,598 @@
+import bisect
+import datetime as dt
+import itertools
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from uuid import UUID
+
+from timecard import xml_data
+from timecard.audit import Finding, OverlapError, sweep
+from timecard.data import Activity, Project, Timeslot
+from timecard.index import insertRunningMax
+from timecard.journal import replaceAtomically
+from timecard.metrics import Metrics
+from timecard.snapshot import NO_END
+from timecard.xml_database import Timecard as XmlTimecard
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Activity codes stored in the records.  Append new activities only: the
+# position is the on-disk code.
+ACTIVITIES: List[Activity] = [Activity.Development, Activity.Meetings, Activity.Planning, Activity.Support]
+ACTIVITY_CODES: Dict[Activity, int] = {activity: code for code, activity in enumerate(ACTIVITIES)}
+
+Record = Tuple[int, int, bytes, int, int, int, int]
+
+
+class _StartKeys:
+    """Start times of the records in file order, as a sequence for bisect."""
+
+    def __init__(self, timecard: 'Timecard'):
+        self._timecard = timecard
+
+    def __len__(self) -> int:
+        return self._timecard._count
+
+    def __getitem__(self, position: int) -> int:
+        return Timecard.START.unpack_from(self._timecard._mapped, Timecard.HEADER_SIZE +
+                                          position * Timecard.RECORD.size)[0]
+
+
+class Timecard:
+    """Timeslots as fixed-size records in a memory-mapped file.
+
+    ``filename`` holds a header and one record per timeslot: start and end
+    epoch, uuid, message offset and length, project index and activity code.
+    Message text is appended to ``filename.msgs`` and projects, one JSON
+    object per line, to ``filename.projects``; a record's project index is
+    its line number there.  ``stop()`` appends a single record, and range
+    queries bisect the start times in the mapping, so totals never build a
+    Timeslot and entry lookups only build the ones returned.
+
+    While the header's sorted flag is set the records are in start order.
+    An append that starts before the last record clears it; queries then go
+    through an in-memory order built on first use, and ``flush()`` (called
+    by ``close()``) rewrites the file sorted.
+
+    Only one writable Timecard may have a file open; it holds an exclusive
+    lock on ``filename.lock``.  ``readOnly`` opens take no lock and never
+    write: they map the file as it was when opened, which stays intact even
+    if the writer later replaces it.
+    """
+    MAGIC = b'TCSLOT'
+    VERSION = 1
+    HEADER = struct.Struct('<6sHIQ')
+    HEADER_SIZE = 64
+    RECORD = struct.Struct('<qq16sQIIB7x')
+    START = struct.Struct('<q')
+    SORTED = 0x1
+    NO_PROJECT = 0xffffffff
+    MIN_CAPACITY = 4096
+
+    def __init__(self, filename: str, readOnly: bool = False):
+        self._filename = filename
+        self._readOnly = readOnly
+        self._lock: Optional[BinaryIO] = None
+        self._projects: Set[Project] = set()
+        self._projectList: List[Project] = []
+        self._projectIndex: Dict[UUID, int] = {}
+        self._activeSlot: Optional[Timeslot] = None
+        self._file: Optional[BinaryIO] = None
+        self._map: Optional[mmap.mmap] = None
+        self._msgs: Optional[BinaryIO] = None
+        self._msgMap: Optional[mmap.mmap] = None
+        self._count = 0
+        self._sorted = True
+        # Built on demand: start order while unsorted, the running maximum
+        # of end times in start order, stored uuids for imports, and the
+        # record with the latest end.
+        self._order: Optional[List[int]] = None
+        self._orderStarts: List[int] = []
+        self._reach: Optional[List[int]] = None
+        self._uids: Optional[Set[bytes]] = None
+        self._lastRecord: Optional[int] = None
+        self.open()
+
+    @staticmethod
+    def messagesPath(filename: str) -> Path:
+        return Path(filename + '.msgs')
+
+    @staticmethod
+    def projectsPath(filename: str) -> Path:
+        return Path(filename + '.projects')
+
+    @staticmethod
+    def lockPath(filename: str) -> Path:
+        return Path(filename + '.lock')
+
+    def open(self):
+        if self._map is not None:
+            return
+        path = Path(self._filename)
+        if self._readOnly:
+            if not path.is_file():
+                raise RuntimeError(f"{self._filename} does not exist")
+        else:
+            self.__acquireLock()
+            if not path.is_file() or path.stat().st_size == 0:
+                self.__create(path)
+        try:
+            self.__mapRecords()
+            self.__loadProjects()
+            messagesPath = self.messagesPath(self._filename)
+            if not self._readOnly:
+                self._msgs = open(messagesPath, 'a+b')
+            elif messagesPath.is_file():
+                self._msgs = open(messagesPath, 'rb')
+        except BaseException:
+            self.__unmapRecords()
+            self.__releaseLock()
+            raise
+        self._order = None
+        self._reach = None
+        self._uids = None
+        self._lastRecord = None
+
+    def close(self):
+        if self._map is None:
+            return
+        self.flush()
+        if self._msgMap is not None:
+            self._msgMap.close()
+            self._msgMap = None
+        if self._msgs is not None:
+            self._msgs.close()
+            self._msgs = None
+        self.__unmapRecords()
+        self.__releaseLock()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    @property
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None:
+            raise RuntimeError("Timecard is closed")
+        return self._map
+
+    def __acquireLock(self):
+        self._lock = open(self.lockPath(self._filename), 'a+b')
+        if fcntl is None:
+            # Elsewhere the open mapping already keeps the file from being
+            # replaced.
+            return
+        try:
+            fcntl.flock(self._lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.__releaseLock()
+            raise RuntimeError(f"{self._filename} is open for writing elsewhere")
+
+    def __releaseLock(self):
+        if self._lock is not None:
+            # Closing the file drops the lock.
+            self._lock.close()
+            self._lock = None
+
+    def __checkWritable(self):
+        if self._readOnly:
+            raise RuntimeError(f"{self._filename} is open read-only")
+
+    def __create(self, path: Path):
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.SORTED, 0).ljust(self.HEADER_SIZE, b'\0'))
+            f.truncate(self.HEADER_SIZE + self.MIN_CAPACITY * self.RECORD.size)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __mapRecords(self):
+        if self._readOnly:
+            self._file = open(self._filename, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._file = open(self._filename, 'r+b')
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, flags, count = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.__unmapRecords()
+            raise RuntimeError(f"{self._filename} is not a timecard record file")
+        if count > self.__capacity():
+            self.__unmapRecords()
+            raise RuntimeError(f"{self._filename} is truncated")
+        self._count = count
+        self._sorted = bool(flags & self.SORTED)
+        Metrics.instance().count('bytesRead', self.HEADER_SIZE)
+
+    def __unmapRecords(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __capacity(self) -> int:
+        return (len(self._mapped) - self.HEADER_SIZE) // self.RECORD.size
+
+    def __loadProjects(self):
+        path = self.projectsPath(self._filename)
+        self._projects = set()
+        self._projectList = []
+        self._projectIndex = {}
+        if not path.is_file():
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        Metrics.instance().count('bytesRead', len(data))
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data) and not self._readOnly:
+            # A line cut short by a crash never got a record pointing at it.
+            with open(path, 'r+b') as f:
+                f.truncate(complete)
+        for project in Project.fromDicts((json.loads(line) for line in data[:complete].splitlines()),
+                                        trusted=True):
+            self.__cacheProject(project)
+
+    def __cacheProject(self, project: Project):
+        self._projectIndex[project.uid] = len(self._projectList)
+        self._projectList.append(project)
+        self._projects.add(project)
+
+    def __appendProjects(self, projects: List[Project]):
+        self.__checkWritable()
+        if not projects:
+            return
+        data = b''.join(json.dumps(project.toDict(), separators=(',', ':')).encode('utf-8') + b'\n'
+                        for project in projects)
+        with open(self.projectsPath(self._filename), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        Metrics.instance().count('bytesWritten', len(data))
+        for project in projects:
+            self.__cacheProject(project)
+
+    def __appendMessages(self, messages: List[str]) -> List[Tuple[int, int]]:
+        if self._msgs is None:
+            raise RuntimeError("Timecard is closed")
+        self._msgs.seek(0, os.SEEK_END)
+        end = self._msgs.tell()
+        chunks: List[bytes] = []
+        written: Dict[str, Tuple[int, int]] = {'': (0, 0)}
+        spans = []
+        for message in messages:
+            span = written.get(message)
+            if span is None:
+                encoded = message.encode('utf-8')
+                span = written[message] = (end, len(encoded))
+                chunks.append(encoded)
+                end += len(encoded)
+            spans.append(span)
+        if chunks:
+            data = b''.join(chunks)
+            self._msgs.write(data)
+            self._msgs.flush()
+            os.fsync(self._msgs.fileno())
+            Metrics.instance().count('bytesWritten', len(data))
+        return spans
+
+    def _message(self, offset: int, length: int) -> str:
+        if length == 0:
+            return ''
+        if self._msgMap is None or offset + length > len(self._msgMap):
+            if self._msgs is None:
+                raise RuntimeError("Timecard is closed")
+            if self._msgMap is not None:
+                self._msgMap.close()
+            self._msgMap = mmap.mmap(self._msgs.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._msgMap[offset:offset + length].decode('utf-8')
+
+    def __reserve(self, count: int):
+        capacity = self.__capacity()
+        if count <= capacity:
+            return
+        # Doubling keeps appends amortized O(1).
+        capacity = max(count, 2 * capacity, self.MIN_CAPACITY)
+        self.__unmapRecords()
+        with open(self._filename, 'r+b') as f:
+            f.truncate(self.HEADER_SIZE + capacity * self.RECORD.size)
+        self.__mapRecords()
+
+    def __syncRange(self, offset: int, length: int):
+        aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self._mapped.flush(aligned, offset + length - aligned)
+
+    def __writeHeader(self):
+        self.HEADER.pack_into(self._mapped, 0, self.MAGIC, self.VERSION,
+                              self.SORTED if self._sorted else 0, self._count)
+        self.__syncRange(0, self.HEADER.size)
+
+    def __projectRef(self, project: Union[Project, UUID, None]) -> int:
+        if project is None:
+            return self.NO_PROJECT
+        uid = project.uid if isinstance(project, Project) else project
+        index = self._projectIndex.get(uid)
+        if index is None:
+            raise RuntimeError(f"Project {uid} not registered")
+        return index
+
+    def __append(self, timeslots: List[Timeslot]):
+        """Append records; the header count is only raised once they are on
+        disk, so a crash part way leaves the earlier records intact."""
+        self.__checkWritable()
+        if not timeslots:
+            return
+        refs = [self.__projectRef(timeslot.getProject()) for timeslot in timeslots]
+        spans = self.__appendMessages([timeslot.getMsg() for timeslot in timeslots])
+        self.__reserve(self._count + len(timeslots))
+        buffer = self._mapped
+        first = self.HEADER_SIZE + self._count * self.RECORD.size
+        offset = first
+        lastStart = _StartKeys(self)[self._count - 1] if self._count else None
+        index = self._count
+        for timeslot, ref, (msgOffset, msgLength) in zip(timeslots, refs, spans):
+            start = timeslot.getStartEpoch()
+            end = timeslot.getEndEpoch()
+            activity = timeslot.getActivity()
+            uid = timeslot.uid.bytes
+            self.RECORD.pack_into(buffer, offset, start, NO_END if end is None else end, uid,
+                                  msgOffset, msgLength, ref, 0xff if activity is None else ACTIVITY_CODES[activity])
+            endKey = start if end is None else end
+            if self._sorted and lastStart is not None and start < lastStart:
+                self._sorted = False
+                self._reach = None
+            elif self._order is not None:
+                position = bisect.bisect_right(self._orderStarts, start)
+                self._order.insert(position, index)
+                self._orderStarts.insert(position, start)
+                if self._reach is not None:
+                    insertRunningMax(self._reach, position, endKey)
+            elif self._reach is not None:
+                insertRunningMax(self._reach, len(self._reach), endKey)
+            if self._uids is not None:
+                self._uids.add(uid)
+            if self._lastRecord is not None and (NO_END if end is None else end) >= self.__endKey(self._lastRecord):
+                self._lastRecord = index
+            lastStart = start
+            offset += self.RECORD.size
+            index += 1
+        self.__syncRange(first, offset - first)
+        self._count = index
+        self.__writeHeader()
+        Metrics.instance().count('bytesWritten', offset - first)
+
+    def flush(self):
+        """Rewrite the record file in start order if appends left it
+        unsorted.  Appends are durable without it."""
+        if self._sorted or self._map is None or self._readOnly:
+            return
+        self.__ensureOrder()
+        buffer = self._mapped
+        size = self.RECORD.size
+        tmpPath = Path(self._filename + '.tmp')
+        with open(tmpPath, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.SORTED, self._count)
+                    .ljust(self.HEADER_SIZE, b'\0'))
+            for index in self._order or ():
+                offset = self.HEADER_SIZE + index * size
+                f.write(buffer[offset:offset + size])
+            f.flush()
+            os.fsync(f.fileno())
+            Metrics.instance().count('bytesWritten', f.tell())
+        self.__unmapRecords()
+        replaceAtomically(tmpPath, Path(self._filename))
+        self.__mapRecords()
+        self._order = None
+        self._orderStarts = []
+        self._reach = None
+        self._lastRecord = None
+
+    def __ensureOrder(self):
+        if self._sorted or self._order is not None:
+            return
+        starts = _StartKeys(self)
+        keys = [starts[index] for index in range(self._count)]
+        self._order = sorted(range(self._count), key=keys.__getitem__)
+        self._orderStarts = [keys[index] for index in self._order]
+
+    def __lowerBound(self, key: int) -> int:
+        self.__ensureOrder()
+        if self._order is not None:
+            return bisect.bisect_left(self._orderStarts, key)
+        return bisect.bisect_left(_StartKeys(self), key)
+
+    def __records(self, lo: int, hi: int) -> Iterator[Record]:
+        """Unpacked records at start-order positions ``[lo, hi)``."""
+        buffer = self._mapped
+        size = self.RECORD.size
+        if self._order is None:
+            yield from self.RECORD.iter_unpack(buffer[self.HEADER_SIZE + lo * size:self.HEADER_SIZE + hi * size])
+            return
+        unpack = self.RECORD.unpack_from
+        for index in self._order[lo:hi]:
+            yield unpack(buffer, self.HEADER_SIZE + index * size)
+
+    def __span(self, start: dt.datetime, end: dt.datetime) -> Tuple[int, int]:
+        lo = self.__lowerBound(int(start.timestamp()))
+        hi = max(lo, self.__lowerBound(int(end.timestamp())))
+        return lo, hi
+
+    def _toTimeslot(self, record: Record) -> Timeslot:
+        start, end, uid, msgOffset, msgLength, projectRef, activity = record
+        return Timeslot._fromFields(start, None if end == NO_END else end,
+                                    None if projectRef == self.NO_PROJECT else self._projectList[projectRef],
+                                    None if activity == 0xff else ACTIVITIES[activity],
+                                    int.from_bytes(uid, 'big'), self._message(msgOffset, msgLength))
+
+    def __endKey(self, index: int) -> int:
+        start, end = struct.unpack_from('<qq', self._mapped, self.HEADER_SIZE + index * self.RECORD.size)
+        return start if end == NO_END else end
+
+    def addProject(self, project: Project) -> None:
+        for existingProject in self._projects:
+            assert(str(project) != str(existingProject))
+        self.__appendProjects([project])
+
+    def start(self, startTime: dt.datetime = None) -> None:
+        self.__checkWritable()
+        if self._activeSlot is not None:
+            raise RuntimeError
+        self._activeSlot = Timeslot(startTime=startTime)
+
+    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg: str = '',
+             allowOverlap: bool = False) -> None:
+        if project not in self._projects:
+            raise RuntimeError("Project not registered")
+        if self._activeSlot is None:
+            raise RuntimeError("Timeslot not started")
+        self._activeSlot.setProject(project, activity)
+        self._activeSlot.setEndTime(endTime=endTime)
+        self._activeSlot.setMsg(msg)
+        if not allowOverlap:
+            overlaps = self.getOverlapping(self._activeSlot.getStartTime(), self._activeSlot.getEndTime())
+            if overlaps:
+                raise OverlapError(self._activeSlot, overlaps)
+        self.__append([self._activeSlot])
+        self._activeSlot = None
+
+    def getRangeTotals(self, start: dt.datetime, end: dt.datetime) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        sums: Dict[Tuple[int, int], int] = {}
+        for slotStart, slotEnd, _, _, _, projectRef, activity in self.__records(*self.__span(start, end)):
+            if slotEnd == NO_END or projectRef == self.NO_PROJECT or activity == 0xff:
+                continue
+            key = (projectRef, activity)
+            sums[key] = sums.get(key, 0) + slotEnd - slotStart
+        return {(self._projectList[projectRef], ACTIVITIES[activity]): dt.timedelta(seconds=total)
+                for (projectRef, activity), total in sums.items()}
+
+    def getDayTotals(self, date: dt.date = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        if date is None:
+            date = dt.date.today()
+        return self.getRangeTotals(*self._dayRange(date))
+
+    def getWeekTotals(self, weekNum: int = None, year: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        return self.getRangeTotals(*self._weekRange(weekNum, year))
+
+    def getRangeEntries(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        return [self._toTimeslot(record) for record in self.__records(*self.__span(start, end))]
+
+    def getOverlapping(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        if end <= start:
+            return []
+        lo, hi = self.__span(start, end)
+        if self._reach is None:
+            self._reach = list(itertools.accumulate(
+                (slotStart if slotEnd == NO_END else slotEnd
+                 for slotStart, slotEnd, *_ in self.__records(0, self._count)), max))
+        startEpoch = int(start.timestamp())
+        # _reach never decreases: earlier slots still running at start all
+        # lie at or after the first position whose reach passes it.
+        first = bisect.bisect_right(self._reach, startEpoch, 0, lo)
+        overlaps = [self._toTimeslot(record) for record in self.__records(first, lo)
+                    if record[1] != NO_END and record[1] > startEpoch]
+        return overlaps + [self._toTimeslot(record) for record in self.__records(lo, hi)]
+
+    def audit(self, minGap: dt.timedelta = None) -> List[Finding]:
+        self.__ensureOrder()
+        return sweep((self._toTimeslot(record) for record in self.__records(0, self._count)),
+                     minGap, presorted=True)
+
+    def getDayEntries(self, date: dt.date = None) -> List[Timeslot]:
+        if date is None:
+            date = dt.date.today()
+        return self.getRangeEntries(*self._dayRange(date))
+
+    def getWeekEntries(self, weekNum: int = None, year: int = None) -> List[Timeslot]:
+        return self.getRangeEntries(*self._weekRange(weekNum, year))
+
+    @staticmethod
+    def _dayRange(date: dt.date) -> Tuple[dt.datetime, dt.datetime]:
+        start = dt.datetime.combine(date, dt.time.min)
+        return start, start + dt.timedelta(days=1)
+
+    @staticmethod
+    def _weekRange(weekNum: Optional[int], year: Optional[int]) -> Tuple[dt.datetime, dt.datetime]:
+        if weekNum is None:
+            weekNum = dt.date.today().isocalendar()[1]
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        start = dt.datetime.combine(dt.date.fromisocalendar(year, weekNum, 1), dt.time.min)
+        return start, start + dt.timedelta(weeks=1)
+
+    def getProjects(self) -> Dict[str, Project]:
+        return {project.name: project for project in self._projects}
+
+    def getLastEntry(self) -> Timeslot:
+        if self._count == 0:
+            raise RuntimeError("No timeslots recorded")
+        if self._lastRecord is None:
+            last = 0
+            lastEnd = self.__endKey(0)
+            size = self.RECORD.size
+            for index, (start, end) in enumerate(struct.iter_unpack(
+                    '<qq' + 'x' * (size - 16),
+                    self._mapped[self.HEADER_SIZE:self.HEADER_SIZE + self._count * size])):
+                endKey = start if end == NO_END else end
+                if endKey >= lastEnd:
+                    last, lastEnd = index, endKey
+            self._lastRecord = last
+        offset = self.HEADER_SIZE + self._lastRecord * self.RECORD.size
+        return self._toTimeslot(self.RECORD.unpack_from(self._mapped, offset))
+
+    def importRecords(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> Tuple[int, int]:
+        """Append ``(tag, toDict())`` records, skipping UUIDs already stored.
+
+        Each batch costs one fsync per side file and one msync of the new
+        records.  Returns the number of projects and timeslots read.
+        """
+        projectRecords: List[Dict[str, Any]] = []
+        timeslotRecords: List[Dict[str, Any]] = []
+        for tag, data in records:
+            if tag == XmlTimecard.PROJECT_TAG:
+                projectRecords.append(data)
+            elif tag == XmlTimecard.TIMESLOT_TAG:
+                timeslotRecords.append(data)
+        projects: Dict[UUID, Project] = {}
+        for project in Project.fromDicts(projectRecords):
+            if project.uid not in self._projectIndex:
+                projects.setdefault(project.uid, project)
+        self.__appendProjects(list(projects.values()))
+        if self._uids is None:
+            size = self.RECORD.size
+            buffer = self._mapped
+            self._uids = {buffer[offset:offset + 16] for offset in
+                          range(self.HEADER_SIZE + 16, self.HEADER_SIZE + 16 + self._count * size, size)}
+        added: List[Timeslot] = []
+        seen: Set[bytes] = set()
+        for timeslot in Timeslot.fromDicts(timeslotRecords):
+            uid = timeslot.uid.bytes
+            if uid not in self._uids and uid not in seen:
+                seen.add(uid)
+                added.append(timeslot)
+        self.__append(added)
+        return len(projectRecords), len(timeslotRecords)
+
+    def readRecords(self, start: dt.datetime = None, end: dt.datetime = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream projects, then timeslots by start time, as ``toDict`` records."""
+        for project in self._projectList:
+            yield XmlTimecard.PROJECT_TAG, project.toDict()
+        lo = self.__lowerBound(int(start.timestamp())) if start else 0
+        hi = max(lo, self.__lowerBound(int(end.timestamp()))) if end else self._count
+        for record in self.__records(lo, hi):
+            yield XmlTimecard.TIMESLOT_TAG, self._toTimeslot(record).toDict()
+
+    def importXml(self, filename: str) -> Tuple[int, int]:
+        return self.importRecords(XmlTimecard.readRecords(filename))
+
+    def importLegacyXml(self, filename: str) -> Tuple[int, int]:
+        return self.importRecords(xml_data.Timecard.readRecords(filename))
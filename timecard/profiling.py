@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import io
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+
+
+class Profiler:
+    """Profiles CLI commands into ``directory``.
+
+    Each command run while enabled leaves ``NNN-command.pstats`` (cProfile,
+    open with ``python -m pstats``) and ``NNN-command.txt`` with the top
+    cumulative functions and the allocation sites that grew most during the
+    command (tracemalloc).  ``stop()`` writes the session's largest live
+    allocation sites to ``session-allocations.txt``.
+
+    cProfile only sees the thread that enables it, so threads started during
+    a command get a profile of their own (via ``threading.setprofile``) that
+    is merged into the command's report.  Threads that were already running
+    when the command started, such as the Firebase write queue and event
+    loop, are not profiled on Python before 3.12; their work shows up only
+    as waits in the calling thread.  From 3.12 cProfile hooks the
+    process-wide ``sys.monitoring`` and sees every thread.  tracemalloc is
+    process-wide on all versions.
+    """
+
+    def __init__(self, directory: Path, topFunctions: int = 30, topAllocations: int = 25,
+                 frames: int = 5):
+        self.directory = directory
+        self._topFunctions = topFunctions
+        self._topAllocations = topAllocations
+        self._frames = frames
+        self._sequence = 0
+        self._enabled = False
+        self._startedTracing = False
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def start(self) -> None:
+        if self._enabled:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+            self._startedTracing = True
+        self._enabled = True
+
+    def stop(self) -> Optional[Path]:
+        if not self._enabled:
+            return None
+        self._enabled = False
+        path = self.directory.joinpath('session-allocations.txt')
+        with open(path, 'w') as f:
+            f.write(self.__formatAllocations(tracemalloc.take_snapshot().statistics('lineno')))
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+        return path
+
+    @contextlib.contextmanager
+    def command(self, name: str) -> Iterator[None]:
+        if not self._enabled:
+            yield
+            return
+        self._sequence += 1
+        stem = '%03d-%s' % (self._sequence, re.sub(r'[^\w.-]', '_', name))
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        threadProfiles: List[cProfile.Profile] = []
+        threadHook = None
+        if sys.version_info < (3, 12):
+            threadHook = threading.getprofile() if hasattr(threading, 'getprofile') else None
+
+            def profileThread(frame: Any, event: str, arg: Any) -> None:
+                # Runs once per new thread; enabling replaces this hook there.
+                threadProfile = cProfile.Profile()
+                threadProfiles.append(threadProfile)
+                threadProfile.enable()
+
+            threading.setprofile(profileThread)
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            if sys.version_info < (3, 12):
+                threading.setprofile(threadHook)
+            stats = pstats.Stats(profile)
+            for threadProfile in list(threadProfiles):
+                stats.add(threadProfile)
+            # 'profile off' may have stopped tracing during the command.
+            allocations = []
+            if tracemalloc.is_tracing():
+                allocations = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+            stats.dump_stats(self.directory.joinpath(stem + '.pstats').as_posix())
+            self.__writeReport(stem, name, elapsed, stats, allocations)
+
+    def __writeReport(self, stem: str, name: str, elapsed: float, stats: pstats.Stats,
+                      allocations: list) -> None:
+        functions = io.StringIO()
+        stats.stream = functions
+        stats.sort_stats('cumulative').print_stats(self._topFunctions)
+        with open(self.directory.joinpath(stem + '.txt'), 'w') as f:
+            f.write('%s: %.3f s\n\n' % (name, elapsed))
+            f.write('Allocation growth by site:\n')
+            f.write(self.__formatAllocations(allocations))
+            f.write('\n')
+            f.write(functions.getvalue())
+
+    def __formatAllocations(self, statistics: list) -> str:
+        lines = [str(statistic) for statistic in statistics[:self._topAllocations]]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import bisect
+import datetime as dt
+import itertools
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+Key = Tuple[Any, Any]
+Bucket = Dict[Key, dt.timedelta]
+Counts = Dict[Key, int]
+MICROSECOND = dt.timedelta(microseconds=1)
+
+
+def byProjectUid(bucket: Bucket) -> Bucket:
+    """``bucket`` keyed by project UUID, for comparing totals.
+
+    A slot may still hold its project's UUID after addProject rekeyed a
+    rollup, so totals are compared by project identity rather than object.
+    """
+    normalized: Bucket = {}
+    for (project, activity), total in bucket.items():
+        Rollup._addTo(normalized, (getattr(project, 'uid', project), activity), total)
+    return normalized
+
+
+class RangeTotals:
+    """Prefix sums of slot durations per (project, activity), by start time.
+
+    For each key the start times are kept sorted next to cumulative
+    durations, so the total over any ``[start, end)`` is two bisects per key.
+    Slots arriving in order are appended in O(1); an out-of-order insert or
+    a removal re-accumulates that key on the next query.  As in ``Rollup``,
+    slots whose project is still a UUID are keyed by it until
+    ``addProject`` rekeys them.
+    """
+
+    def __init__(self, timeslots: Iterable[Any] = ()):
+        self._starts: Dict[Key, List[dt.datetime]] = {}
+        self._durations: Dict[Key, List[int]] = {}
+        self._sums: Dict[Key, List[int]] = {}
+        self._dirty: Set[Key] = set()
+        self._pending: Dict[UUID, Set[Key]] = {}
+        self.rebuild(timeslots)
+
+    def rebuild(self, timeslots: Iterable[Any]) -> None:
+        slots: Dict[Key, List[Tuple[dt.datetime, int]]] = {}
+        for ts in timeslots:
+            key = self._key(ts)
+            if key is not None:
+                slots.setdefault(key, []).append((ts.getStartTime(), ts.getTotalTime() // MICROSECOND))
+        self._starts = {}
+        self._durations = {}
+        self._sums = {}
+        self._dirty = set()
+        self._pending = {}
+        for key, entries in slots.items():
+            if isinstance(key[0], UUID):
+                self._pending.setdefault(key[0], set()).add(key)
+            entries.sort(key=lambda entry: entry[0])
+            self._starts[key] = [start for start, _ in entries]
+            self._durations[key] = [duration for _, duration in entries]
+            self._sums[key] = list(itertools.accumulate(self._durations[key], initial=0))
+
+    @staticmethod
+    def _key(timeslot: Any) -> Any:
+        project = timeslot.getProject()
+        activity = timeslot.getActivity()
+        if not project or not activity:
+            return None
+        return (project, activity)
+
+    def add(self, timeslot: Any) -> None:
+        key = self._key(timeslot)
+        if key is None:
+            return
+        if isinstance(key[0], UUID):
+            self._pending.setdefault(key[0], set()).add(key)
+        start = timeslot.getStartTime()
+        duration = timeslot.getTotalTime() // MICROSECOND
+        starts = self._starts.setdefault(key, [])
+        durations = self._durations.setdefault(key, [])
+        sums = self._sums.setdefault(key, [0])
+        if not starts or start >= starts[-1]:
+            starts.append(start)
+            durations.append(duration)
+            if key not in self._dirty:
+                sums.append(sums[-1] + duration)
+            return
+        idx = bisect.bisect_right(starts, start)
+        starts.insert(idx, start)
+        durations.insert(idx, duration)
+        self._dirty.add(key)
+
+    def remove(self, timeslot: Any) -> None:
+        key = self._key(timeslot)
+        if key is None or key not in self._starts:
+            return
+        start = timeslot.getStartTime()
+        duration = timeslot.getTotalTime() // MICROSECOND
+        starts = self._starts[key]
+        durations = self._durations[key]
+        for idx in range(bisect.bisect_left(starts, start), bisect.bisect_right(starts, start)):
+            if durations[idx] == duration:
+                del starts[idx]
+                del durations[idx]
+                self._dirty.add(key)
+                return
+
+    def addProject(self, project: Any) -> None:
+        for key in self._pending.pop(project.uid, ()):
+            target = (project, key[1])
+            starts = self._starts.pop(key)
+            durations = self._durations.pop(key)
+            self._sums.pop(key, None)
+            self._dirty.discard(key)
+            entries = sorted(zip(self._starts.get(target, []) + starts,
+                                 self._durations.get(target, []) + durations), key=lambda entry: entry[0])
+            self._starts[target] = [start for start, _ in entries]
+            self._durations[target] = [duration for _, duration in entries]
+            self._dirty.add(target)
+
+    def _prefix(self, key: Key) -> List[int]:
+        if key in self._dirty:
+            self._sums[key] = list(itertools.accumulate(self._durations[key], initial=0))
+            self._dirty.discard(key)
+        return self._sums[key]
+
+    def range(self, start: dt.datetime, end: dt.datetime) -> Bucket:
+        """Totals of the slots starting in ``[start, end)``."""
+        totals: Bucket = {}
+        for key, starts in self._starts.items():
+            lo = bisect.bisect_left(starts, start)
+            hi = bisect.bisect_left(starts, end)
+            if lo == hi:
+                continue
+            sums = self._prefix(key)
+            totals[key] = (sums[hi] - sums[lo]) * MICROSECOND
+        return totals
+
+
+class Rollup:
+    """Per-day and per-ISO-week totals keyed by (project, activity).
+
+    Slots are folded in as they are recorded, so a report is a dictionary
+    lookup.  Slots whose project is still an unresolved UUID are keyed by that
+    UUID until ``addProject`` rekeys them to the project object.  ``rebuild``
+    only takes the slots; the buckets are filled on first use, so opening a
+    large timecard does not pay for them up front.  Each bucket counts the
+    slots behind every key, so a key stays while it has slots even if their
+    total is zero.
+    """
+
+    def __init__(self, timeslots: Iterable[Any] = ()):
+        self._days: Dict[dt.date, Bucket] = {}
+        self._weeks: Dict[Tuple[int, int], Bucket] = {}
+        self._dayCounts: Dict[dt.date, Counts] = {}
+        self._weekCounts: Dict[Tuple[int, int], Counts] = {}
+        self._pending: Dict[UUID, Set[Tuple[dt.date, Tuple[int, int]]]] = {}
+        self._ranges = RangeTotals()
+        self._unbuilt: Optional[List[Any]] = None
+        self.rebuild(timeslots)
+
+    def rebuild(self, timeslots: Iterable[Any]) -> None:
+        self._unbuilt = list(timeslots)
+
+    def _materialize(self) -> None:
+        if self._unbuilt is None:
+            return
+        timeslots = self._unbuilt
+        self._unbuilt = None
+        # Sum plain microseconds per day first, so each distinct day costs
+        # one isocalendar() and the buckets are filled once.
+        perDay: Dict[dt.date, Dict[Key, List[int]]] = {}
+        for ts in timeslots:
+            project = ts.getProject()
+            activity = ts.getActivity()
+            if not project or not activity:
+                continue
+            bucket = perDay.setdefault(ts.getStartTime().date(), {})
+            entry = bucket.setdefault((project, activity), [0, 0])
+            entry[0] += ts.getTotalTime() // MICROSECOND
+            entry[1] += 1
+        self._days = {}
+        self._weeks = {}
+        self._dayCounts = {}
+        self._weekCounts = {}
+        self._pending = {}
+        for date, totals in perDay.items():
+            isoDate = date.isocalendar()
+            week = (isoDate[0], isoDate[1])
+            for key, (micros, slots) in totals.items():
+                delta = micros * MICROSECOND
+                self._addTo(self._days.setdefault(date, {}), key, delta,
+                            self._dayCounts.setdefault(date, {}), slots)
+                self._addTo(self._weeks.setdefault(week, {}), key, delta,
+                            self._weekCounts.setdefault(week, {}), slots)
+                if isinstance(key[0], UUID):
+                    self._pending.setdefault(key[0], set()).add((date, week))
+        self._ranges.rebuild(timeslots)
+
+    def add(self, timeslot: Any) -> None:
+        self._materialize()
+        self._apply(timeslot, timeslot.getTotalTime(), 1)
+        self._ranges.add(timeslot)
+
+    def remove(self, timeslot: Any) -> None:
+        self._materialize()
+        self._apply(timeslot, -timeslot.getTotalTime(), -1)
+        self._ranges.remove(timeslot)
+
+    def _apply(self, timeslot: Any, delta: dt.timedelta, slots: int) -> None:
+        project = timeslot.getProject()
+        activity = timeslot.getActivity()
+        if not project or not activity:
+            return
+        date = timeslot.getStartTime().date()
+        isoDate = date.isocalendar()
+        week = (isoDate[0], isoDate[1])
+        key = (project, activity)
+        self._addTo(self._days.setdefault(date, {}), key, delta, self._dayCounts.setdefault(date, {}), slots)
+        self._addTo(self._weeks.setdefault(week, {}), key, delta, self._weekCounts.setdefault(week, {}), slots)
+        if isinstance(project, UUID):
+            self._pending.setdefault(project, set()).add((date, week))
+
+    @staticmethod
+    def _addTo(bucket: Bucket, key: Key, delta: dt.timedelta,
+               counts: Optional[Counts] = None, slots: int = 0) -> None:
+        """Add to a total; with ``counts`` the key goes once its slots do,
+        otherwise once the total is zero."""
+        total = bucket.get(key, dt.timedelta(0)) + delta
+        if counts is None:
+            keep = bool(total)
+        else:
+            remaining = counts.get(key, 0) + slots
+            if remaining > 0:
+                counts[key] = remaining
+            else:
+                counts.pop(key, None)
+            keep = remaining > 0
+        if keep:
+            bucket[key] = total
+        else:
+            bucket.pop(key, None)
+
+    def addProject(self, project: Any) -> None:
+        self._materialize()
+        self._ranges.addProject(project)
+        for date, week in self._pending.pop(project.uid, ()):
+            self._rekey(self._days[date], self._dayCounts[date], project)
+            self._rekey(self._weeks[week], self._weekCounts[week], project)
+
+    @staticmethod
+    def _rekey(bucket: Bucket, counts: Counts, project: Any) -> None:
+        for key in [key for key in bucket if key[0] == project.uid]:
+            Rollup._addTo(bucket, (project, key[1]), bucket.pop(key), counts, counts.pop(key))
+
+    def day(self, date: dt.date) -> Bucket:
+        self._materialize()
+        return dict(self._days.get(date, {}))
+
+    def week(self, year: int, weekNum: int) -> Bucket:
+        self._materialize()
+        return dict(self._weeks.get((year, weekNum), {}))
+
+    def range(self, start: dt.datetime, end: dt.datetime) -> Bucket:
+        self._materialize()
+        return self._ranges.range(start, end)
+
+    def verify(self, timeslots: Iterable[Any]) -> List[Tuple[Any, Key]]:
+        self._materialize()
+        expected = Rollup(timeslots)
+        expected._materialize()
+        mismatches: List[Tuple[Any, Key]] = []
+        for mine, theirs in ((self._days, expected._days), (self._weeks, expected._weeks)):
+            for bucketKey in set(mine) | set(theirs):
+                a = byProjectUid(mine.get(bucketKey, {}))
+                b = byProjectUid(theirs.get(bucketKey, {}))
+                for key in set(a) | set(b):
+                    if a.get(key) != b.get(key):
+                        mismatches.append((bucketKey, key))
+        return mismatches
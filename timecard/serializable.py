@@ -1,11 +1,57 @@
 from __future__ import annotations
 
+import time
 from abc import ABC, abstractclassmethod, abstractmethod
-from typing import Any, Dict, Type, TypeVar, Optional
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple, Type, TypeVar
 from uuid import UUID
 
+from timecard.metrics import Metrics
+
 T = TypeVar('T')
+S = TypeVar('S', bound='Serializable')
+Validator = Callable[[Any], Optional[str]]
+
+
+def compileValidator(fields: Dict[str, type], optional: FrozenSet[str] = frozenset()) -> Validator:
+    """Build a checker equivalent to ``schema.Schema(fields)`` for flat dicts
+    of plain types.  It returns a description of the first problem, or None.
+    """
+    required = frozenset(fields) - optional
+    allowed = frozenset(fields)
+    checks = tuple(fields.items())
+
+    def validate(data: Any) -> Optional[str]:
+        if not isinstance(data, dict):
+            return f'expected a dict, got {type(data).__name__}'
+        keys = data.keys()
+        if not required <= keys:
+            return f'missing keys {sorted(required - keys)}'
+        if not keys <= allowed:
+            return f'unexpected keys {sorted(keys - allowed)}'
+        for key, kind in checks:
+            if key in data and not isinstance(data[key], kind):
+                return f'{key} should be {kind.__name__}, got {type(data[key]).__name__}'
+        return None
+    return validate
+
+
 class Serializable (ABC):
+    __slots__ = ()
+
+    FIELDS: Dict[str, type] = {}
+    OPTIONAL_FIELDS: FrozenSet[str] = frozenset()
+
+    class DeserializationError(RuntimeError):
+        """Raised by ``fromDicts`` after reading every record.
+
+        ``errors`` holds ``(position, message)`` for each rejected record and
+        ``objects`` the records that did deserialize.
+        """
+        def __init__(self, errors: List[Tuple[int, str]], objects: List[Any]):
+            super().__init__(f'{len(errors)} invalid records, first at {errors[0][0]}: {errors[0][1]}')
+            self.errors = errors
+            self.objects = objects
+
     @abstractmethod
     def toDict(self) -> Dict[str, Any]:
         pass
@@ -14,6 +60,57 @@ class Serializable (ABC):
     def fromDict(cls, data: Dict[str, Any]):
         pass
 
+    @abstractclassmethod
+    def _fromTrustedDict(cls: Type[S], data: Dict[str, Any]) -> S:
+        pass
+
+    @classmethod
+    def _validator(cls) -> Validator:
+        validator = cls.__dict__.get('_compiledValidator')
+        if validator is None:
+            validator = compileValidator(cls.FIELDS, cls.OPTIONAL_FIELDS)
+            setattr(cls, '_compiledValidator', validator)
+        return validator
+
+    @classmethod
+    def fromDicts(cls: Type[S], records: Iterable[Dict[str, Any]], trusted: bool = False,
+                  errors: Optional[List[Tuple[int, str]]] = None) -> List[S]:
+        """Deserialize many records at once.
+
+        ``trusted`` skips validation for data this application wrote itself.
+        Bad records are skipped and collected; with ``errors`` given they are
+        appended there, otherwise DeserializationError is raised at the end.
+        """
+        validate = None if trusted else cls._validator()
+        build = cls._fromTrustedDict
+        objects: List[S] = []
+        failed: List[Tuple[int, str]] = []
+        clock = time.perf_counter
+        validating = 0.0
+        started = clock()
+        for position, data in enumerate(records):
+            if validate is not None:
+                validateStart = clock()
+                problem = validate(data)
+                validating += clock() - validateStart
+                if problem is not None:
+                    failed.append((position, problem))
+                    continue
+            try:
+                objects.append(build(data))
+            except (KeyError, ValueError, TypeError) as e:
+                failed.append((position, repr(e)))
+        # Includes time spent by the iterable producing the records.
+        metrics = Metrics.instance()
+        metrics.record('phases', 'deserialize', clock() - started - validating)
+        if validate is not None:
+            metrics.record('phases', 'validate', validating)
+        if failed:
+            if errors is None:
+                raise cls.DeserializationError(failed, objects)
+            errors.extend(failed)
+        return objects
+
     @abstractmethod
     def isComplete(self) -> bool:
         pass
@@ -22,6 +119,19 @@ class Serializable (ABC):
     def complete(self, objects: Dict[UUID, Serializable]):
         pass
 
+    @property
+    @abstractmethod
+    def uid(self) -> UUID:
+        pass
+
+    def references(self) -> List[Tuple[Type[Serializable], UUID]]:
+        """Unresolved references as ``(type, uuid)`` pairs."""
+        return []
+
+    def bind(self, obj: Serializable) -> None:
+        """Replace the reference to ``obj.uid`` with ``obj`` itself."""
+        raise RuntimeError(f'{type(self).__name__} holds no references')
+
     def _resolveObj(self, id: UUID, t: Type[T], objects: Dict[UUID, Serializable]) -> Optional[T]:
         if id in objects:
             obj = objects[id]
@@ -30,3 +140,71 @@ class Serializable (ABC):
             else:
                 raise RuntimeError(f'Expected {id} to be {t}, got {type(obj)} instead!')
         return None
+
+
+Reference = Tuple[Serializable, Type[Serializable], UUID]
+
+
+class ObjectRegistry:
+    """Serializable objects indexed by type and UUID.
+
+    ``resolve`` binds the references of many objects in one pass.  A
+    reference whose target is not registered yet is parked, and bound as
+    soon as the target is added, e.g. a project that arrives after its
+    timeslots during an incremental sync.
+    """
+
+    def __init__(self):
+        self._index: Dict[type, Dict[UUID, Serializable]] = {}
+        self._waiting: Dict[Tuple[type, UUID], List[Serializable]] = {}
+
+    def get(self, t: Type[T], uid: UUID) -> Optional[T]:
+        return self._index.get(t, {}).get(uid)  # type: ignore
+
+    def values(self, t: Type[T]) -> List[T]:
+        return list(self._index.get(t, {}).values())  # type: ignore
+
+    def __contains__(self, obj: Serializable) -> bool:
+        return obj.uid in self._index.get(type(obj), {})
+
+    def add(self, obj: Serializable) -> List[Serializable]:
+        """Register ``obj``; returns the parked objects it completed."""
+        uid = obj.uid
+        bound: List[Serializable] = []
+        for cls in type(obj).__mro__:
+            if cls is Serializable or not issubclass(cls, Serializable):
+                continue
+            self._index.setdefault(cls, {})[uid] = obj
+            for waiting in self._waiting.pop((cls, uid), ()):
+                waiting.bind(obj)
+                bound.append(waiting)
+        return bound
+
+    def addMany(self, objects: Iterable[Serializable]) -> List[Serializable]:
+        bound: List[Serializable] = []
+        for obj in objects:
+            bound.extend(self.add(obj))
+        return bound
+
+    def resolve(self, objects: Iterable[Serializable]) -> List[Reference]:
+        """Bind what can be bound; returns the references left dangling."""
+        dangling: List[Reference] = []
+        for obj in objects:
+            for t, uid in obj.references():
+                target = self._index.get(t, {}).get(uid)
+                if target is not None:
+                    obj.bind(target)
+                else:
+                    self._waiting.setdefault((t, uid), []).append(obj)
+                    dangling.append((obj, t, uid))
+        return dangling
+
+    def dangling(self) -> List[Reference]:
+        return [(obj, t, uid) for (t, uid), objects in self._waiting.items() for obj in objects]
+
+    def forget(self, obj: Serializable) -> None:
+        """Stop waiting on behalf of ``obj`` (e.g. it was replaced)."""
+        for key, objects in list(self._waiting.items()):
+            objects[:] = [waiting for waiting in objects if waiting is not obj]
+            if not objects:
+                del self._waiting[key]
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from uuid import UUID
+
+from timecard.data import Activity, Project, Timeslot
+from timecard.journal import replaceAtomically
+from timecard.metrics import Metrics
+
+NO_END = -(1 << 63)
+
+Fingerprint = Tuple[int, int]
+
+
+class Snapshot:
+    """Binary image of a Timecard's projects and timeslots.
+
+    Layout, all little-endian::
+
+        header    magic, version, source size and mtime (ns), counts, crc32
+        uids      16 bytes per project, then per unresolved project UUID
+        projects  name and desc string indices
+        timeslots uuid, start, end, uid index, activity and msg string indices
+        strings   u32 end offsets, then the UTF-8 blob
+
+    Activities are stored by value, with the empty string for none, so
+    adding or reordering ``Activity`` members does not change their meaning.
+    The crc32 covers everything after the header.  A snapshot only stands
+    for the source file whose size and mtime it recorded; ``load`` returns
+    None when the file is missing, damaged, of another version, stale or
+    names an activity this version does not know, and the caller reads the
+    source instead.
+    """
+
+    MAGIC = b'TCSNAP'
+    VERSION = 2
+    HEADER = struct.Struct('<6sHqqIIIII')
+    PROJECT = struct.Struct('<II')
+    TIMESLOT = struct.Struct('<16sqqIII')
+
+    @staticmethod
+    def fingerprint(source: Path) -> Optional[Fingerprint]:
+        try:
+            stat = source.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def write(cls, path: Path, source: Path, projects: Iterable[Project], timeslots: Iterable[Timeslot]) -> None:
+        fingerprint = cls.fingerprint(source)
+        if fingerprint is None:
+            raise RuntimeError(f'{source} does not exist')
+        projects = list(projects)
+        strings: Dict[str, int] = {'': 0}
+        blob: List[bytes] = [b'']
+
+        def intern(value: str) -> int:
+            index = strings.get(value)
+            if index is None:
+                index = strings[value] = len(blob)
+                blob.append(value.encode('utf-8'))
+            return index
+
+        uidIndex: Dict[UUID, int] = {project.uid: i for i, project in enumerate(projects)}
+        extraUids: List[UUID] = []
+        projectRecords = [cls.PROJECT.pack(intern(project.name), intern(project.desc)) for project in projects]
+        slotRecords = []
+        pack = cls.TIMESLOT.pack
+        # Stored by start time so the loader's index sort has nothing to do.
+        for timeslot in sorted(timeslots, key=lambda ts: ts.getStartEpoch()):
+            project = timeslot.getProject()
+            uid = project.uid if isinstance(project, Project) else project
+            if uid is None:
+                projectRef = 0xffffffff
+            else:
+                projectRef = uidIndex.get(uid)
+                if projectRef is None:
+                    projectRef = uidIndex[uid] = len(projects) + len(extraUids)
+                    extraUids.append(uid)
+            activity = timeslot.getActivity()
+            endEpoch = timeslot.getEndEpoch()
+            slotRecords.append(pack(timeslot.uid.bytes, timeslot.getStartEpoch(),
+                                    NO_END if endEpoch is None else endEpoch, projectRef,
+                                    0 if activity is None else intern(activity.value),
+                                    intern(timeslot.getMsg())))
+
+        offsets = []
+        end = 0
+        for value in blob:
+            end += len(value)
+            offsets.append(end)
+        body = b''.join([b''.join(project.uid.bytes for project in projects),
+                         b''.join(uid.bytes for uid in extraUids),
+                         b''.join(projectRecords),
+                         b''.join(slotRecords),
+                         struct.pack(f'<{len(offsets)}I', *offsets),
+                         b''.join(blob)])
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, fingerprint[0], fingerprint[1],
+                                 len(projects), len(extraUids), len(slotRecords), len(offsets),
+                                 zlib.crc32(body))
+        tmpPath = Path(path.as_posix() + '.tmp')
+        with open(tmpPath, 'wb') as f:
+            f.write(header)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        replaceAtomically(tmpPath, path)
+        Metrics.instance().count('bytesWritten', len(header) + len(body))
+
+    @classmethod
+    def load(cls, path: Path, source: Path) -> Optional[Tuple[List[Project], List[Timeslot]]]:
+        result = cls._load(path, source)
+        Metrics.instance().count('snapshotHits' if result is not None else 'snapshotMisses')
+        return result
+
+    @classmethod
+    def _load(cls, path: Path, source: Path) -> Optional[Tuple[List[Project], List[Timeslot]]]:
+        fingerprint = cls.fingerprint(source)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if fingerprint is None or len(data) < cls.HEADER.size:
+            return None
+        magic, version, size, mtime, projectCount, extraCount, slotCount, stringCount, crc = \
+            cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION or (size, mtime) != fingerprint:
+            return None
+        body = memoryview(data)[cls.HEADER.size:]
+        if zlib.crc32(body) != crc:
+            return None
+        Metrics.instance().count('bytesRead', len(data))
+
+        offset = 0
+        uidBytes = body[offset:offset + 16 * (projectCount + extraCount)]
+        offset += len(uidBytes)
+        projectBytes = body[offset:offset + cls.PROJECT.size * projectCount]
+        offset += len(projectBytes)
+        slotBytes = body[offset:offset + cls.TIMESLOT.size * slotCount]
+        offset += len(slotBytes)
+        ends = struct.unpack_from(f'<{stringCount}I', body, offset)
+        offset += 4 * stringCount
+        blob = bytes(body[offset:])
+        strings = [blob[start:end].decode('utf-8') for start, end in zip((0,) + ends, ends)]
+
+        uids = [UUID(bytes=bytes(uidBytes[16 * i:16 * (i + 1)])) for i in range(projectCount + extraCount)]
+        projects = [Project(strings[name], strings[desc], uids[i])
+                    for i, (name, desc) in enumerate(cls.PROJECT.iter_unpack(projectBytes))]
+        refs: List[Optional[Union[Project, UUID]]] = [*projects, *uids[projectCount:]]
+        records = list(cls.TIMESLOT.iter_unpack(slotBytes))
+        activities: Dict[int, Optional[Activity]] = {0: None}
+        try:
+            for index in {record[4] for record in records} - {0}:
+                activities[index] = Activity(strings[index])
+        except ValueError:
+            return None
+        fromFields = Timeslot._fromFields
+        fromBytes = int.from_bytes
+        timeslots = [fromFields(start, None if end == NO_END else end,
+                                refs[projectRef] if projectRef != 0xffffffff else None,
+                                activities[activity], fromBytes(uid, 'big'), strings[msg])
+                     for uid, start, end, projectRef, activity, msg in records]
+        return projects, timeslots
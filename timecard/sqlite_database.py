@@ -0,0 +1,238 @@
+import datetime as dt
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from uuid import UUID
+
+from timecard import xml_data
+from timecard.audit import Finding, OverlapError, sweep
+from timecard.data import Activity, Project, Timeslot
+from timecard.xml_database import Timecard as XmlTimecard
+
+
+class Timecard:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS projects (
+            uuid TEXT PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            desc TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS timeslots (
+            uuid TEXT PRIMARY KEY,
+            project TEXT NOT NULL REFERENCES projects(uuid),
+            activity TEXT NOT NULL,
+            startTime INTEGER NOT NULL,
+            endTime INTEGER NOT NULL,
+            msg TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS timeslots_startTime ON timeslots(startTime);
+        CREATE INDEX IF NOT EXISTS timeslots_endTime ON timeslots(endTime);
+        CREATE INDEX IF NOT EXISTS timeslots_project_activity ON timeslots(project, activity);
+    """
+    TIMESLOT_COLUMNS = "uuid, project, activity, startTime, endTime, msg"
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._projects: Set[Project] = set()
+        self._projectsById: Dict[str, Project] = {}
+        self._activeSlot: Optional[Timeslot] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self.skippedTimeslots = 0
+        self.open()
+
+    def open(self):
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self._filename)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._conn.executescript(self.SCHEMA)
+        self._projects = set()
+        self._projectsById = {}
+        for row in self._conn.execute('SELECT uuid, name, desc FROM projects'):
+            self.__cacheProject(Project(name=row[1], desc=row[2], uid=UUID(row[0])))
+
+    def close(self):
+        if self._conn is None:
+            return
+        self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            raise RuntimeError("Timecard is closed")
+        return self._conn
+
+    def __cacheProject(self, project: Project):
+        self._projects.add(project)
+        self._projectsById[project.uid.hex] = project
+
+    def addProject(self, project: Project) -> None:
+        for existingProject in self._projects:
+            assert(str(project) != str(existingProject))
+        with self._db:
+            self._db.execute('INSERT INTO projects (uuid, name, desc) VALUES (?, ?, ?)',
+                             (project.uid.hex, project.name, project.desc))
+        self.__cacheProject(project)
+
+    def start(self, startTime: dt.datetime = None) -> None:
+        if self._activeSlot is not None:
+            raise RuntimeError
+        self._activeSlot = Timeslot(startTime=startTime)
+
+    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg: str = '',
+             allowOverlap: bool = False) -> None:
+        if project not in self._projects:
+            raise RuntimeError("Project not registered")
+        if self._activeSlot is None:
+            raise RuntimeError("Timeslot not started")
+        self._activeSlot.setProject(project, activity)
+        self._activeSlot.setEndTime(endTime=endTime)
+        self._activeSlot.setMsg(msg)
+        if not allowOverlap:
+            overlaps = self.getOverlapping(self._activeSlot.getStartTime(), self._activeSlot.getEndTime())
+            if overlaps:
+                raise OverlapError(self._activeSlot, overlaps)
+        with self._db:
+            self._db.execute(f'INSERT INTO timeslots ({self.TIMESLOT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+                             self._toRow(self._activeSlot.toDict()))
+        self._activeSlot = None
+
+    @staticmethod
+    def _toRow(data: Dict[str, Any]) -> Tuple[Any, ...]:
+        return (data['uuid'], data['project'], data['activity'],
+                data['startTime'], data['endTime'], data.get('msg') or '')
+
+    def _fromRow(self, row: Tuple[Any, ...]) -> Timeslot:
+        return Timeslot(
+            project=self._projectsById.get(row[1], UUID(row[1])),
+            startTime=dt.datetime.fromtimestamp(row[3]),
+            endTime=dt.datetime.fromtimestamp(row[4]),
+            activity=Activity(row[2]),
+            uid=UUID(row[0]),
+            msg=row[5])
+
+    def getRangeTotals(self, start: dt.datetime, end: dt.datetime) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        cursor = self._db.execute(
+            'SELECT project, activity, SUM(endTime - startTime) FROM timeslots '
+            'WHERE startTime >= ? AND startTime < ? GROUP BY project, activity',
+            (int(start.timestamp()), int(end.timestamp())))
+        return {(self._projectsById.get(project, UUID(project)), Activity(activity)): dt.timedelta(seconds=total)
+                for project, activity, total in cursor}
+
+    def getDayTotals(self, date: dt.date = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        if date is None:
+            date = dt.date.today()
+        return self.getRangeTotals(*self._dayRange(date))
+
+    def getWeekTotals(self, weekNum: int = None, year: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        return self.getRangeTotals(*self._weekRange(weekNum, year))
+
+    def getRangeEntries(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        cursor = self._db.execute(
+            f'SELECT {self.TIMESLOT_COLUMNS} FROM timeslots '
+            'WHERE startTime >= ? AND startTime < ? ORDER BY startTime',
+            (int(start.timestamp()), int(end.timestamp())))
+        return [self._fromRow(row) for row in cursor]
+
+    def getOverlapping(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        if end <= start:
+            return []
+        # Earlier slots still running at start come off the endTime index;
+        # the ones starting inside the range off the startTime index.
+        earlier = self._db.execute(
+            f'SELECT {self.TIMESLOT_COLUMNS} FROM timeslots WHERE endTime > ? AND startTime < ? '
+            'ORDER BY startTime', (int(start.timestamp()), int(start.timestamp())))
+        return [self._fromRow(row) for row in earlier] + self.getRangeEntries(start, end)
+
+    def audit(self, minGap: dt.timedelta = None) -> List[Finding]:
+        cursor = self._db.execute(f'SELECT {self.TIMESLOT_COLUMNS} FROM timeslots ORDER BY startTime')
+        return sweep((self._fromRow(row) for row in cursor), minGap, presorted=True)
+
+    def getDayEntries(self, date: dt.date = None) -> List[Timeslot]:
+        if date is None:
+            date = dt.date.today()
+        return self.getRangeEntries(*self._dayRange(date))
+
+    def getWeekEntries(self, weekNum: int = None, year: int = None) -> List[Timeslot]:
+        return self.getRangeEntries(*self._weekRange(weekNum, year))
+
+    @staticmethod
+    def _dayRange(date: dt.date) -> Tuple[dt.datetime, dt.datetime]:
+        start = dt.datetime.combine(date, dt.time.min)
+        return start, start + dt.timedelta(days=1)
+
+    @staticmethod
+    def _weekRange(weekNum: Optional[int], year: Optional[int]) -> Tuple[dt.datetime, dt.datetime]:
+        if weekNum is None:
+            weekNum = dt.date.today().isocalendar()[1]
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        start = dt.datetime.combine(dt.date.fromisocalendar(year, weekNum, 1), dt.time.min)
+        return start, start + dt.timedelta(weeks=1)
+
+    def getProjects(self) -> Dict[str, Project]:
+        return {project.name: project for project in self._projects}
+
+    def getLastEntry(self) -> Timeslot:
+        row = self._db.execute(
+            f'SELECT {self.TIMESLOT_COLUMNS} FROM timeslots ORDER BY endTime DESC LIMIT 1').fetchone()
+        if row is None:
+            raise RuntimeError("No timeslots recorded")
+        return self._fromRow(row)
+
+    def importRecords(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> Tuple[int, int]:
+        """Insert ``(tag, toDict())`` records, skipping UUIDs already stored.
+
+        The whole batch is validated before anything is written.  Slots whose
+        project is neither stored nor in the batch would break the foreign
+        key, so they are skipped and counted in ``skippedTimeslots``.
+        Returns the number of projects and timeslots read.
+        """
+        projectRecords: List[Dict[str, Any]] = []
+        timeslotRecords: List[Dict[str, Any]] = []
+        for tag, data in records:
+            if tag == XmlTimecard.PROJECT_TAG:
+                projectRecords.append(data)
+            elif tag == XmlTimecard.TIMESLOT_TAG:
+                timeslotRecords.append(data)
+        projects = Project.fromDicts(projectRecords)
+        timeslots = Timeslot.fromDicts(timeslotRecords)
+        with self._db:
+            for project in projects:
+                if project.uid.hex not in self._projectsById:
+                    self._db.execute('INSERT INTO projects (uuid, name, desc) VALUES (?, ?, ?)',
+                                     (project.uid.hex, project.name, project.desc))
+                    self.__cacheProject(project)
+            rows = [self._toRow(timeslot.toDict()) for timeslot in timeslots]
+            known = [row for row in rows if row[1] in self._projectsById]
+            self.skippedTimeslots += len(rows) - len(known)
+            self._db.executemany(f'INSERT OR IGNORE INTO timeslots ({self.TIMESLOT_COLUMNS}) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)', known)
+        return len(projectRecords), len(timeslotRecords)
+
+    def readRecords(self, start: dt.datetime = None, end: dt.datetime = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream projects, then timeslots by start time, as ``toDict`` records."""
+        for project in self._projects:
+            yield XmlTimecard.PROJECT_TAG, project.toDict()
+        bounds = (int(start.timestamp()) if start else -(1 << 62), int(end.timestamp()) if end else 1 << 62)
+        cursor = self._db.execute(
+            f'SELECT {self.TIMESLOT_COLUMNS} FROM timeslots '
+            'WHERE startTime >= ? AND startTime < ? ORDER BY startTime', bounds)
+        columns = [column.strip() for column in self.TIMESLOT_COLUMNS.split(',')]
+        for row in cursor:
+            yield XmlTimecard.TIMESLOT_TAG, dict(zip(columns, row))
+
+    def importXml(self, filename: str) -> Tuple[int, int]:
+        return self.importRecords(XmlTimecard.readRecords(filename))
+
+    def importLegacyXml(self, filename: str) -> Tuple[int, int]:
+        return self.importRecords(xml_data.Timecard.readRecords(filename))
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from timecard.journal import replaceAtomically
+
+if TYPE_CHECKING:
+    from timecard.firebase import RealtimeDatabase
+
+Records = Dict[str, Dict[str, Any]]
+
+
+class DeltaSync:
+    """Local snapshot of a user's subtree plus a server-side sync cursor.
+
+    Every record the Timecard writes carries an ``updated`` field set by the
+    server (``{".sv": "timestamp"}``).  The cursor is the largest value seen,
+    so later pulls only ask for children ordered by ``updated`` starting at
+    the cursor and merge them into the snapshot.  Without a snapshot the
+    whole subtree is fetched once.
+
+    The server needs ``".indexOn": ["updated"]`` on the ``projects`` and
+    ``timeslots`` nodes for the ordered queries.
+
+    Records written by older clients have no ``updated`` field, so ordered
+    queries never return them.  Every ``fullResyncInterval`` seconds a fetch
+    downloads the whole subtree again to catch them, and ``backfill`` stamps
+    them so that later edits show up in ordinary delta pulls.  Fetches only
+    return records that differ from the snapshot.
+
+    Deletions are only seen by the full download: records the server no
+    longer has come back as ``None``, as in a multi-path update, and
+    ``merge`` drops them.  Our own writes still waiting for the server are
+    not treated as deleted.
+
+    The snapshot file is read on first access to ``records`` or ``cursor``,
+    so a caller that can start from a binary snapshot does not parse it.
+    """
+
+    FIELD = 'updated'
+    KINDS = ('projects', 'timeslots')
+
+    def __init__(self, snapshotPath: Path, fullResyncInterval: Optional[float] = 86400.0):
+        self._path = snapshotPath
+        self.fullResyncInterval = fullResyncInterval
+        self._cursor: Optional[int] = None
+        self._fullSync: Optional[float] = None
+        self._fullSyncStarted: Optional[float] = None
+        self._records: Dict[str, Records] = {kind: {} for kind in self.KINDS}
+        self._loaded = False
+        self._loadLock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def records(self) -> Dict[str, Records]:
+        self.load()
+        return self._records
+
+    @property
+    def cursor(self) -> Optional[int]:
+        self.load()
+        return self._cursor
+
+    @cursor.setter
+    def cursor(self, cursor: Optional[int]) -> None:
+        self.load()
+        self._cursor = cursor
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        # The first access may come from the event loop and a caller at once.
+        with self._loadLock:
+            if not self._loaded:
+                self.__read()
+                self._loaded = True
+
+    def __read(self) -> None:
+        if not self._path.is_file():
+            return
+        try:
+            with open(self._path, 'r') as f:
+                data = json.load(f)
+            records = {kind: dict(data[kind]) for kind in self.KINDS}
+            cursor = data['cursor']
+            fullSync = data.get('fullSync')
+        except (ValueError, KeyError, TypeError):
+            # A damaged snapshot only costs one full download.
+            return
+        self._records = records
+        self._cursor = cursor
+        self._fullSync = fullSync
+
+    def save(self) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmpPath = self._path.with_name(self._path.name + '.tmp')
+        with open(tmpPath, 'w') as f:
+            json.dump(dict(self.records, cursor=self.cursor, fullSync=self._fullSync), f, separators=(',', ':'))
+        replaceAtomically(tmpPath, self._path)
+
+    async def pull(self, db: RealtimeDatabase, root: str) -> Dict[str, Records]:
+        changed = await self.fetch(db, root)
+        self.merge(changed)
+        self.save()
+        return changed
+
+    @property
+    def fullResyncDue(self) -> bool:
+        if self.cursor is None or self._fullSync is None:
+            return True
+        return self.fullResyncInterval is not None and time.time() - self._fullSync >= self.fullResyncInterval
+
+    async def fetch(self, db: RealtimeDatabase, root: str) -> Dict[str, Records]:
+        """Records that differ from the snapshot; ``merge`` applies them."""
+        if self.fullResyncDue:
+            started = time.time()
+            data = await db.get(root)
+            if not isinstance(data, dict):
+                data = {}
+            # Recorded as the last full sync once merged.
+            self._fullSyncStarted = started
+            return {kind: self.__withDeletions(kind, data.get(kind)) for kind in self.KINDS}
+        results = await asyncio.gather(*(self.__query(db, root, kind) for kind in self.KINDS))
+        return dict(zip(self.KINDS, results))
+
+    async def __query(self, db: RealtimeDatabase, root: str, kind: str) -> Records:
+        # startAt is inclusive, so records stamped at the cursor come back
+        # every time; __changedOnly drops them.
+        data = await db.get(f'{root}/{kind}', orderBy=self.FIELD, startAt=self.cursor)
+        return self.__changedOnly(kind, data)
+
+    def __changedOnly(self, kind: str, data: Any) -> Records:
+        if not isinstance(data, dict):
+            return {}
+        known = self.records[kind]
+        return {key: record for key, record in data.items() if known.get(key) != record}
+
+    def __withDeletions(self, kind: str, data: Any) -> Records:
+        changed: Dict[str, Any] = self.__changedOnly(kind, data)
+        present = data if isinstance(data, dict) else {}
+        for key, record in self.records[kind].items():
+            if key not in present and not self.__unsent(record):
+                changed[key] = None
+        return changed
+
+    @classmethod
+    def __unsent(cls, record: Any) -> bool:
+        # Local writes keep the server value placeholder until pulled back.
+        return isinstance(record, dict) and isinstance(record.get(cls.FIELD), dict)
+
+    def unstamped(self) -> List[Tuple[str, str]]:
+        """``(kind, key)`` of snapshot records without an ``updated`` field.
+
+        Our own queued writes hold the server placeholder instead and are
+        not listed.
+        """
+        return [(kind, key) for kind in self.KINDS for key, record in self.records[kind].items()
+                if isinstance(record, dict) and self.FIELD not in record]
+
+    async def backfill(self, db: RealtimeDatabase, root: str, batchSize: int = 500) -> int:
+        """Stamp records that older clients wrote without ``updated``.
+
+        Only the stamp is written, as multi-path updates of ``batchSize``
+        paths, so a concurrent edit of the record itself is not overwritten.
+        The stamped records come back with the next delta pull.
+        """
+        paths = [f'{kind}/{key}/{self.FIELD}' for kind, key in self.unstamped()]
+        for i in range(0, len(paths), batchSize):
+            await db.update(root, {path: {'.sv': 'timestamp'} for path in paths[i:i + batchSize]})
+        return len(paths)
+
+    def merge(self, changed: Dict[str, Records]) -> None:
+        if self._fullSyncStarted is not None:
+            self._fullSync = self._fullSyncStarted
+            self._fullSyncStarted = None
+        cursor = self.cursor or 0
+        for kind, records in changed.items():
+            for key, record in records.items():
+                if record is None:
+                    self.records[kind].pop(key, None)
+                    continue
+                self.records[kind][key] = record
+                updated = record.get(self.FIELD)
+                if isinstance(updated, int) and updated > cursor:
+                    cursor = updated
+        self.cursor = cursor
+
+    @classmethod
+    def stamp(cls, data: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(data, **{cls.FIELD: {'.sv': 'timestamp'}})
+
+    @classmethod
+    def strip(cls, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in data.items() if key != cls.FIELD}
+
+    def values(self, kind: str) -> Tuple[Dict[str, Any], ...]:
+        return tuple(self.strip(record) for record in self.records[kind].values())
@@ -1,21 +1,68 @@
-#!/usr/bin/env python3.7
+#!/usr/bin/env python3.8
+import argparse
+import atexit
+import csv
 import datetime as dt
+import json
 import sys
+import time
 import traceback
 from pathlib import Path
+from typing import Dict, Optional, Union
+from uuid import UUID
 
 import appdirs
 import IPython
 
 import timecard
+from timecard.audit import OverlapError
 from timecard.config import Config
 from timecard.data import Activity, Project, Timeslot
-from timecard.firebase import Timecard
+from timecard.metrics import InstrumentedBackend, Metrics
+from timecard.profiling import Profiler
+
+
+def openTimecard(config: Config):
+    if config.backend == 'firebase':
+        from timecard.firebase import Timecard as FirebaseTimecard
+        return FirebaseTimecard()
+    config.dataPath.parent.mkdir(parents=True, exist_ok=True)
+    if config.backend == 'sqlite':
+        from timecard.sqlite_database import Timecard as SqliteTimecard
+        return SqliteTimecard(config.dataPath.as_posix())
+    if config.backend == 'mmap':
+        from timecard.mmap_database import Timecard as MmapTimecard
+        return MmapTimecard(config.dataPath.as_posix())
+    if config.backend == 'xml':
+        from timecard.xml_database import Timecard as XmlTimecard
+        return XmlTimecard(config.dataPath.as_posix())
+    raise RuntimeError(f'Unknown backend {config.backend}')
+
+
+def projectName(project: Union[Project, UUID, None]) -> str:
+    # Slots whose project has not been synced yet still hold its UUID.
+    if isinstance(project, Project):
+        return project.name
+    if isinstance(project, UUID):
+        return f'Unknown({project.hex[:8]})'
+    return 'Unknown'
 
 
 class TimeCardCLI:
-    def __init__(self):
-        self.tc = Timecard()
+    def __init__(self, profile: bool = False, profileDir: Optional[Path] = None):
+        config = Config.instance()
+        self.metrics = Metrics.instance()
+        if profileDir is None:
+            profileDir = config.logPath.parent.joinpath(
+                'profiles', dt.datetime.now().strftime('%Y%m%d-%H%M%S'))
+        self.profiler = Profiler(profileDir)
+        self.rejectOverlaps = config.rejectOverlaps
+        if profile:
+            self.profiler.start()
+        with self.metrics.timer('calls', 'open'), self.profiler.command('open'):
+            self.tc = InstrumentedBackend(openTimecard(config), self.metrics)
+        if config.dumpMetrics:
+            atexit.register(self.dumpMetrics, config.logPath.parent)
         print("E4E Timecard Application")
 
         lut = {
@@ -29,8 +76,14 @@ class TimeCardCLI:
             "cli": self.cli,
             "weekrpt": self.weekReport,
             "weekentries": self.weekEntries,
+            "rangerpt": self.rangeReport,
+            "audit": self.auditCmd,
             "addproject": self.addProjectCmd,
             "listprojects": self.listProjectCmd,
+            "import": self.importCmd,
+            "queue": self.queueCmd,
+            "stats": self.statsCmd,
+            "profile": self.profileCmd,
         }
 
         self._run = True
@@ -39,8 +92,11 @@ class TimeCardCLI:
             userInput = input("> ")
             if userInput == '':
                 continue
+            command = userInput.strip().lower().split()[0]
             try:
-                lut[userInput.strip().lower().split()[0]](userInput)
+                handler = lut[command]
+                with self.metrics.timer('commands', command), self.profiler.command(command):
+                    handler(userInput)
             except Exception as e:
                 print("Invalid input")
                 print(e)
@@ -80,11 +136,7 @@ class TimeCardCLI:
             startTime = self.__roundTime(timeSlot.getStartTime())
             endTime = startTime + \
                 self.__roundTimeDelta(timeSlot.getTotalTime())
-            ts_proj = timeSlot.getProject()
-            if ts_proj:
-                ts_proj_name = ts_proj.name
-            else:
-                ts_proj_name = 'Unknown'
+            ts_proj_name = projectName(timeSlot.getProject())
             ts_act = timeSlot.getActivity()
             if ts_act:
                 ts_act_name = ts_act.value
@@ -104,7 +156,7 @@ class TimeCardCLI:
         for projectTuple, interval in report.items():
             hours = interval.total_seconds() / 60 / 60
             print("%s.%s: %.2f" %
-                  (projectTuple[0].name, projectTuple[1].value, hours))
+                  (projectName(projectTuple[0]), projectTuple[1].value, hours))
             totalHours += hours
 
         print("Total: %.2f" % totalHours)
@@ -115,8 +167,7 @@ class TimeCardCLI:
             activityCode = input.strip().upper().split()[2].strip()
             assert(projectCode in self.tc.getProjects())
             Activity(activityCode)
-            self.tc.stop(self.tc.getProjects()[
-                         projectCode], Activity(activityCode))
+            self.__stop(self.tc.getProjects()[projectCode], Activity(activityCode))
         else:
             projectCode = input.strip().upper().split()[1].strip()
             activityCode = input.strip().upper().split()[2].strip()
@@ -124,9 +175,50 @@ class TimeCardCLI:
                                             3].strip(), "%Y.%m.%d.%H.%M")
             assert(projectCode in self.tc.getProjects())
             Activity(activityCode)
-            self.tc.stop(self.tc.getProjects()[projectCode], Activity(
+            self.__stop(self.tc.getProjects()[projectCode], Activity(
                 activityCode), endTime=dateCode)
 
+    def __stop(self, project: Project, activity: Activity, endTime: dt.datetime = None):
+        try:
+            self.tc.stop(project, activity, endTime=endTime)
+        except OverlapError as e:
+            print("Warning: this entry overlaps:")
+            for timeSlot in e.overlaps:
+                self.__printSlot(timeSlot)
+            if self.rejectOverlaps:
+                print("Entry rejected, stop again with a different end time")
+                return
+            self.tc.stop(project, activity, endTime=endTime, allowOverlap=True)
+
+    def __printSlot(self, timeSlot):
+        timeFmt = "%Y.%m.%d %H:%M"
+        print("  %s - %s %s.%s" % (
+            timeSlot.getStartTime().strftime(timeFmt),
+            timeSlot.getEndTime().strftime(timeFmt),
+            projectName(timeSlot.getProject()),
+            timeSlot.getActivity().value if timeSlot.getActivity() else ''))
+
+    def auditCmd(self, cmd: str):
+        cmd_tokens = cmd.split()
+        minGap = None
+        if len(cmd_tokens) > 1:
+            minGap = dt.timedelta(minutes=int(cmd_tokens[1]))
+        findings = self.tc.audit(minGap)
+        if not findings:
+            print("No problems found")
+            return
+        timeFmt = "%Y.%m.%d %H:%M"
+        for finding in findings:
+            print("%s: %s - %s (%.2f h)" % (
+                finding.kind, finding.start.strftime(timeFmt), finding.end.strftime(timeFmt),
+                finding.length.total_seconds() / 60 / 60))
+            for timeSlot in finding.slots:
+                self.__printSlot(timeSlot)
+        counts = {}
+        for finding in findings:
+            counts[finding.kind] = counts.get(finding.kind, 0) + 1
+        print("\n" + ", ".join("%d %s" % (count, kind) for kind, count in sorted(counts.items())))
+
     def start(self, input):
         if len(input.strip().split()) == 1:
             self.tc.start()
@@ -147,6 +239,7 @@ class TimeCardCLI:
     def exit(self, *args):
         self.tc.close()
         self._run = False
+        self.profileCmd('profile off')
 
     def listProjectCmd(self, *args):
         projects = self.tc.getProjects()
@@ -163,6 +256,60 @@ class TimeCardCLI:
         self.tc.addProject(new_proj)
         print("New project added")
 
+    def importCmd(self, cmd: str):
+        cmd_tokens = cmd.split()
+        if len(cmd_tokens) < 2 or not hasattr(self.tc, 'importXml'):
+            raise RuntimeError("usage: import FILE [legacy] (sqlite and mmap backends only)")
+        if len(cmd_tokens) > 2 and cmd_tokens[2].lower() == 'legacy':
+            projects, timeslots = self.tc.importLegacyXml(cmd_tokens[1])
+        else:
+            projects, timeslots = self.tc.importXml(cmd_tokens[1])
+        print("Imported %d projects and %d timeslots" % (projects, timeslots))
+        if getattr(self.tc, 'skippedTimeslots', 0):
+            print("Skipped %d timeslots whose project is unknown" % self.tc.skippedTimeslots)
+
+    def queueCmd(self, *args):
+        if not hasattr(self.tc, 'writeQueueStatus'):
+            print("This backend writes synchronously")
+            return
+        status = self.tc.writeQueueStatus()
+        print("Online: %s" % ("yes" if self.tc.online else "no"))
+        if self.tc.lastSync is not None:
+            print("Last sync: %s" % dt.datetime.fromtimestamp(self.tc.lastSync).strftime("%Y.%m.%d %H:%M:%S"))
+        if self.tc.syncError is not None:
+            print("Sync error: %s" % self.tc.syncError)
+        print("Pending writes: %d (%d in flight)" % (status.depth, status.inFlight))
+        if status.lastFlush is not None:
+            print("Last flush: %s" % dt.datetime.fromtimestamp(status.lastFlush).strftime("%Y.%m.%d %H:%M:%S"))
+        if status.lastError is not None:
+            print("Last error: %s (%d failures)" % (status.lastError, status.failures))
+        if status.lastRejection is not None:
+            print("Rejected writes: %d, last: %s" % (status.rejected, status.lastRejection))
+
+    def statsCmd(self, cmd: str):
+        cmd_tokens = cmd.split()
+        if len(cmd_tokens) > 1 and cmd_tokens[1].lower() == 'reset':
+            self.metrics.reset()
+            print("Metrics reset")
+        elif len(cmd_tokens) > 1 and cmd_tokens[1].lower() == 'json':
+            print(json.dumps(self.metrics.toDict(), indent=2))
+        else:
+            print(self.metrics.format())
+
+    def profileCmd(self, cmd: str):
+        cmd_tokens = cmd.split()
+        if len(cmd_tokens) > 1 and cmd_tokens[1].lower() == 'on':
+            self.profiler.start()
+            print("Profiling commands into %s" % self.profiler.directory)
+        elif len(cmd_tokens) > 1 and cmd_tokens[1].lower() == 'off':
+            if self.profiler.stop() is not None:
+                print("Profiles written to %s" % self.profiler.directory)
+        else:
+            print("Profiling is %s" % ("on" if self.profiler.enabled else "off"))
+
+    def dumpMetrics(self, directory: Path):
+        print("Metrics written to %s" % self.metrics.dump(directory))
+
     def printHelp(self, *args):
         print("help - print this message")
         print("start - start an activity")
@@ -183,15 +330,46 @@ class TimeCardCLI:
         print("entries - generate entries")
         print("          usage: report [DATE]")
         print("            where DATE is YYYY.MM.DD")
+        print("rangerpt - generate report over a date range")
+        print("           usage: rangerpt START END")
+        print("             where START and END are YYYY.MM.DD, END inclusive")
+        print("audit - report overlapping entries, bad durations and gaps")
+        print("        usage: audit [MINUTES]")
+        print("          where gaps longer than MINUTES within a day are reported")
+        print("queue - show sync status and pending background writes")
+        print("stats - show command latency, backend calls and I/O counters")
+        print("        usage: stats [json|reset]")
+        print("profile - profile each command with cProfile and tracemalloc")
+        print("          usage: profile [on|off]")
+        print("import - import an XML timecard into the sqlite or mmap backend")
+        print("         usage: import FILE [legacy]")
 
     def weekReport(self, input):
         weeknum = dt.date.today().isocalendar()[1]
         if len(input.strip().split()) == 2:
             weeknum = int(input.strip().split()[1])
         report = self.tc.getWeekTotals(weeknum)
-        totalHours = 0
 
         print("Report for Week %d\n" % (weeknum))
+        self.__printProjectTotals(report)
+
+    def rangeReport(self, input):
+        cmd_tokens = input.strip().split()
+        if len(cmd_tokens) != 3:
+            raise RuntimeError("usage: rangerpt START END")
+        startDate = dt.datetime.strptime(cmd_tokens[1], "%Y.%m.%d").date()
+        endDate = dt.datetime.strptime(cmd_tokens[2], "%Y.%m.%d").date()
+        if endDate < startDate:
+            raise RuntimeError("END is before START")
+        # END is inclusive: a pay period 2024.01.01 2024.01.15 covers the 15th.
+        report = self.tc.getRangeTotals(dt.datetime.combine(startDate, dt.time.min),
+                                        dt.datetime.combine(endDate + dt.timedelta(days=1), dt.time.min))
+
+        print("Report for %s - %s\n" % (startDate.strftime("%Y.%m.%d"), endDate.strftime("%Y.%m.%d")))
+        self.__printProjectTotals(report)
+
+    def __printProjectTotals(self, report):
+        totalHours = 0
         projectDict = {}
         for projectTuple in report.keys():
             if projectTuple[0] in projectDict:
@@ -210,7 +388,7 @@ class TimeCardCLI:
                 else:
                     projectHours += hours
                 totalHours += hours
-            print("%s: %.2f" % (project.name, projectHours))
+            print("%s: %.2f" % (projectName(project), projectHours))
 
         print("\nMeetings: %.2f" % (meetingHours))
         print("\nTotal: %.2f" % totalHours)
@@ -237,11 +415,7 @@ class TimeCardCLI:
                 continue
             hours = (ts_end - timeSlot.getStartTime()
                      ).total_seconds() / 60 / 60
-            ts_proj = timeSlot.getProject()
-            if ts_proj:
-                ts_proj_name = ts_proj.name
-            else:
-                ts_proj_name = 'Unknown'
+            ts_proj_name = projectName(timeSlot.getProject())
             ts_act = timeSlot.getActivity()
             if ts_act:
                 ts_act_name = ts_act.value
@@ -250,12 +424,197 @@ class TimeCardCLI:
             print("%s - %s: %.2f\t%s.%s" % (startTime.strftime(timeFmt), endTime.strftime(
                 timeFmt), hours, ts_proj_name, ts_act_name))
 
+def parseDate(value: str) -> dt.date:
+    try:
+        return dt.datetime.strptime(value, "%Y.%m.%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not YYYY.MM.DD')
+
+
+def exportCmd(args: argparse.Namespace, config: Config):
+    from timecard import export
+
+    start = dt.datetime.combine(args.start, dt.time.min) if args.start else None
+    end = dt.datetime.combine(args.end + dt.timedelta(days=1), dt.time.min) if args.end else None
+    count = export.export(export.backendRecords(config, start, end), args.format,
+                          path=Path(args.output) if args.output else None,
+                          compression=args.compress, start=start, end=end)
+    print(f'Exported {count} timeslots', file=sys.stderr)
+
+
+def migrateCmd(args: argparse.Namespace):
+    from timecard import migrate
+
+    source = Path(args.source)
+    if args.to != 'firebase' and not args.output:
+        raise SystemExit(f'timecard migrate: --output is required for the {args.to} target')
+    statePath = Path(args.state) if args.state else Path(args.source + '.migrate')
+    if args.restart and statePath.is_file():
+        statePath.unlink()
+
+    def report(status: 'migrate.MigrationStatus'):
+        print('%d records (%d projects, %d timeslots), %.0f records/s' % (
+            status.records, status.projects, status.timeslots, status.rate), file=sys.stderr)
+
+    target = migrate.openTarget(args.to, Path(args.output) if args.output else None)
+    try:
+        migration = migrate.Migration(source, target, args.to, statePath, batchSize=args.batch, report=report,
+                                      flushTimeout=args.flush_timeout)
+        status = migration.run()
+    except RuntimeError as e:
+        raise SystemExit(f'timecard migrate: {e}') from e
+    finally:
+        target.close()
+    if status.resumed:
+        print('Resumed after %d records' % status.resumed, file=sys.stderr)
+    print('Migrated %d projects and %d timeslots in %.2f s (%.0f records/s)' % (
+        status.projects, status.timeslots, status.seconds, status.rate), file=sys.stderr)
+
+
+def labReportCmd(args: argparse.Namespace, config: Config):
+    from timecard.firebase import FirebaseClient, Timecard as FirebaseTimecard
+    from timecard.lab_report import LabReport
+
+    today = dt.date.today().isocalendar()
+    year = args.year if args.year is not None else today[0]
+    weekNum = args.week if args.week is not None else today[1]
+    cacheDir = Path(args.cache) if args.cache else \
+        Path(appdirs.user_cache_dir(appname=timecard.__appname__), 'lab')
+    client = FirebaseClient(FirebaseTimecard.config, sessionPath=cacheDir.joinpath(FirebaseTimecard.SESSION_FILE),
+                            maxConnections=args.concurrency)
+    try:
+        if client.tokens.load(config.email) is None:
+            client.run(client.tokens.signIn(config.email, config.password))
+        report = LabReport(client, cacheDir, concurrency=args.concurrency)
+        started = time.perf_counter()
+        results = report.weekTotals(year, weekNum, args.users.split(',') if args.users else None)
+        elapsed = time.perf_counter() - started
+    finally:
+        client.close()
+
+    if args.format == 'json':
+        print(json.dumps({
+            'year': year,
+            'week': weekNum,
+            'users': [{'localId': result.localId,
+                       'error': result.error,
+                       'totals': [{'project': project, 'activity': activity.value,
+                                   'hours': round(total.total_seconds() / 3600, 4)}
+                                  for (project, activity), total in sorted(result.totals.items(),
+                                                                           key=lambda item: item[0][0])]}
+                      for result in results]
+        }, indent=2))
+    elif args.format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(('user', 'project', 'activity', 'hours'))
+        for result in results:
+            for (project, activity), total in sorted(result.totals.items(), key=lambda item: item[0][0]):
+                writer.writerow((result.localId, project, activity.value, round(total.total_seconds() / 3600, 4)))
+    else:
+        print("Lab report for Week %d, %d (%d users)\n" % (weekNum, year, len(results)))
+        for result in sorted(results, key=lambda result: -result.hours):
+            note = " (cached: %s)" % result.error if result.error else ""
+            print("%s: %.2f%s" % (result.localId, result.hours, note))
+        print("\nProjects:")
+        lab = LabReport.merge(results)
+        projects: Dict[str, float] = {}
+        for (project, activity), total in lab.items():
+            projects[project] = projects.get(project, 0) + total.total_seconds() / 3600
+        for project, hours in sorted(projects.items(), key=lambda item: -item[1]):
+            print("  %s: %.2f" % (project, hours))
+        print("\nTotal: %.2f" % sum(projects.values()))
+    print('Fetched %d users in %.2f s' % (len(results), elapsed), file=sys.stderr)
+
+
+def batchReportCmd(args: argparse.Namespace):
+    from timecard import batch_report
+
+    directory = Path(args.directory)
+    paths = sorted(directory.glob(args.pattern))
+    if not paths:
+        raise SystemExit(f'timecard batch-report: no {args.pattern} files in {directory}')
+    since = int(dt.datetime.combine(args.start, dt.time.min).timestamp()) if args.start else None
+    until = int(dt.datetime.combine(args.end + dt.timedelta(days=1), dt.time.min).timestamp()) if args.end else None
+    started = time.perf_counter()
+    summaries = batch_report.batchReport(paths, workers=args.workers, since=since, until=until)
+    elapsed = time.perf_counter() - started
+    writer = batch_report.writeJson if args.format == 'json' else batch_report.writeCsv
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer(summaries, f)
+    else:
+        writer(summaries, sys.stdout)
+    for summary in summaries:
+        if summary.error:
+            print('%s: %s' % (summary.path, summary.error), file=sys.stderr)
+    print('Summarized %d files (%d timeslots) in %.2f s' % (
+        len(summaries), sum(summary.slots for summary in summaries), elapsed), file=sys.stderr)
+
+
 def main():
+    parser = argparse.ArgumentParser(prog='timecard', description='E4E Timecard Application')
+    parser.add_argument('--profile', nargs='?', const='', metavar='DIR',
+                        help='profile every command, writing pstats and allocation reports to DIR '
+                             '(default: a profiles directory next to the log)')
+    commands = parser.add_subparsers(dest='command')
+    exportParser = commands.add_parser('export', help='stream timeslots as CSV or JSON Lines')
+    exportParser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    exportParser.add_argument('--from', dest='start', type=parseDate, metavar='DATE',
+                              help='first day to export, YYYY.MM.DD')
+    exportParser.add_argument('--to', dest='end', type=parseDate, metavar='DATE',
+                              help='last day to export (inclusive), YYYY.MM.DD')
+    exportParser.add_argument('--output', '-o', metavar='FILE',
+                              help='write to FILE instead of stdout; .gz, .bz2 and .xz are compressed')
+    exportParser.add_argument('--compress', choices=('gzip', 'bz2', 'xz'),
+                              help='compression, overriding the one implied by FILE')
+    migrateParser = commands.add_parser('migrate', help='copy a legacy XML timecard into another backend')
+    migrateParser.add_argument('source', metavar='SOURCE', help='legacy xml_data file')
+    migrateParser.add_argument('--to', choices=('xml', 'sqlite', 'mmap', 'firebase'), required=True)
+    migrateParser.add_argument('--output', '-o', metavar='FILE', help='target file for the xml, sqlite and mmap targets')
+    migrateParser.add_argument('--batch', type=int, default=5000, help='records per committed batch')
+    migrateParser.add_argument('--state', metavar='FILE',
+                               help='resume state (default: SOURCE.migrate)')
+    migrateParser.add_argument('--restart', action='store_true', help='ignore saved progress')
+    migrateParser.add_argument('--flush-timeout', type=float, default=600.0, metavar='SECONDS',
+                               help='how long to wait for queued firebase writes')
+    labParser = commands.add_parser('labreport', help='weekly hours across all users (needs read access to them)')
+    labParser.add_argument('--week', type=int, help='ISO week number (default: this week)')
+    labParser.add_argument('--year', type=int, help='ISO year (default: this year)')
+    labParser.add_argument('--users', metavar='IDS', help='comma separated user IDs (default: every user)')
+    labParser.add_argument('--concurrency', type=int, default=8, help='users fetched at once')
+    labParser.add_argument('--format', choices=('text', 'csv', 'json'), default='text')
+    labParser.add_argument('--cache', metavar='DIR', help='per-user snapshot directory')
+    batchParser = commands.add_parser('batch-report', help='summarize a directory of XML timecards in parallel')
+    batchParser.add_argument('directory', metavar='DIR')
+    batchParser.add_argument('--pattern', default='*.xml', help='file glob inside DIR (default: *.xml)')
+    batchParser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    batchParser.add_argument('--from', dest='start', type=parseDate, metavar='DATE',
+                             help='first day to include, YYYY.MM.DD')
+    batchParser.add_argument('--to', dest='end', type=parseDate, metavar='DATE',
+                             help='last day to include (inclusive), YYYY.MM.DD')
+    batchParser.add_argument('--format', choices=('csv', 'json'), default='csv')
+    batchParser.add_argument('--output', '-o', metavar='FILE', help='write to FILE instead of stdout')
+    args = parser.parse_args()
+
     configPath = Path(appdirs.user_config_dir(timecard.__appname__), 'config.yaml')
+    if args.command == 'export':
+        exportCmd(args, Config.instance(configPath=configPath))
+        return
+    if args.command == 'labreport':
+        labReportCmd(args, Config.instance(configPath=configPath))
+        return
+    if args.command == 'batch-report':
+        batchReportCmd(args)
+        return
+    if args.command == 'migrate':
+        if args.to == 'firebase':
+            Config.instance(configPath=configPath)
+        migrateCmd(args)
+        return
     print(f'Config path is {configPath}')
     config = Config.instance(configPath=configPath)
-    tc = TimeCardCLI()
-
+    tc = TimeCardCLI(profile=args.profile is not None,
+                     profileDir=Path(args.profile) if args.profile else None)
 
 if __name__ == '__main__':
     main()
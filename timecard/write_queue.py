@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+@dataclass
+class WriteQueueStatus:
+    depth: int
+    inFlight: int
+    flushes: int
+    failures: int
+    lastFlush: Optional[float]
+    lastError: Optional[str]
+    rejected: int = 0
+    lastRejection: Optional[str] = None
+
+
+class WriteQueue:
+    """Batches path -> value writes into multi-path updates sent in the background.
+
+    Writes to the same path coalesce, so only the newest value is sent.  A
+    failed batch is put back under any newer writes and retried with
+    exponential backoff and jitter.  ``close()`` waits (up to an optional
+    timeout) until everything has been sent and returns whether it was; a
+    send that fails once closing has begun is not retried, so callers must
+    keep unsent writes themselves.  ``onDrained`` is called each time a
+    successful send leaves nothing pending.
+
+    Errors for which ``permanent`` returns True are not retried: the batch is
+    split until the rejected writes are isolated, and those are dropped and
+    counted in ``status()`` instead of blocking the writes behind them.
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], None],
+                 flushDelay: float = 0.2,
+                 maxBatch: int = 1000,
+                 minBackoff: float = 0.5,
+                 maxBackoff: float = 60.0,
+                 onDrained: Optional[Callable[[], None]] = None,
+                 permanent: Optional[Callable[[Exception], bool]] = None):
+        self._send = send
+        self._onDrained = onDrained
+        self._permanent = permanent or (lambda e: False)
+        self._flushDelay = flushDelay
+        self._maxBatch = maxBatch
+        self._minBackoff = minBackoff
+        self._maxBackoff = maxBackoff
+
+        self._pending: Dict[str, Any] = {}
+        self._inFlight = 0
+        self._cond = threading.Condition()
+        self._closing = False
+        self._retryNow = False
+        self._flushes = 0
+        self._failures = 0
+        self._lastFlush: Optional[float] = None
+        self._lastError: Optional[str] = None
+        self._rejected = 0
+        self._lastRejection: Optional[str] = None
+
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    def put(self, path: str, value: Any) -> None:
+        self.putMany({path: value})
+
+    def putMany(self, values: Dict[str, Any]) -> None:
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("Write queue is closed")
+            self._pending.update(values)
+            self._cond.notify_all()
+
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending) + self._inFlight
+
+    def status(self) -> WriteQueueStatus:
+        with self._cond:
+            return WriteQueueStatus(
+                depth=len(self._pending) + self._inFlight,
+                inFlight=self._inFlight,
+                flushes=self._flushes,
+                failures=self._failures,
+                lastFlush=self._lastFlush,
+                lastError=self._lastError,
+                rejected=self._rejected,
+                lastRejection=self._lastRejection)
+
+    def retryNow(self) -> None:
+        """Cut short a backoff wait, e.g. once the network is back."""
+        with self._cond:
+            self._retryNow = True
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and not self._inFlight, timeout)
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            return not self._thread.is_alive() and not self._pending
+
+    def __takeBatch(self) -> Dict[str, Any]:
+        if len(self._pending) <= self._maxBatch:
+            batch = self._pending
+            self._pending = {}
+        else:
+            keys = list(self._pending)[:self._maxBatch]
+            batch = {key: self._pending.pop(key) for key in keys}
+        self._inFlight = len(batch)
+        return batch
+
+    def __sendBatch(self, batch: Dict[str, Any]) -> Tuple[int, Optional[Exception]]:
+        """Count of writes rejected permanently and the last rejection; other errors raise."""
+        try:
+            self._send(batch)
+        except Exception as e:
+            if not self._permanent(e):
+                raise
+            if len(batch) == 1:
+                return 1, e
+            # Halve the batch so one bad path does not take the rest with it.
+            # A transient error part way resends the whole batch, which is
+            # harmless for path updates.
+            paths = list(batch)
+            middle = len(paths) // 2
+            rejected, rejection = self.__sendBatch({path: batch[path] for path in paths[:middle]})
+            moreRejected, moreRejection = self.__sendBatch({path: batch[path] for path in paths[middle:]})
+            return rejected + moreRejected, moreRejection or rejection
+        return 0, None
+
+    def __run(self) -> None:
+        backoff = self._minBackoff
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closing)
+                if not self._pending and self._closing:
+                    return
+            if not self._closing:
+                # Give bursts (e.g. backfilling a day) a moment to coalesce.
+                time.sleep(self._flushDelay)
+            with self._cond:
+                batch = self.__takeBatch()
+            try:
+                rejected, rejection = self.__sendBatch(batch)
+            except Exception as e:
+                with self._cond:
+                    batch.update(self._pending)
+                    self._pending = batch
+                    self._inFlight = 0
+                    self._failures += 1
+                    self._lastError = repr(e)
+                    self._cond.notify_all()
+                    if self._closing:
+                        return
+                    # close() cuts the wait short for one last attempt.
+                    woken = self._cond.wait_for(lambda: self._retryNow or self._closing,
+                                                backoff * (0.5 + random.random() / 2))
+                    self._retryNow = False
+                backoff = self._minBackoff if woken else min(backoff * 2, self._maxBackoff)
+                continue
+            with self._cond:
+                self._inFlight = 0
+                self._flushes += 1
+                self._lastFlush = time.time()
+                self._lastError = None
+                if rejection is not None:
+                    self._rejected += rejected
+                    self._lastRejection = repr(rejection)
+                drained = not self._pending
+                self._cond.notify_all()
+            backoff = self._minBackoff
+            if drained and self._onDrained is not None:
+                self._onDrained()
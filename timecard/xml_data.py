@@ -3,9 +3,13 @@ import enum
 import os
 import uuid
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 from xml.dom import minidom
 
+from timecard.audit import Finding, checkOverlap, sweep
+from timecard.index import TimeslotIndex
+from timecard.rollup import Rollup
+
 
 class Activity(enum.Enum):
     Development = "DEV"
@@ -144,7 +148,9 @@ class Timeslot:
         return retval
 
     @classmethod
-    def fromDict(cls, data: dict, projects: set):
+    def fromDict(cls, data: dict, projects: Union[Dict[str, Project], Iterable[Project]]):
+        """``projects`` is either a name -> project table or any iterable of
+        projects; pass the table when loading many slots."""
         assert("startTime" in data)
         assert("endTime" in data)
         assert("code" in data)
@@ -153,9 +159,10 @@ class Timeslot:
         if "msg" not in data:
             data['msg'] = ""
 
+        if not isinstance(projects, dict):
+            projects = {project.getName(): project for project in projects}
         projectCode = data['code'].split('.')[0]
-        project = next(
-            project for project in projects if project.getName() == projectCode)
+        project = projects[projectCode]
         activity = Activity(data['code'].split('.')[1])
 
         return cls(
@@ -178,6 +185,8 @@ class Timecard:
         self._filename: str = filename
         self._activeSlot: Optional[Timeslot] = None
         self._timeslots: List[Timeslot] = []
+        self._index: TimeslotIndex[Timeslot] = TimeslotIndex()
+        self._rollup = Rollup()
         self.__dirty = True
 
         self.__enter__()
@@ -211,23 +220,67 @@ class Timecard:
                         self._projects.add(Project.fromDict(child.attrib))
 
             if timeslotsLeaf:
+                projectsByName = {project.getName(): project for project in self._projects}
                 for child in timeslotsLeaf:
                     if child.tag == self.TIMESLOT_TAG:
                         # child.attrib.pop('key')
                         self._timeslots.append(Timeslot.fromDict(
-                            child.attrib, self._projects))
+                            child.attrib, projectsByName))
+            self._index.rebuild(self._timeslots)
+            self._rollup.rebuild(self._timeslots)
 
             self.__dirty = False
             return self
         else:
             self._projects = set()
             self._timeslots = []
+            self._index.rebuild(self._timeslots)
+            self._rollup.rebuild(self._timeslots)
             self.__dirty = False
             return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.flush()
 
+    @classmethod
+    def readRecords(cls, filename: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream a legacy file as current-format ``toDict`` records.
+
+        Slot codes (``NAME.ACTIVITY``) are resolved against a name -> UUID
+        table built from the projects section, which precedes the slots.
+        Unfinished or unresolvable slots are skipped.
+        """
+        projectIds: Dict[str, str] = {}
+        section = None
+        for event, elem in ET.iterparse(filename, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in (cls.PROJECTS_TAG, cls.TIMESLOTS_TAG):
+                    section = elem
+                continue
+            if elem.tag == cls.PROJECT_TAG:
+                project = Project.fromDict(dict(elem.attrib))
+                data = project.toDict()
+                projectIds[project.getName()] = data['uuid']
+                yield cls.PROJECT_TAG, data
+            elif elem.tag == cls.TIMESLOT_TAG:
+                attrib = elem.attrib
+                code = attrib.get('code') or ''
+                name, _, activity = code.partition('.')
+                endTime = attrib.get('endTime')
+                if name in projectIds and activity and endTime not in (None, '', 'None'):
+                    yield cls.TIMESLOT_TAG, {
+                        'startTime': int(float(attrib['startTime'])),
+                        'endTime': int(float(endTime)),
+                        'project': projectIds[name],
+                        'uuid': attrib['uuid'],
+                        'msg': attrib.get('msg', ''),
+                        'activity': Activity(activity).value
+                    }
+            else:
+                continue
+            if section is not None:
+                section.clear()
+
     def flush(self):
         tree = ET.Element('root')
         projectsLeaf = ET.SubElement(tree, self.PROJECTS_TAG)
@@ -267,7 +320,8 @@ class Timecard:
         self._activeSlot = Timeslot(startTime=startTime)
         self.__dirty = True
 
-    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg: str = ""):
+    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg: str = "",
+             allowOverlap: bool = False):
         if project not in self._projects:
             raise RuntimeError("Project not registered")
         if self._activeSlot is None:
@@ -275,7 +329,10 @@ class Timecard:
         self._activeSlot.setProject(project, activity)
         self._activeSlot.setEndTime(endTime=endTime)
         self._activeSlot.setMsg(msg)
+        checkOverlap(self._index, self._activeSlot, allowOverlap)
         self._timeslots.append(self._activeSlot)
+        self._index.insert(self._activeSlot)
+        self._rollup.add(self._activeSlot)
         self._activeSlot = None
         self.__dirty = True
         self.flush()
@@ -283,58 +340,49 @@ class Timecard:
     def getDayTotals(self, date: dt.date = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
         if date is None:
             date = dt.date.today()
+        return self._rollup.day(date)
 
-        timeslots = self.getDayEntries(date)
-        report: Dict[Tuple[Project, Activity], dt.timedelta] = {}
-        for ts in timeslots:
-            ts_project = ts.getProject()
-            ts_activity = ts.getActivity()
-            if not ts_project or not ts_activity:
-                continue
-            if (ts_project, ts_activity) in report:
-                report[(ts_project, ts_activity)
-                       ] += ts.getTotalTime()
-            else:
-                report[(ts_project, ts_activity)] = ts.getTotalTime()
-        return report
-
-    def getWeekTotals(self, weekNum: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+    def getWeekTotals(self, weekNum: int = None, year: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
         if weekNum is None:
             weekNum = dt.date.today().isocalendar()[1]
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        return self._rollup.week(year, weekNum)
 
-        timeslots = self.getWeekEntries(weekNum)
-        report: Dict[Tuple[Project, Activity], dt.timedelta] = {}
-        for ts in timeslots:
-            ts_project = ts.getProject()
-            ts_activity = ts.getActivity()
-            if not ts_project or not ts_activity:
-                continue
-            if (ts_project, ts_activity) in report:
-                report[(ts_project, ts_activity)
-                       ] += ts.getTotalTime()
-            else:
-                report[(ts_project, ts_activity)] = ts.getTotalTime()
-        return report
+    def getRangeTotals(self, start: dt.datetime, end: dt.datetime) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        return self._rollup.range(start, end)
+
+    def verifyRollup(self, repair: bool = False) -> bool:
+        mismatches = self._rollup.verify(self._timeslots)
+        if mismatches and repair:
+            self._rollup.rebuild(self._timeslots)
+        return not mismatches
 
     def getDayEntries(self, date: dt.date = None) -> List[Timeslot]:
         if date is None:
             date = dt.date.today()
-        timeslots = [
-            ts for ts in self._timeslots if ts.getStartTime().date() == date]
-        return timeslots
+        return self._index.day(date)
 
-    def getWeekEntries(self, weekNum: int = None) -> List[Timeslot]:
+    def getWeekEntries(self, weekNum: int = None, year: int = None) -> List[Timeslot]:
         if weekNum is None:
             weekNum = dt.date.today().isocalendar()[1]
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        return self._index.week(year, weekNum)
+
+    def getRangeEntries(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        return self._index.range(start, end)
 
-        timeslots = [ts for ts in self._timeslots if ts.getStartTime().date().isocalendar()[
-            1] == weekNum]
-        return timeslots
+    def audit(self, minGap: dt.timedelta = None) -> List[Finding]:
+        return sweep(self._index, minGap, presorted=True)
 
     def getProjects(self) -> Dict[str, Project]:
         return {project.getName(): project for project in self._projects}
 
     def getLastEntry(self) -> Timeslot:
-        return self._timeslots[-1]
+        lastEntry = self._index.last()
+        if lastEntry is None:
+            raise RuntimeError("No timeslots recorded")
+        return lastEntry
 
     
\ No newline at end of file
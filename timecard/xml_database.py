@@ -1,10 +1,19 @@
 import datetime as dt
+import itertools
 import os
 import xml.etree.ElementTree as ET
-from typing import List, Optional, Set, Dict, Tuple
-from xml.dom import minidom
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional, Set, Dict, TextIO, Tuple, Union
 
+from timecard.audit import Finding, checkOverlap, sweep
+from timecard.columnar import ColumnarRollup, ColumnarStore
 from timecard.data import Activity, Project, Timeslot
+from timecard.index import TimeslotIndex
+from timecard.journal import Journal, replaceAtomically
+from timecard.metrics import Metrics
+from timecard.rollup import Rollup
+from timecard.serializable import ObjectRegistry, Reference
+from timecard.snapshot import Snapshot
 
 
 class Timecard:
@@ -13,11 +22,27 @@ class Timecard:
     TIMESLOTS_TAG = "timeslots"
     TIMESLOT_TAG = "timeslot"
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, fsyncEvery: int = 1, checkpointBytes: int = 1 << 20,
+                 since: Optional[dt.datetime] = None, until: Optional[dt.datetime] = None,
+                 columnar: bool = False):
         self._projects: Set[Project] = set()
+        self._registry = ObjectRegistry()
         self._filename: str = filename
         self._activeSlot: Optional[Timeslot] = None
         self._timeslots: List[Timeslot] = []
+        if columnar:
+            store = ColumnarStore()
+            self._index: Union[TimeslotIndex[Timeslot], ColumnarStore] = store
+            self._rollup: Union[Rollup, ColumnarRollup] = store.rollup()
+        else:
+            self._index = TimeslotIndex()
+            self._rollup = Rollup()
+        self._journal = Journal(self.journalPath(filename), fsyncEvery=fsyncEvery)
+        self._checkpointBytes = checkpointBytes
+        # Only slots starting in [since, until) are materialized; flush()
+        # streams the rest straight from the existing file.
+        self._since: Optional[int] = int(since.timestamp()) if since else None
+        self._until: Optional[int] = int(until.timestamp()) if until else None
         self.__dirty = True
 
         self.__enter__()
@@ -37,57 +62,186 @@ class Timecard:
 
         # self.__dirty = False
         # return self
-        if os.path.isfile(self._filename):
-            tree = ET.parse(self._filename)
-            root = tree.getroot()
-            projectsLeaf = root.find(self.PROJECTS_TAG)
-            timeslotsLeaf = root.find(self.TIMESLOTS_TAG)
-            self._projects = set()
-            self._timeslots = []
-            if projectsLeaf:
-                for child in projectsLeaf:
-                    if child.tag == self.PROJECT_TAG:
-                        # child.attrib.pop('key')
-                        self._projects.add(Project.fromDict(child.attrib))
-
-            if timeslotsLeaf:
-                for child in timeslotsLeaf:
-                    if child.tag == self.TIMESLOT_TAG:
-                        # child.attrib.pop('key')
-                        self._timeslots.append(Timeslot.fromDict(
-                            child.attrib, self._projects))
-
-            self.__dirty = False
-            return self
-        else:
-            self._projects = set()
-            self._timeslots = []
-            self.__dirty = False
-            return self
+        self._projects = set()
+        self._timeslots = []
+        snapshot = Snapshot.load(self.snapshotPath(self._filename), Path(self._filename))
+        if snapshot is not None:
+            projects, timeslots = snapshot
+            self._projects = set(projects)
+            if self.windowed:
+                timeslots = [ts for ts in timeslots if self._inWindow(ts.getStartEpoch())]
+            self._timeslots = timeslots
+        elif os.path.isfile(self._filename):
+            Metrics.instance().count('bytesRead', os.path.getsize(self._filename))
+            # Our own file: skip per-record validation.
+            self._timeslots = Timeslot.fromDicts(self.__timeslotRecords(), trusted=True)
+        self.__replayJournal()
+
+        self._registry = ObjectRegistry()
+        self._registry.addMany(self._projects)
+        self._registry.resolve(self._timeslots)
+        self._index.rebuild(self._timeslots)
+        if not isinstance(self._rollup, ColumnarRollup):
+            self._rollup.rebuild(self._timeslots)
+        self._journal.open()
+        self.__dirty = False
+        return self
+
+    @classmethod
+    def _iterRecords(cls, filename: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+        # Each record is dropped from its section as soon as it is consumed,
+        # so the parse never holds more than one element in memory.
+        section = None
+        for event, elem in ET.iterparse(filename, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in (cls.PROJECTS_TAG, cls.TIMESLOTS_TAG):
+                    section = elem
+            elif elem.tag in (cls.PROJECT_TAG, cls.TIMESLOT_TAG):
+                yield elem.tag, dict(elem.attrib)
+                if section is not None:
+                    section.clear()
+
+    def __timeslotRecords(self) -> Iterator[Dict[str, Any]]:
+        for tag, attrib in self._iterRecords(self._filename):
+            if tag == self.PROJECT_TAG:
+                self._projects.add(Project.fromDict(attrib))
+            else:
+                data = self._fromAttrib(attrib)
+                if self._inWindow(data['startTime']):
+                    yield data
+
+    @classmethod
+    def readRecords(cls, filename: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream a timecard file and its journal as ``toDict`` records
+        without opening it for writing.
+
+        As in ``__replayJournal``, journal records whose UUID the file
+        already holds (left by a crash between a checkpoint's rename and the
+        journal reset) are skipped.  The UUIDs are only collected when there
+        is a journal to check.
+        """
+        journalPath = cls.journalPath(filename)
+        seen: Optional[Set[Tuple[str, str]]] = None
+        if journalPath.is_file() and journalPath.stat().st_size > 0:
+            seen = set()
+        if os.path.isfile(filename):
+            for tag, attrib in cls._iterRecords(filename):
+                if seen is not None:
+                    seen.add((tag, attrib.get('uuid', '')))
+                if tag == cls.TIMESLOT_TAG:
+                    yield tag, cls._fromAttrib(attrib)
+                else:
+                    yield tag, attrib
+        if seen is None:
+            return
+        for tag, data in Journal(journalPath).replay():
+            key = (tag, str(data.get('uuid', '')))
+            if key not in seen:
+                seen.add(key)
+                yield tag, data
+
+    @staticmethod
+    def journalPath(filename: str) -> Path:
+        return Path(filename + '.journal')
+
+    @staticmethod
+    def snapshotPath(filename: str) -> Path:
+        return Path(filename + '.snap')
+
+    def _inWindow(self, startTime: int) -> bool:
+        if self._since is not None and startTime < self._since:
+            return False
+        if self._until is not None and startTime >= self._until:
+            return False
+        return True
+
+    @property
+    def windowed(self) -> bool:
+        return self._since is not None or self._until is not None
+
+    def __replayJournal(self):
+        # A crash between a checkpoint's rename and the journal reset leaves
+        # records that are already in the main file, so skip known UUIDs.
+        records = self._journal.replay()
+        first = next(records, None)
+        if first is None:
+            return
+        projectIds = {project.uid for project in self._projects}
+        timeslotIds = {timeslot.uid for timeslot in self._timeslots}
+        for kind, data in itertools.chain([first], records):
+            if kind == self.PROJECT_TAG:
+                project = Project.fromDict(data)
+                if project.uid not in projectIds:
+                    projectIds.add(project.uid)
+                    self._projects.add(project)
+            elif kind == self.TIMESLOT_TAG:
+                timeslot = Timeslot.fromDict(data)
+                if timeslot.uid not in timeslotIds:
+                    timeslotIds.add(timeslot.uid)
+                    self._timeslots.append(timeslot)
+
+    @staticmethod
+    def _toAttrib(data: Dict[str, Any]) -> Dict[str, str]:
+        return {key: str(value) for key, value in data.items() if value is not None}
+
+    @staticmethod
+    def _fromAttrib(attrib: Dict[str, str]) -> Dict[str, Any]:
+        data: Dict[str, Any] = dict(attrib)
+        for key in ('startTime', 'endTime'):
+            if key in data:
+                data[key] = int(float(data[key]))
+        if 'msg' not in data:
+            data['msg'] = ''
+        return data
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.flush()
+        self._journal.close()
 
     def flush(self):
-        tree = ET.Element('root')
-        projectsLeaf = ET.SubElement(tree, self.PROJECTS_TAG)
-        timeslotsLeaf = ET.SubElement(tree, self.TIMESLOTS_TAG)
-        for project in self._projects:
-            ET.SubElement(projectsLeaf, self.PROJECT_TAG,
-                          attrib=project.toDict())
-        for timeslot in self._timeslots:
-            ET.SubElement(timeslotsLeaf, self.TIMESLOT_TAG,
-                          attrib=timeslot.toDict())
-
-        roughString = ET.tostring(tree, 'utf-8')
-        reparsed = minidom.parseString(roughString)
-        with open(self._filename, 'w') as f:
-            f.write(reparsed.toprettyxml(indent="  "))
+        tmpPath = Path(self._filename + '.tmp')
+        timeslots: Iterable[Dict[str, Any]] = (timeslot.toDict() for timeslot in self._timeslots)
+        if self.windowed and os.path.isfile(self._filename):
+            timeslots = itertools.chain(self.__unloadedTimeslots(), timeslots)
+        with open(tmpPath, 'w') as f:
+            with Metrics.instance().timer('phases', 'serialize'):
+                self._writeXml(f,
+                               (project.toDict() for project in self._projects),
+                               timeslots)
+            f.flush()
+            os.fsync(f.fileno())
+            Metrics.instance().count('bytesWritten', f.tell())
+        replaceAtomically(tmpPath, Path(self._filename))
+        if not self.windowed:
+            # Matches the file just written, so the next open can skip the XML.
+            with Metrics.instance().timer('phases', 'snapshot'):
+                Snapshot.write(self.snapshotPath(self._filename), Path(self._filename),
+                               self._projects, self._timeslots)
+        if self._journal.size() > 0:
+            self._journal.reset()
         self.__dirty = False
-        # cred_obj = firebase_admin.credentials.Certificate('e4e-timecard-firebase-adminsdk-2tx0f-6d6696558b.json')
-        # default_app = firebase_admin.initialize_app(cred_obj, {
-        # 'databaseURL':'https://e4e-timecard-default-rtdb.firebaseio.com/'
-        # })
+
+    def __unloadedTimeslots(self) -> Iterator[Dict[str, str]]:
+        loadedIds = {timeslot.uid.hex for timeslot in self._timeslots}
+        for tag, attrib in self._iterRecords(self._filename):
+            if tag == self.TIMESLOT_TAG and attrib['uuid'] not in loadedIds:
+                yield attrib
+
+    @classmethod
+    def _writeXml(cls, f: TextIO, projects: Iterable[Dict[str, Any]], timeslots: Iterable[Dict[str, Any]]):
+        f.write('<?xml version="1.0" ?>\n<root>\n')
+        for sectionTag, tag, records in ((cls.PROJECTS_TAG, cls.PROJECT_TAG, projects),
+                                         (cls.TIMESLOTS_TAG, cls.TIMESLOT_TAG, timeslots)):
+            f.write('  <%s>\n' % sectionTag)
+            for record in records:
+                element = ET.Element(tag, attrib=cls._toAttrib(record))
+                f.write('    %s\n' % ET.tostring(element, encoding='unicode'))
+            f.write('  </%s>\n' % sectionTag)
+        f.write('</root>\n')
+
+    def __checkpointIfLarge(self):
+        if self._journal.size() >= self._checkpointBytes:
+            self.flush()
 
     def close(self):
         self.__exit__(None, None, None)
@@ -99,7 +253,49 @@ class Timecard:
         for existingProject in self._projects:
             assert(str(project) != str(existingProject))
         self._projects.add(project)
+        self._rollup.addProject(project)
+        self._registry.add(project)
+        self._journal.append(self.PROJECT_TAG, project.toDict())
         self.__dirty = True
+        self.__checkpointIfLarge()
+
+    def importRecords(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> Tuple[int, int]:
+        """Add ``(tag, toDict())`` records, skipping UUIDs already present.
+
+        The batch is journaled with a single fsync.  Returns the number of
+        projects and timeslots read.
+        """
+        projectRecords: List[Dict[str, Any]] = []
+        timeslotRecords: List[Dict[str, Any]] = []
+        for tag, data in records:
+            if tag == self.PROJECT_TAG:
+                projectRecords.append(data)
+            elif tag == self.TIMESLOT_TAG:
+                timeslotRecords.append(data)
+        journaled: List[Tuple[str, Dict[str, Any]]] = []
+        for project in Project.fromDicts(projectRecords):
+            if self._registry.get(Project, project.uid) is None:
+                self._projects.add(project)
+                self._rollup.addProject(project)
+                self._registry.add(project)
+                journaled.append((self.PROJECT_TAG, project.toDict()))
+        added: List[Timeslot] = []
+        timeslotIds = {timeslot.uid for timeslot in self._timeslots}
+        for timeslot in Timeslot.fromDicts(timeslotRecords):
+            if timeslot.uid not in timeslotIds:
+                timeslotIds.add(timeslot.uid)
+                added.append(timeslot)
+                journaled.append((self.TIMESLOT_TAG, timeslot.toDict()))
+        self._registry.resolve(added)
+        self._timeslots.extend(added)
+        for timeslot in added:
+            self._index.insert(timeslot)
+            self._rollup.add(timeslot)
+        if journaled:
+            self._journal.appendMany(journaled)
+            self.__dirty = True
+            self.__checkpointIfLarge()
+        return len(projectRecords), len(timeslotRecords)
 
     def start(self, startTime: dt.datetime = None):
         if self._activeSlot is not None:
@@ -107,7 +303,8 @@ class Timecard:
         self._activeSlot = Timeslot(startTime=startTime)
         self.__dirty = True
 
-    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg: str = ""):
+    def stop(self, project: Project, activity: Activity, endTime: dt.datetime = None, msg: str = "",
+             allowOverlap: bool = False):
         if project not in self._projects:
             raise RuntimeError("Project not registered")
         if self._activeSlot is None:
@@ -115,65 +312,63 @@ class Timecard:
         self._activeSlot.setProject(project, activity)
         self._activeSlot.setEndTime(endTime=endTime)
         self._activeSlot.setMsg(msg)
+        checkOverlap(self._index, self._activeSlot, allowOverlap)
         self._timeslots.append(self._activeSlot)
+        self._index.insert(self._activeSlot)
+        self._rollup.add(self._activeSlot)
+        self._journal.append(self.TIMESLOT_TAG, self._activeSlot.toDict())
         self._activeSlot = None
         self.__dirty = True
-        self.flush()
+        self.__checkpointIfLarge()
 
     def getDayTotals(self, date: dt.date = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
         if date is None:
             date = dt.date.today()
+        return self._rollup.day(date)
 
-        timeslots = self.getDayEntries(date)
-        report: Dict[Tuple[Project, Activity], dt.timedelta] = {}
-        for ts in timeslots:
-            ts_project = ts.getProject()
-            ts_activity = ts.getActivity()
-            if not ts_project or not ts_activity:
-                continue
-            if (ts_project, ts_activity) in report:
-                report[(ts_project, ts_activity)
-                       ] += ts.getTotalTime()
-            else:
-                report[(ts_project, ts_activity)] = ts.getTotalTime()
-        return report
-
-    def getWeekTotals(self, weekNum: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+    def getWeekTotals(self, weekNum: int = None, year: int = None) -> Dict[Tuple[Project, Activity], dt.timedelta]:
         if weekNum is None:
             weekNum = dt.date.today().isocalendar()[1]
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        return self._rollup.week(year, weekNum)
 
-        timeslots = self.getWeekEntries(weekNum)
-        report: Dict[Tuple[Project, Activity], dt.timedelta] = {}
-        for ts in timeslots:
-            ts_project = ts.getProject()
-            ts_activity = ts.getActivity()
-            if not ts_project or not ts_activity:
-                continue
-            if (ts_project, ts_activity) in report:
-                report[(ts_project, ts_activity)
-                       ] += ts.getTotalTime()
-            else:
-                report[(ts_project, ts_activity)] = ts.getTotalTime()
-        return report
+    def getRangeTotals(self, start: dt.datetime, end: dt.datetime) -> Dict[Tuple[Project, Activity], dt.timedelta]:
+        return self._rollup.range(start, end)
+
+    def verifyRollup(self, repair: bool = False) -> bool:
+        mismatches = self._rollup.verify(self._timeslots)
+        if mismatches and repair:
+            self._rollup.rebuild(self._timeslots)
+        return not mismatches
 
     def getDayEntries(self, date: dt.date = None) -> List[Timeslot]:
         if date is None:
             date = dt.date.today()
-        timeslots = [
-            ts for ts in self._timeslots if ts.getStartTime().date() == date]
-        return timeslots
+        return self._index.day(date)
 
-    def getWeekEntries(self, weekNum: int = None) -> List[Timeslot]:
+    def getWeekEntries(self, weekNum: int = None, year: int = None) -> List[Timeslot]:
         if weekNum is None:
             weekNum = dt.date.today().isocalendar()[1]
+        if year is None:
+            year = dt.date.today().isocalendar()[0]
+        return self._index.week(year, weekNum)
+
+    def getRangeEntries(self, start: dt.datetime, end: dt.datetime) -> List[Timeslot]:
+        return self._index.range(start, end)
+
+    def audit(self, minGap: dt.timedelta = None) -> List[Finding]:
+        return sweep(self._index, minGap, presorted=True)
 
-        timeslots = [ts for ts in self._timeslots if ts.getStartTime().date().isocalendar()[
-            1] == weekNum]
-        return timeslots
+    def danglingReferences(self) -> List[Reference]:
+        return self._registry.dangling()
 
     def getProjects(self) -> Dict[str, Project]:
         return {project.name: project for project in self._projects}
 
     def getLastEntry(self) -> Timeslot:
-        return self._timeslots[-1]
+        lastEntry = self._index.last()
+        if lastEntry is None:
+            raise RuntimeError("No timeslots recorded")
+        return lastEntry
 